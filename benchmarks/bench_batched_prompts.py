@@ -0,0 +1,85 @@
+"""Batched classification prompts: prompt tokens per email and emails per second for K=1 versus K=8.
+
+    python benchmarks/bench_batched_prompts.py [--emails 32] [--batch 1 8] [--prompt-rate 300] [--generation-rate 40]
+
+A stand-in Ollama server takes as long as a CPU-bound model would: prompt tokens / --prompt-rate plus
+answer tokens / --generation-rate seconds, one request at a time. It leaves --drop of the emails out of
+every batched answer, so the cost of the single-email fallback is included. Token counts are the same
+estimate that sizes the batches (about 3 characters a token). The speedup depends on the ratio of the
+two rates, not on how fast they are; the defaults keep the ratio of a small model on CPU but run faster.
+"""
+import sys
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from json import dumps
+from os import path
+from random import Random
+from re import MULTILINE, compile as compile_regex
+from time import perf_counter
+
+import corpus
+# The stand-in server lives with the tests
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from cache.cache import ImportanceLevel
+from e2e import classify_emails
+from llm.ollamallm.llm import LLM
+from mail.emailwrapper import EmailWrapper
+from prompt.prompt import estimate_tokens
+from tests.ollamastandin import ANSWER, StandInOllamaServer
+
+EMAIL_IDS = compile_regex(r"^ID: (\d+)$", flags=MULTILINE)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=32)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--num-ctx", type=int, default=8192)
+    parser.add_argument("--prompt-rate", type=float, default=300.0, help="prompt tokens evaluated per second")
+    parser.add_argument("--generation-rate", type=float, default=40.0, help="answer tokens generated per second")
+    parser.add_argument("--drop", type=float, default=0.05, help="share of emails left out of batched answers")
+    args = parser.parse_args()
+
+    rng = Random(2024)
+    emails = [
+        EmailWrapper(corpus.sentence(rng, 6), corpus.paragraph(rng), f"sender{index}@example.com", "me@example.com", "", f"<{index}@x>", uid=str(index))
+        for index in range(args.emails)
+    ]
+    answer_rng = Random(7)
+
+    def respond(body: dict) -> str:
+        ids = EMAIL_IDS.findall(body["prompt"])
+        if not ids:
+            return ANSWER
+        kept = [email_id for email_id in ids if answer_rng.random() >= args.drop]
+        return dumps([{"id": email_id, "importance": 0.5, "confidence": 0.9, "reasoning": "Stand-in verdict"} for email_id in kept])
+
+    def latency(body: dict) -> float:
+        answer_tokens = 30 * max(1, len(EMAIL_IDS.findall(body["prompt"])))
+        return estimate_tokens(body["prompt"]) / args.prompt_rate + answer_tokens / args.generation_rate
+
+    server = StandInOllamaServer(latency=latency, response=respond, parallel=1)
+    server.start()
+    try:
+        config = ConfigParser()
+        config["OLLAMA"] = {"ollama_base_url": server.url, "num_ctx": str(args.num_ctx), "read_timeout": "3600"}
+        llm = LLM(config)
+        print(f"{args.emails} emails, {args.prompt_rate:.0f} prompt tokens/s, {args.generation_rate:.0f} answer tokens/s, "
+              f"{args.drop:.0%} left out of batched answers")
+        for batch in args.batch:
+            first_request = len(server.requests)
+            started = perf_counter()
+            results = classify_emails(emails, None, llm, max_batch=batch)
+            elapsed = perf_counter() - started
+            prompts = [body["prompt"] for _, body in server.requests[first_request:]]
+            prompt_tokens = sum(estimate_tokens(prompt) for prompt in prompts)
+            print(f"K={batch:<3} {len(prompts):4} prompts  {prompt_tokens / args.emails:6.0f} prompt tokens/email  "
+                  f"{args.emails / elapsed:5.2f} emails/s  {sum(not isinstance(result, ImportanceLevel) for result in results)} unclassified")
+        llm.close()
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Messages per second of the body extraction stage, before and after the single-pass extractor.
+
+    python benchmarks/bench_body_extraction.py [--count 200] [--repeat 3]
+
+before:     the original pipeline. ImapService parsed the message, decoded the first text part as UTF-8 and
+            EmailWrapper ran extract_best_body on that text, which parsed it again and built a new
+            HTML2Text converter per call.
+full parse: BodyExtractor.from_raw, i.e. one parse with charset-aware decoding and the prompt budget cap.
+streaming:  what the services do now. StreamingBodyExtractor decodes only the selected part while
+            reading and BodyExtractor.from_text converts and caps it.
+"""
+from argparse import ArgumentParser
+from email import message_from_bytes, message_from_string
+from time import perf_counter
+import html2text
+
+from corpus import generate_corpus
+from mail.bodyextractor import BodyExtractor
+from mail.streamparser import StreamingBodyExtractor
+
+
+def legacy_html_to_text(html: str) -> str:
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = True
+    converter.bypass_tables = False
+    converter.body_width = 0
+    return converter.handle(html).strip()
+
+
+# Copy of ImapService.__extract_email_body before the change
+def legacy_service_body(msg) -> str:
+    body = ""
+    if msg.is_multipart():
+        for part in msg.walk():
+            if "attachment" in str(part.get("Content-Disposition", "")):
+                continue
+            content_type = part.get_content_type()
+            if content_type == "text/plain":
+                payload = part.get_payload(decode=True)
+                if payload is not None:
+                    body = payload.decode('utf-8', errors='replace')
+                    break
+            elif content_type == "text/html" and not body:
+                payload = part.get_payload(decode=True)
+                if payload is not None:
+                    body = payload.decode('utf-8', errors='replace')
+    else:
+        payload = msg.get_payload(decode=True)
+        if payload is not None:
+            body = payload.decode('utf-8', errors='replace')
+    return body
+
+
+# Copy of mail.utils.extract_best_body before the change
+def legacy_extract_best_body(raw_email: str) -> str:
+    try:
+        if raw_email.lstrip().lower().startswith('<!doctype') or raw_email.lstrip().lower().startswith('<html'):
+            return legacy_html_to_text(raw_email)
+        msg = message_from_string(raw_email)
+        if msg.is_multipart():
+            plain = html = None
+            for part in msg.walk():
+                if part.get_content_disposition() == 'attachment':
+                    continue
+                payload = part.get_payload(decode=True)
+                if not payload:
+                    continue
+                content = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+                if part.get_content_type() == 'text/plain' and not plain:
+                    plain = content
+                elif part.get_content_type() == 'text/html' and not html:
+                    html = content
+            if plain:
+                return plain.strip()
+            if html:
+                return legacy_html_to_text(html)
+        else:
+            payload = msg.get_payload(decode=True)
+            if not payload:
+                return raw_email.strip()
+            content = payload.decode(msg.get_content_charset() or 'utf-8', errors='replace')
+            if msg.get_content_type() == 'text/html':
+                return legacy_html_to_text(content)
+            return content.strip()
+    except Exception:
+        pass
+    return raw_email.strip()
+
+
+def before(raw: bytes) -> str:
+    return legacy_extract_best_body(legacy_service_body(message_from_bytes(raw)))
+
+
+def full_parse(body_extractor: BodyExtractor):
+    return lambda raw: body_extractor.from_raw(raw)
+
+
+def streaming(body_extractor: BodyExtractor, window: int = 64 * 1024):
+    def run(raw: bytes) -> str:
+        extractor = StreamingBodyExtractor()
+        for offset in range(0, len(raw), window):
+            extractor.feed(raw[offset:offset + window])
+            if extractor.done:
+                break
+        _, body = extractor.close()
+        return body_extractor.from_text(body, extractor.content_subtype)
+    return run
+
+
+def measure(extract, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = perf_counter()
+        for raw in corpus:
+            extract(raw)
+        best = min(best, perf_counter() - started)
+    return len(corpus) / best
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.count)
+    body_extractor = BodyExtractor()
+    print(f"{len(corpus)} messages, {sum(map(len, corpus)) / 1024 / 1024:.1f} MiB")
+    baseline = None
+    for name, extract in (("before", before), ("full parse", full_parse(body_extractor)), ("streaming", streaming(body_extractor))):
+        rate = measure(extract, corpus, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:>10}: {rate:8.1f} msg/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cache lookup latency: the old per-lookup CSV scan versus the indexed backends.
+
+    python benchmarks/bench_cache_lookup.py [--entries 1000000] [--lookups 20000]
+
+A cache CSV with --entries rows is generated in a temporary directory, then each backend answers
+--lookups queries (half hits, half misses). The legacy scan is timed on a few queries only.
+"""
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from csv import DictReader, DictWriter
+from datetime import datetime
+from hashlib import sha256
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+
+import corpus  # noqa: F401  (puts mailbot/ on sys.path)
+from cache.backends import FIELDNAMES, CsvLogBackend, ExpiryPolicy, SqliteBackend
+
+
+def write_cache_csv(csv_path: str, entries: int) -> None:
+    time_added = datetime.now().isoformat()
+    with open(csv_path, 'w', newline='') as file:
+        writer = DictWriter(file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for index in range(entries):
+            subject = f"Subject {index}"
+            writer.writerow({
+                'sender': f"sender{index}@example.com",
+                'importance_level': "least_important",
+                'email_subject': subject,
+                'email_subject_hash': sha256(subject.encode()).hexdigest(),
+                'reasoning': "generated",
+                'time_added': time_added,
+            })
+
+
+def legacy_lookup(csv_path: str):
+    # The scan Cache.exists used to do for every email
+    def run(subject_hash: str, sender: str):
+        with open(csv_path, 'r', newline='') as file:
+            for row in DictReader(file):
+                if row['email_subject_hash'] == subject_hash or row['sender'] == sender:
+                    return row
+        return None
+    return run
+
+
+def queries(rng: Random, entries: int, count: int) -> list:
+    result = []
+    for number in range(count):
+        index = rng.randrange(entries) if number % 2 == 0 else entries + number
+        result.append((sha256(f"Subject {index}".encode()).hexdigest(), f"nobody{number}@example.com"))
+    return result
+
+
+def measure(lookup, lookups: list) -> float:
+    started = perf_counter()
+    for subject_hash, sender in lookups:
+        lookup(subject_hash, sender)
+    return (perf_counter() - started) / len(lookups) * 1e6
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--legacy-lookups", type=int, default=4)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        csv_path = path.join(directory, "cache.csv")
+        write_cache_csv(csv_path, args.entries)
+        lookups = queries(Random(9000), args.entries, args.lookups)
+        print(f"{args.entries:,} cache entries, {args.lookups:,} lookups (50% hits)")
+
+        print(f"{'csv scan (legacy)':>18}: {measure(legacy_lookup(csv_path), lookups[:args.legacy_lookups]):12.1f} us/lookup")
+
+        config = ConfigParser()
+        config["CACHE"] = {"max_entries": str(2 * args.entries)}
+        policy = ExpiryPolicy(config)
+        for name, open_backend in (
+            ("csv log + index", lambda: CsvLogBackend(csv_path, policy)),
+            ("sqlite", lambda: SqliteBackend(path.join(directory, "cache.sqlite3"), policy, csv_path)),
+        ):
+            started = perf_counter()
+            backend = open_backend()
+            load_seconds = perf_counter() - started
+            print(f"{name:>18}: {measure(backend.lookup, lookups):12.1f} us/lookup  (load {load_seconds:.1f}s)")
+            backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""html2text versus the streaming HtmlTextConverter on large marketing emails.
+
+    python benchmarks/bench_html_to_text.py [--count 30] [--size-kb 200] [--budget 2000]
+
+html2text converts the whole document and the result is cut to the budget afterwards, which is what
+BodyExtractor does with html_converter = html2text. The streaming converter stops once the budget is
+reached.
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+import html2text
+
+from corpus import marketing_html
+from mail.htmltext import HtmlTextConverter
+
+
+def html2text_convert(budget: int):
+    def run(html: str) -> str:
+        converter = html2text.HTML2Text()
+        converter.ignore_links = False
+        converter.ignore_images = True
+        converter.bypass_tables = False
+        converter.body_width = 0
+        return converter.handle(html).strip()[:budget]
+    return run
+
+
+def measure(convert, documents: list, repeat: int) -> tuple:
+    best = float("inf")
+    output_chars = 0
+    for _ in range(repeat):
+        started = perf_counter()
+        output_chars = sum(len(convert(html)) for html in documents)
+        best = min(best, perf_counter() - started)
+    return len(documents) / best, output_chars / len(documents)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--size-kb", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = Random(9000)
+    documents = [marketing_html(rng, args.size_kb * 1024) for _ in range(args.count)]
+    print(f"{len(documents)} documents of ~{args.size_kb} KiB, budget {args.budget} characters")
+
+    streaming = HtmlTextConverter(args.budget)
+    full = HtmlTextConverter(10 ** 9)
+    baseline = None
+    for name, convert in (
+        ("html2text", html2text_convert(args.budget)),
+        ("streaming (no budget)", full.convert),
+        ("streaming", streaming.convert),
+    ):
+        rate, average_chars = measure(convert, documents, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:>22}: {rate:8.1f} docs/s  ({rate / baseline:6.1f}x)  avg output {average_chars:,.0f} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Near-duplicate index: hit rate and lookup latency for a range of max_distance thresholds.
+
+    python benchmarks/bench_near_duplicates.py [--seen 5000] [--lookups 2000] [--distances 0,2,3,4,6,8,10]
+
+--seen templated emails (shipping notices, receipts, newsletters... from a few hundred domains, with
+their own names, order numbers, dates and items) are recorded first. Then --lookups new emails are
+looked up: half are new copies of the recorded templates, which should hit, and half are unrelated
+emails from the same domains, which should not. A false hit is any hit on an unrelated email, or a
+hit on a copy that returns the verdict of another template.
+"""
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+
+import corpus
+from cache.simhash import NearDuplicateIndex
+from mail.emailwrapper import EmailWrapper
+
+TEMPLATES = (
+    ("Your order #{order} has shipped",
+     "Hi {name}, good news! Your order #{order} placed on {date} has shipped. {item} is on its way. Track your "
+     "package at https://track.{domain}/{order} to see when it arrives. Estimated delivery is within three to five "
+     "business days. Thank you for shopping with us."),
+    ("Receipt for your payment of ${amount}",
+     "Dear {name}, we received your payment of ${amount} on {date} for {item}. Your receipt number is {order}. "
+     "You can download an invoice from your account at https://{domain}/account/orders. Questions about this "
+     "charge? Reply to this email or contact our support team."),
+    ("{name}, your weekly digest is here",
+     "Here is what happened this week, {name}. {item} and more picks selected for you. Members save up to "
+     "{amount}% this weekend only, offer ends {date}. Unsubscribe or manage your preferences at "
+     "https://{domain}/preferences."),
+    ("Reset your password",
+     "Hello {name}, someone asked to reset the password of your account on {date}. If it was you, use the link "
+     "https://{domain}/reset/{order} within 30 minutes. If it was not you, you can ignore this message and your "
+     "password stays the same."),
+    ("Your subscription renews on {date}",
+     "Hi {name}, your {item} subscription renews on {date} and your card ending in {order} will be charged "
+     "${amount}. To change your plan or cancel, visit https://{domain}/billing before then."),
+)
+NAMES = "Ann Bob Carla Dmitri Elif Farah Goran Hana Ivan Jun Kofi Lena Mateo Nora Omar Priya".split()
+ITEMS = (
+    "Wireless headphones", "Blue cotton T-shirt", "Espresso machine", "Running shoes size 42", "Garden hose",
+    "Premium", "Family plan", "Cloud storage 2 TB", "Hardcover cookbook", "Desk lamp"
+)
+
+
+def templated(rng: Random, domain: str, template: int) -> EmailWrapper:
+    subject, body = TEMPLATES[template]
+    fill = {
+        'name': rng.choice(NAMES), 'order': rng.randrange(10 ** 3, 10 ** 9), 'item': rng.choice(ITEMS),
+        'amount': f"{rng.randrange(1, 500)}.{rng.randrange(100):02d}", 'domain': domain,
+        'date': f"{rng.randrange(1, 29)}/{rng.randrange(1, 13)}/2026",
+    }
+    return EmailWrapper(subject.format(**fill), body.format(**fill), f"noreply@{domain}", "me@example.com", "", "")
+
+
+def unrelated(rng: Random, domain: str) -> EmailWrapper:
+    return EmailWrapper(corpus.sentence(rng, 5), corpus.paragraph(rng, 3), f"noreply@{domain}", "me@example.com", "", "")
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seen", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--domains", type=int, default=300)
+    parser.add_argument("--distances", default="0,2,3,4,6,8,10")
+    args = parser.parse_args()
+
+    rng = Random(9000)
+    domains = [f"shop{index}.example" for index in range(args.domains)]
+    # Every domain uses two of the templates
+    used = {domain: rng.sample(range(len(TEMPLATES)), 2) for domain in domains}
+    seen = [(domain, template) for domain in domains for template in used[domain]]
+    seen = [rng.choice(seen) for _ in range(args.seen)]
+    # Each query carries the verdict it should get: its template number, or None
+    queries = [
+        (templated(rng, domain, template), str(template)) if number % 2 == 0 else (unrelated(rng, domain), None)
+        for number, (domain, template) in enumerate(rng.choice(seen) for _ in range(args.lookups))
+    ]
+    recorded = [(templated(rng, domain, template), template) for domain, template in seen]
+    print(f"{args.seen:,} recorded emails, {args.lookups:,} lookups (50% new copies of a recorded template)")
+
+    for max_distance in (int(distance) for distance in args.distances.split(',')):
+        with TemporaryDirectory() as directory:
+            config = ConfigParser()
+            config["NEAR_DUPLICATES"] = {
+                "near_duplicate_file": path.join(directory, "near_duplicates.sqlite3"),
+                "max_distance": str(max_distance),
+            }
+            index = NearDuplicateIndex(config)
+            # Every template gets its own verdict, so a match with the wrong template shows
+            index.record([(email.sender, index.fingerprint(email), str(template)) for email, template in recorded])
+
+            started = perf_counter()
+            verdicts = []
+            for email, _ in queries:
+                fingerprint = index.fingerprint(email)
+                row = index.lookup(email.sender, fingerprint) if fingerprint is not None else None
+                verdicts.append(row['importance_level'] if row else None)
+            elapsed = perf_counter() - started
+
+            copies = sum(verdict == expected for verdict, (_, expected) in zip(verdicts, queries) if expected)
+            false_hits = sum(verdict not in (None, expected) for verdict, (_, expected) in zip(verdicts, queries))
+            halves = len(queries) / 2
+            print(
+                f"max_distance {max_distance:2}: hit rate {copies / halves:6.1%} on copies, {false_hits / halves:6.2%} false hits, "
+                f"{elapsed / len(queries) * 1e6:7.1f} us per email (fingerprint + lookup, index {index.stats()['mean_lookup_ms'] * 1000:.1f} us)"
+            )
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
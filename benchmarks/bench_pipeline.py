@@ -0,0 +1,116 @@
+"""Mailbox throughput, one email after the other versus the staged pipeline.
+
+    python benchmarks/bench_pipeline.py [--emails 64] [--imap-latency 0.02] [--llm-latency 0.25] [--parallel 4]
+
+A stand-in IMAP server answers every command after --imap-latency seconds and a stand-in Ollama server
+answers every generation after --llm-latency seconds, running --parallel of them at once like
+OLLAMA_NUM_PARALLEL. The sequential run is the old process_mailbox loop: fetch, then classify every
+email in turn, then move. The pipeline run is process_mailbox with --parallel LLM workers.
+"""
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from configparser import ConfigParser
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import corpus  # noqa: F401  (puts mailbot/ on sys.path)
+# The stand-in servers live with the tests
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from cache.cache import ImportanceLevel
+from e2e import process_mailbox, safe_classify_email
+from llm.ollamallm.llm import LLM
+from mail.imapservice import ImapService
+from pipeline import PipelineSettings
+from workqueue.workqueue import WorkQueue
+from tests.imapstandin import StandInImapServer
+from tests.ollamastandin import StandInOllamaServer
+
+FOLDERS = ("Important", "Later", "Spare", "Junk")
+
+
+def raw_email(index: int) -> bytes:
+    return (
+        f"From: sender{index}@example.com\r\nTo: me@example.com\r\nSubject: Message {index}\r\n"
+        f"Message-ID: <{index}@example.com>\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n"
+        f"Body of message {index}\r\n"
+    ).encode("utf-8")
+
+
+def make_config(directory: str, imap_port: int, ollama_url: str, parallel: int) -> ConfigParser:
+    config = ConfigParser()
+    config["IMAP"] = {
+        "port": str(imap_port),
+        "server": "127.0.0.1",
+        "username": "user@example.com",
+        "password": "password",
+        "ssl": "false",
+        "most_important_folder": "Important",
+        "medium_important_folder": "Later",
+        "less_important_folder": "Spare",
+        "likely_junk_folder": "Junk",
+        "fetch_chunk_size": "16",
+        "incremental_sync": "false",
+    }
+    config["OLLAMA"] = {"ollama_base_url": ollama_url, "pool_size": str(parallel)}
+    config["QUEUE"] = {"queue_file": path.join(directory, "queue.sqlite3")}
+    return config
+
+
+def sequential(service: ImapService, llm: LLM, mailbox: str) -> None:
+    uids = service.fetch_email_ids(mailbox)
+    moves = defaultdict(list)
+    for email_data in service.fetch_partial_bodies(service.fetch_headers(uids)):
+        importance = safe_classify_email(email_data, None, llm)
+        if isinstance(importance, ImportanceLevel):
+            moves[importance].append(email_data.uid)
+    for importance, moved in moves.items():
+        service.move_emails(moved, importance)
+
+
+def run(mode: str, args, ollama: StandInOllamaServer) -> float:
+    mailboxes = {"INBOX": [raw_email(index) for index in range(args.emails)], **{folder: [] for folder in FOLDERS}}
+    with TemporaryDirectory() as directory, StandInImapServer(mailboxes, latency=args.imap_latency) as imap:
+        config = make_config(directory, imap.port, ollama.url, args.parallel)
+        llm = LLM(config)
+        work_queue = WorkQueue(config)
+        service = ImapService(config)
+        started = perf_counter()
+        if mode == "sequential":
+            sequential(service, llm, "INBOX")
+        else:
+            process_mailbox(service, None, llm, work_queue, "INBOX", settings=PipelineSettings.from_config(config))
+        elapsed = perf_counter() - started
+        assert not imap.mailboxes["INBOX"], f"{len(imap.mailboxes['INBOX'])} emails left in INBOX"
+        service.shutdown()
+        work_queue.close()
+        llm.close()
+    return elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=64)
+    parser.add_argument("--imap-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.25)
+    parser.add_argument("--parallel", type=int, default=4)
+    args = parser.parse_args()
+
+    ollama = StandInOllamaServer(latency=args.llm_latency, parallel=args.parallel)
+    ollama.start()
+    try:
+        llm_bound = args.emails * args.llm_latency / args.parallel
+        print(f"{args.emails} emails, IMAP {args.imap_latency * 1000:.0f} ms per command, "
+              f"LLM {args.llm_latency * 1000:.0f} ms per email with {args.parallel} in parallel "
+              f"(the LLM stage alone needs {llm_bound:.2f}s)")
+        for mode in ("sequential", "pipeline"):
+            elapsed = run(mode, args, ollama)
+            print(f"{mode:>10}: {elapsed:6.2f}s  {args.emails / elapsed:6.1f} emails/s")
+    finally:
+        ollama.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Time to first token with and without reuse of the static prompt prefix.
+
+    python benchmarks/bench_prefix_cache.py [--backend ollama] [--url http://localhost:11434/api] [--emails 10]
+    python benchmarks/bench_prefix_cache.py --backend huggingface --token hf_...
+
+Needs a running Ollama server with the model pulled, or torch and transformers for --backend huggingface.
+Every email is classified with ImportanceEvaulator in three ways:
+
+  uncached  the whole prompt, behind a line that differs per call, so no prefix can be reused
+  prompt    the whole prompt as one user prompt, as before
+  system    instructions and examples as the system prompt and the email as the prompt
+
+Ollama streams the answer; the time to the first chunk is the time to first token, and its final chunk
+reports how many prompt tokens it evaluated. The Hugging Face LLM generates a single token, once from
+the plain prompt string and once from its cached system prefix.
+"""
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from json import dumps, loads
+from random import Random
+from statistics import median
+from time import perf_counter
+from uuid import uuid4
+from requests import Session
+
+import corpus
+from mail.emailwrapper import EmailWrapper
+from prompt.importance_evaluator import ImportanceEvaulator
+
+
+def ollama_ttft(session: Session, args, prompt: str, system: str = None) -> tuple:
+    data = {"model": args.model, "prompt": prompt, "stream": True, "keep_alive": "30m", "options": {"num_predict": 8}}
+    if system:
+        data["system"] = system
+    started = perf_counter()
+    first_token = None
+    prompt_tokens = None
+    with session.post(f"{args.url}/generate", data=dumps(data), stream=True, timeout=600) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            first_token = first_token or perf_counter() - started
+            chunk = loads(line)
+            if chunk.get("done"):
+                prompt_tokens = chunk.get("prompt_eval_count")
+    return first_token, prompt_tokens
+
+
+def run_ollama(args, prompts: list) -> None:
+    session = Session()
+    # Load the model and fill the cache with the system prefix first
+    ollama_ttft(session, args, prompts[0].get_user_prompt(), prompts[0].get_system_prompt())
+    for mode in ("uncached", "prompt", "system"):
+        results = []
+        for prompt in prompts:
+            if mode == "uncached":
+                results.append(ollama_ttft(session, args, f"Request {uuid4()}\n\n{prompt.get_prompt()}"))
+            elif mode == "prompt":
+                results.append(ollama_ttft(session, args, prompt.get_prompt()))
+            else:
+                results.append(ollama_ttft(session, args, prompt.get_user_prompt(), prompt.get_system_prompt()))
+        evaluated = [tokens for _, tokens in results if tokens is not None]
+        print(f"{mode:>9}: median TTFT {median(seconds for seconds, _ in results) * 1000:7.0f} ms, "
+              f"{sum(evaluated) / max(len(evaluated), 1):6.0f} prompt tokens evaluated per call")
+    session.close()
+
+
+def run_huggingface(args, prompts: list) -> None:
+    from llm.hugginfacellm.llm import LLM
+
+    config = ConfigParser()
+    config["HUGGINGFACE"] = {"token": args.token, "max_new_tokens": "1"}
+    llm = LLM(config)
+    llm.setup()
+    for prompt in prompts:
+        prompt.max_tokens = 1
+    llm.generate(prompts[0])
+    for mode in ("prompt", "system"):
+        timings = []
+        for prompt in prompts:
+            started = perf_counter()
+            llm.generate(prompt.get_prompt() if mode == "prompt" else prompt)
+            timings.append(perf_counter() - started)
+        print(f"{mode:>9}: median TTFT {median(timings) * 1000:7.0f} ms")
+    llm.tear_down()
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("ollama", "huggingface"), default="ollama")
+    parser.add_argument("--url", default="http://localhost:11434/api")
+    parser.add_argument("--model", default="deepseek-r1:14b")
+    parser.add_argument("--token", default="", help="Hugging Face token")
+    parser.add_argument("--emails", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = Random(11)
+    prompts = [
+        ImportanceEvaulator(EmailWrapper(corpus.sentence(rng, 6), corpus.paragraph(rng), f"sender{index}@example.com", "me@example.com", "", f"<{index}@x>"))
+        for index in range(args.emails)
+    ]
+    print(f"system prompt of {len(prompts[0].get_system_prompt())} characters, "
+          f"emails of {sum(len(prompt.get_user_prompt()) for prompt in prompts) // len(prompts)} on average")
+    if args.backend == "ollama":
+        run_ollama(args, prompts)
+    else:
+        run_huggingface(args, prompts)
+
+
+if __name__ == "__main__":
+    main()
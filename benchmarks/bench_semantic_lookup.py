@@ -0,0 +1,66 @@
+"""Semantic index lookup latency and size, float32 versus int8 vectors.
+
+    python benchmarks/bench_semantic_lookup.py [--entries 100000] [--dimensions 768] [--batch 32]
+
+--entries random unit vectors (768 dimensions, like nomic-embed-text) are stored, then looked up one
+at a time and --batch at a time. Embedding time is not included: it depends on the model server.
+"""
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import numpy as np
+
+import corpus  # noqa: F401  (puts mailbot/ on sys.path)
+from cache.semantic import LEVELS, SemanticIndex
+
+
+# Stands in for the embedding model; only its name and dimensions matter here
+class FixedEmbedder:
+    def __init__(self, dimensions: int):
+        self.model_name = f"random-{dimensions}"
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--lookups", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(9000)
+    vectors = rng.standard_normal((args.entries, args.dimensions)).astype(np.float32)
+    levels = [LEVELS[row % len(LEVELS)] for row in range(args.entries)]
+    # Queries near stored rows, so the vote has neighbours
+    queries = vectors[rng.integers(args.entries, size=args.lookups)] + 0.1 * rng.standard_normal((args.lookups, args.dimensions)).astype(np.float32)
+    print(f"{args.entries:,} entries of {args.dimensions} dimensions")
+
+    for quantize in ("false", "true"):
+        with TemporaryDirectory() as directory:
+            config = ConfigParser()
+            config["SEMANTIC"] = {"semantic_file": path.join(directory, "semantic"), "quantize": quantize, "min_votes": "1"}
+            index = SemanticIndex(config, FixedEmbedder(args.dimensions))
+            for start in range(0, args.entries, 10_000):
+                index.add(vectors[start:start + 10_000], levels[start:start + 10_000])
+            size = path.getsize(path.join(directory, "semantic.vectors")) + path.getsize(path.join(directory, "semantic.scales"))
+
+            started = perf_counter()
+            single = [index.classify(query[None, :])[0] for query in queries]
+            single_ms = (perf_counter() - started) / len(queries) * 1000
+            started = perf_counter()
+            for start in range(0, len(queries), args.batch):
+                index.classify(queries[start:start + args.batch])
+            batched_ms = (perf_counter() - started) / len(queries) * 1000
+
+            hits = sum(result is not None for result in single)
+            print(
+                f"{('float32', 'int8')[quantize == 'true']:>8}: {size / 2 ** 20:7.1f} MiB on disk, {single_ms:7.2f} ms per lookup, "
+                f"{batched_ms:7.2f} ms per email in batches of {args.batch} ({hits}/{len(queries)} hits)"
+            )
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
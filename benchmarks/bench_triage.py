@@ -0,0 +1,77 @@
+"""Pre-classifier: training time, escalation rate, accuracy of what it handles and per-email latency.
+
+    python benchmarks/bench_triage.py [--train 20000] [--test 5000] [--noise 0.05]
+
+A synthetic cache is generated: a few thousand senders, each with a usual verdict and subjects drawn
+from words typical of that verdict. A --noise share of verdicts is flipped, as if the LLM changed its
+mind. The model is trained on --train rows and then asked about --test unseen emails.
+"""
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from os import path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import corpus
+from mail.emailwrapper import EmailWrapper
+from triage.triage import LEVELS, PreClassifier
+
+VOCABULARY = {
+    "least_important": "sale discount offer newsletter weekly exclusive members rewards points deals".split(),
+    "medium_important": "order shipped delivery tracking receipt invoice payment subscription renew".split(),
+    "most_important": "meeting tomorrow review project deadline team security alert password".split(),
+    "scam": "urgent verify account suspended winner prize claim wallet unlock".split(),
+}
+
+
+def synthetic_rows(rng: Random, senders: list, count: int, noise: float) -> list:
+    rows = []
+    for _ in range(count):
+        sender, level = rng.choice(senders)
+        words = rng.sample(VOCABULARY[level], 3) + [rng.choice(corpus.WORDS) for _ in range(2)]
+        rng.shuffle(words)
+        if rng.random() < noise:
+            level = rng.choice(LEVELS)
+        rows.append({'sender': sender, 'email_subject': " ".join(words).capitalize(), 'importance_level': level})
+    return rows
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--train", type=int, default=20_000)
+    parser.add_argument("--test", type=int, default=5_000)
+    parser.add_argument("--senders", type=int, default=3_000)
+    parser.add_argument("--noise", type=float, default=0.05)
+    args = parser.parse_args()
+
+    rng = Random(9000)
+    senders = [(f"sender{index}@domain{index % 500}.example", rng.choice(LEVELS)) for index in range(args.senders)]
+    training = synthetic_rows(rng, senders, args.train, args.noise)
+    testing = synthetic_rows(rng, senders, args.test, args.noise)
+
+    with TemporaryDirectory() as directory:
+        config = ConfigParser()
+        config["TRIAGE"] = {"triage_file": path.join(directory, "triage_model.npz")}
+        classifier = PreClassifier(config)
+        started = perf_counter()
+        classifier.train(iter(training))
+        print(f"trained on {args.train:,} verdicts in {perf_counter() - started:.2f}s, "
+              f"precision while training {classifier.stats()['precision']:.1%}")
+
+        handled = correct = 0
+        for row in testing:
+            prediction = classifier.predict(EmailWrapper(row['email_subject'], "", row['sender'], "me@example.com", "", ""))
+            if prediction:
+                handled += 1
+                correct += prediction[0].value == row['importance_level']
+        stats = classifier.stats()
+        print(
+            f"escalated {stats['escalation_rate']:.1%} of {args.test:,} emails to the LLM; "
+            f"the rest were {correct / max(handled, 1):.1%} right (labels carry {args.noise:.0%} noise); "
+            f"{stats['mean_predict_ms'] * 1000:.0f} us per email"
+        )
+
+
+if __name__ == "__main__":
+    main()
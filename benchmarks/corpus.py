@@ -0,0 +1,100 @@
+import sys
+from os import path
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from random import Random
+
+# Benchmarks import the application modules the same way e2e.py does when run from inside mailbot/.
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "mailbot"))
+
+WORDS = (
+    "order shipped invoice meeting tomorrow security alert password account sale discount offer limited "
+    "newsletter weekly update team project deadline review payment receipt confirm delivery tracking "
+    "unsubscribe preferences exclusive members rewards points expires renew subscription"
+).split()
+
+
+def sentence(rng: Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng: Random, sentences: int = 5) -> str:
+    return " ".join(sentence(rng, rng.randint(6, 14)) for _ in range(sentences))
+
+
+# A marketing email the way ESPs send them: nested layout tables, inline styles, a <style> block,
+# tracking pixels, hidden preheaders and a link on nearly everything. Roughly target_bytes of HTML.
+def marketing_html(rng: Random, target_bytes: int = 200 * 1024) -> str:
+    head = (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>"
+        + "".join(f".c{index}{{color:#{rng.randrange(0xffffff):06x};padding:{index}px}}" for index in range(200))
+        + "</style><script>window.dataLayer=[];</script></head><body>"
+        "<div style=\"display:none;max-height:0;overflow:hidden\">Preheader text you never see</div>"
+    )
+    rows = []
+    size = len(head)
+    while size < target_bytes:
+        link = f"https://click.example.com/t/{rng.randrange(10 ** 9)}"
+        row = (
+            "<table width=\"100%\" cellpadding=\"0\" cellspacing=\"0\" border=\"0\"><tr>"
+            f"<td class=\"c{rng.randrange(200)}\" style=\"font-family:Arial;font-size:14px;line-height:20px\">"
+            f"<a href=\"{link}\" style=\"color:#333;text-decoration:none\">{sentence(rng, 8)}</a>"
+            f"<p style=\"margin:0\">{paragraph(rng, 2)}</p></td>"
+            f"<td><img src=\"https://img.example.com/{rng.randrange(10 ** 6)}.png\" width=\"1\" height=\"1\" alt=\"\"></td>"
+            "</tr></table>"
+        )
+        rows.append(row)
+        size += len(row)
+    return head + "".join(rows) + "</body></html>"
+
+
+def plain_email(rng: Random) -> MIMEText:
+    return MIMEText("\n\n".join(paragraph(rng) for _ in range(rng.randint(2, 8))), "plain", rng.choice(["utf-8", "iso-8859-1"]))
+
+
+def alternative_email(rng: Random) -> MIMEMultipart:
+    message = MIMEMultipart("alternative")
+    text = paragraph(rng, 6)
+    message.attach(MIMEText(text, "plain", "utf-8"))
+    message.attach(MIMEText(f"<html><body><p>{text}</p></body></html>", "html", "utf-8"))
+    return message
+
+
+def html_only_email(rng: Random, target_bytes: int) -> MIMEText:
+    return MIMEText(marketing_html(rng, target_bytes), "html", "utf-8")
+
+
+def attachment_email(rng: Random) -> MIMEMultipart:
+    message = MIMEMultipart("mixed")
+    message.attach(MIMEText(paragraph(rng, 3), "plain", "utf-8"))
+    attachment = MIMEApplication(rng.randbytes(256 * 1024), "pdf")
+    attachment.add_header("Content-Disposition", "attachment", filename="statement.pdf")
+    message.attach(attachment)
+    return message
+
+
+def build_message(rng: Random, kind: str, index: int, html_bytes: int):
+    if kind == "plain":
+        message = plain_email(rng)
+    elif kind == "alternative":
+        message = alternative_email(rng)
+    elif kind == "html":
+        message = html_only_email(rng, html_bytes)
+    else:
+        message = attachment_email(rng)
+    message["From"] = f"sender{index}@example.com"
+    message["To"] = "me@example.com"
+    message["Subject"] = sentence(rng, 5)
+    message["Message-ID"] = f"<{index}@bench.example.com>"
+    return message
+
+
+# A deterministic corpus of raw RFC 5322 messages. mix maps message kinds (plain, alternative, html,
+# attachment) to their share of the corpus.
+def generate_corpus(count: int = 200, seed: int = 9000, mix: dict = None, html_bytes: int = 60 * 1024) -> list:
+    mix = mix or {"plain": 0.3, "alternative": 0.3, "html": 0.3, "attachment": 0.1}
+    rng = Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    return [build_message(rng, rng.choices(kinds, weights)[0], index, html_bytes).as_bytes() for index in range(count)]
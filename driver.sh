@@ -12,6 +12,6 @@ source ./setup.sh >> "$LOGFILE" 2>&1
 
 cd "$PROJECT_DIR/mailbot" || exit 1
 
-python3 -u e2e.py >> "$LOGFILE" 2>&1 &
+python3 -u e2e.py "$@" >> "$LOGFILE" 2>&1 &
 
 echo "$(date): Python script launched in background" >> "$LOGFILE"
@@ -0,0 +1,571 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from configparser import ConfigParser
+from contextlib import contextmanager
+from csv import DictWriter, reader as csv_reader
+from datetime import datetime
+from fcntl import LOCK_EX, LOCK_SH, LOCK_UN, flock
+from io import StringIO
+from os import (
+    O_APPEND, O_CREAT, O_RDWR, O_WRONLY, close, fstat, ftruncate, getpid, open as os_open, path, pread, pwrite, remove, replace, stat, write
+)
+from sqlite3 import connect
+from time import time
+from typing import Optional
+from loguru import logger
+
+FIELDNAMES = [
+    'sender',
+    'importance_level',
+    'email_subject',
+    'email_subject_hash',
+    'reasoning',
+    'time_added',
+    'streak'
+]
+# Every record is indexed under both keys; compacted records may carry only one of them
+KEYS = (('subject', 'email_subject_hash'), ('sender', 'sender'))
+HOUR = 3600.0
+TOUCH_BATCH = 1000
+
+
+def record_ids(row: dict) -> set:
+    """What identifies a record: when it was added, with its subject hash or sender (compaction may blank one)."""
+    return {(row.get('time_added'), column, row[column]) for _, column in KEYS if row.get(column)}
+
+
+def parse_time(value: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Decides how long a verdict is served. A key that gets the same verdict three times in a row is
+# considered stable and its TTL doubles with every further confirmation (up to max_ttl_hours); a
+# different verdict resets the streak, so churning senders keep being re-checked by the LLM.
+# Expired entries are no longer served but are remembered for another ttl_hours, so the next verdict
+# for the key can continue the streak.
+class ExpiryPolicy:
+    def __init__(self, config: ConfigParser):
+        self.ttl = config.getfloat("CACHE", "ttl_hours", fallback=168.0) * HOUR
+        self.max_ttl = config.getfloat("CACHE", "max_ttl_hours", fallback=2160.0) * HOUR
+        self.max_entries = config.getint("CACHE", "max_entries", fallback=100000)
+        self.compact_min_records = config.getint("CACHE", "compact_min_records", fallback=1000)
+        self.clock = time
+
+    def ttl_for(self, streak: int) -> float:
+        if streak < 3:
+            return self.ttl
+        return min(self.max_ttl, self.ttl * 2 ** (streak - 2))
+
+    def next_streak(self, previous: Optional[tuple], importance_level: str) -> int:
+        """previous is the (importance_level, streak) currently known for the key."""
+        if previous and previous[0] == importance_level:
+            return previous[1] + 1
+        return 1
+
+    def is_forgotten(self, expires_at: float, now: float) -> bool:
+        return now > expires_at + self.ttl
+
+    def compaction_due(self, records: int, entries: int) -> bool:
+        return records > max(self.compact_min_records, 2 * entries)
+
+
+# Storage behind Cache. A lookup returns the live verdict for the subject hash or the sender; when
+# both are known the more recent one wins. Callers serialize access (Cache holds a lock), except for
+# write_compaction() which runs on a background thread between begin_compaction() and finish_compaction().
+class CacheBackend(ABC):
+    @abstractmethod
+    def append(self, rows: list) -> None:
+        pass
+
+    @abstractmethod
+    def lookup(self, subject_hash: str, sender: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def compaction_due(self) -> bool:
+        pass
+
+    def history(self):
+        """Yield the stored records, oldest first, as dicts with the FIELDNAMES columns."""
+        return iter(())
+
+    def stored(self, rows: list) -> list:
+        """Whether each of the rows was already appended. Reads the whole history, so it is meant for
+        recovering journals, not for the write path."""
+        added = {row.get('time_added') for row in rows}
+        known = set()
+        for row in self.history():
+            if row.get('time_added') in added:
+                known.update(record_ids(row))
+        return [not known.isdisjoint(record_ids(row)) for row in rows]
+
+    def begin_compaction(self):
+        return None
+
+    def write_compaction(self, state):
+        return state
+
+    @abstractmethod
+    def finish_compaction(self, state) -> None:
+        pass
+
+    def abort_compaction(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def iter_csv_rows(file, source: str):
+    """Yield the rows of an open cache CSV as dicts, skipping rows that lack the lookup columns."""
+    rows = csv_reader(file)
+    header = next(rows, None)
+    if not header:
+        return
+    if 'email_subject_hash' not in header or 'sender' not in header:
+        logger.warning(f"Cache file {source} has no email_subject_hash/sender columns; ignoring it.")
+        return
+    for values in rows:
+        # Rows with a different number of fields than the header are damaged; skip them
+        if len(values) != len(header):
+            continue
+        yield dict(zip(header, values))
+
+
+def read_csv_rows(csv_path: str):
+    with open(csv_path, 'r', newline='') as file:
+        yield from iter_csv_rows(file, csv_path)
+
+
+def complete_records_length(data: bytes) -> int:
+    """Length of the prefix of data that holds only complete CSV records.
+
+    A line ends a record when the quotes seen since the record started are balanced; escaped quotes
+    are doubled, so quoted newlines and torn records are both told apart from record ends.
+    """
+    length = 0
+    quotes = 0
+    start = 0
+    while (newline := data.find(b'\n', start)) >= 0:
+        quotes += data.count(b'"', start, newline)
+        start = newline + 1
+        if quotes % 2 == 0:
+            length = start
+            quotes = 0
+    return length
+
+
+# What the in-memory index keeps per key; slots keep a million of them affordable
+class CacheEntry:
+    __slots__ = ('importance_level', 'time_added', 'streak', 'expires_at', 'position')
+
+    def __init__(self, importance_level: str, time_added: float, streak: int, expires_at: float, position: int):
+        self.importance_level = importance_level
+        self.time_added = time_added
+        self.streak = streak
+        self.expires_at = expires_at
+        self.position = position
+
+
+# The existing CSV file used as an append-only log, shared by any number of processes. It is replayed
+# into an LRU ordered index keyed by ('subject', hash) and ('sender', address), so a lookup is two
+# dict probes, and afterwards only the bytes other processes appended are read.
+# Writers hold an exclusive flock on <csv>.lock and append a whole batch with one O_APPEND write, so
+# records never interleave. Readers stop at the last complete record, and a record torn by a crashed
+# writer is cut off by the next writer.
+# Compaction rewrites the log with only the latest row of every remembered key (carrying its streak),
+# copies whatever was appended in the meantime and swaps the file in under the lock. It also bumps the
+# generation number kept in the lock file, which tells other processes to reload (inode numbers can't
+# be used for that, the filesystem hands the freed one to the next compacted file).
+class CsvLogBackend(CacheBackend):
+    def __init__(self, csv_path: str, policy: ExpiryPolicy):
+        self.csv_path = csv_path
+        self.policy = policy
+        self.lock_descriptor = os_open(csv_path + '.lock', O_RDWR | O_CREAT, 0o644)
+        self.compacting = False
+        with self.__file_lock(LOCK_EX):
+            self.__ensure_file()
+        self.__reset()
+        with self.__file_lock(LOCK_SH):
+            self.__catch_up()
+        logger.info(f"Cache index loaded with {len(self.entries)} keys from {self.rows} records in {self.csv_path}")
+
+    @contextmanager
+    def __file_lock(self, operation: int):
+        flock(self.lock_descriptor, operation)
+        try:
+            yield
+        finally:
+            flock(self.lock_descriptor, LOCK_UN)
+
+    def __read_generation(self) -> int:
+        value = pread(self.lock_descriptor, 20, 0).strip()
+        return int(value) if value.isdigit() else 0
+
+    def __ensure_file(self) -> None:
+        if not path.exists(self.csv_path):
+            try:
+                with open(self.csv_path, 'w', newline='') as file:
+                    DictWriter(file, fieldnames=FIELDNAMES).writeheader()
+            except Exception as e:
+                raise Exception(f"Failed to create cache file: {e}")
+
+    def __reset(self) -> None:
+        self.entries: OrderedDict = OrderedDict()
+        self.rows = 0
+        self.offset = 0
+        self.generation = None
+        self.header: Optional[list] = None
+
+    def __parse(self, data: bytes) -> list:
+        rows = csv_reader(StringIO(data.decode('utf-8', errors='replace'), newline=''))
+        if self.header is None:
+            self.header = next(rows, None) or FIELDNAMES
+        if 'email_subject_hash' not in self.header or 'sender' not in self.header:
+            return []
+        return [dict(zip(self.header, values)) for values in rows if len(values) == len(self.header)]
+
+    def __catch_up(self) -> None:
+        """Index the records appended since the last call; reload if the log was replaced. Needs the file lock."""
+        generation = self.__read_generation()
+        if self.generation is not None and generation != self.generation:
+            logger.info(f"Cache log {self.csv_path} was compacted by another process; reloading")
+            self.__reset()
+        self.generation = generation
+        with open(self.csv_path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+        # An incomplete tail can only be a record torn by a crashed writer; the next append truncates it
+        end = complete_records_length(data)
+        for row in self.__parse(data[:end]):
+            self.__index(row)
+        self.offset += end
+
+    def __refresh(self) -> None:
+        if (stat(self.csv_path).st_size, self.__read_generation()) != (self.offset, self.generation):
+            with self.__file_lock(LOCK_SH):
+                self.__catch_up()
+
+    def __index(self, row: dict) -> None:
+        time_added = parse_time(row.get('time_added'))
+        for kind, column in KEYS:
+            key = row.get(column)
+            if not key:
+                continue
+            entry = self.entries.get((kind, key))
+            if row.get('streak', '').isdigit():
+                streak = int(row['streak'])
+            else:
+                streak = self.policy.next_streak(entry and (entry.importance_level, entry.streak), row['importance_level'])
+            self.entries[(kind, key)] = CacheEntry(
+                row['importance_level'], time_added, streak, time_added + self.policy.ttl_for(streak), self.rows
+            )
+            self.entries.move_to_end((kind, key))
+        self.rows += 1
+        while len(self.entries) > self.policy.max_entries:
+            self.entries.popitem(last=False)
+
+    def append(self, rows: list) -> None:
+        buffer = StringIO(newline='')
+        with self.__file_lock(LOCK_EX):
+            self.__catch_up()
+            DictWriter(buffer, fieldnames=self.header, extrasaction='ignore').writerows(rows)
+            data = buffer.getvalue().encode('utf-8')
+            descriptor = os_open(self.csv_path, O_WRONLY | O_APPEND)
+            try:
+                if fstat(descriptor).st_size > self.offset:
+                    logger.warning(f"Dropping a record torn by a crashed writer at the end of {self.csv_path}")
+                    ftruncate(descriptor, self.offset)
+                view = memoryview(data)
+                while view:
+                    view = view[write(descriptor, view):]
+            finally:
+                close(descriptor)
+            # Index our own rows from the file, so positions always match the log
+            self.__catch_up()
+
+    def lookup(self, subject_hash: str, sender: str) -> Optional[dict]:
+        self.__refresh()
+        now = self.policy.clock()
+        best = None
+        for key in (('subject', subject_hash), ('sender', sender)):
+            entry = self.entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                continue
+            self.entries.move_to_end(key)
+            if best is None or entry.time_added > best.time_added:
+                best = entry
+        if best is None:
+            return None
+        return {'importance_level': best.importance_level, 'streak': best.streak, 'expires_at': best.expires_at}
+
+    def count(self) -> int:
+        self.__refresh()
+        return self.rows
+
+    def history(self):
+        with self.__file_lock(LOCK_SH):
+            yield from read_csv_rows(self.csv_path)
+
+    def compaction_due(self) -> bool:
+        return not self.compacting and self.policy.compaction_due(self.rows, len(self.entries))
+
+    def begin_compaction(self):
+        with self.__file_lock(LOCK_SH):
+            self.__catch_up()
+        now = self.policy.clock()
+        for key in [key for key, entry in self.entries.items() if self.policy.is_forgotten(entry.expires_at, now)]:
+            del self.entries[key]
+        # Which (row, kind) pairs are still the latest for a key, and with what streak
+        latest = {(entry.position, kind): entry.streak for (kind, _), entry in self.entries.items()}
+        self.compacting = True
+        return {'rows': self.rows, 'offset': self.offset, 'generation': self.generation, 'latest': latest}
+
+    def write_compaction(self, state):
+        compacted_path = f"{self.csv_path}.compact.{getpid()}"
+        positions = {}
+        written = 0
+        with open(self.csv_path, 'r', newline='') as source:
+            # Checked after opening: a compaction from now on can't change what this handle reads
+            if self.__read_generation() != state['generation']:
+                return None
+            with open(compacted_path, 'w', newline='') as file:
+                writer = DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore')
+                writer.writeheader()
+                for position, row in enumerate(iter_csv_rows(source, self.csv_path)):
+                    if position >= state['rows']:
+                        break
+                    streaks = {kind: state['latest'][(position, kind)] for kind, _ in KEYS if (position, kind) in state['latest']}
+                    if not streaks:
+                        continue
+                    # A row that is the latest for both keys is written once unless the streaks differ
+                    groups = [tuple(streaks)] if len(set(streaks.values())) == 1 else [(kind,) for kind in streaks]
+                    for kinds in groups:
+                        written_row = dict(row, streak=streaks[kinds[0]])
+                        for kind, column in KEYS:
+                            if kind not in kinds:
+                                written_row[column] = ''
+                        writer.writerow(written_row)
+                        for kind in kinds:
+                            positions[(position, kind)] = written
+                        written += 1
+        return dict(state, path=compacted_path, positions=positions, written=written)
+
+    def finish_compaction(self, state) -> None:
+        with self.__file_lock(LOCK_EX):
+            self.__catch_up()
+            if state is None or self.generation != state['generation']:
+                logger.info(f"Cache log {self.csv_path} was compacted by another process first")
+                self.abort_compaction()
+                return
+            positions = [
+                state['written'] + entry.position - state['rows'] if entry.position >= state['rows']
+                else state['positions'][(entry.position, kind)]
+                for (kind, _), entry in self.entries.items()
+            ]
+            # Records appended by any process since the snapshot go to the end of the new log
+            with open(self.csv_path, 'rb') as source:
+                source.seek(state['offset'])
+                appended = self.__parse(source.read(self.offset - state['offset']))
+            with open(state['path'], 'a', newline='') as file:
+                DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore').writerows(appended)
+            replace(state['path'], self.csv_path)
+            self.generation += 1
+            pwrite(self.lock_descriptor, str(self.generation).rjust(20).encode(), 0)
+            self.offset = stat(self.csv_path).st_size
+
+        for entry, position in zip(self.entries.values(), positions):
+            entry.position = position
+        logger.info(f"Compacted cache log from {self.rows} to {state['written'] + len(appended)} records")
+        self.rows = state['written'] + len(appended)
+        self.header = FIELDNAMES
+        self.compacting = False
+
+    def abort_compaction(self) -> None:
+        self.compacting = False
+        compacted_path = f"{self.csv_path}.compact.{getpid()}"
+        if path.exists(compacted_path):
+            remove(compacted_path)
+
+    def close(self) -> None:
+        close(self.lock_descriptor)
+
+
+# SQLite store. records keeps the appended history, entries the current verdict per key with an index
+# on both lookup columns. On first use it imports the existing CSV cache (the CSV is left untouched).
+# WAL mode lets several processes read while one writes; writes start with BEGIN IMMEDIATE so two
+# writers queue on the busy timeout instead of failing to upgrade their read locks.
+class SqliteBackend(CacheBackend):
+    def __init__(self, db_path: str, policy: ExpiryPolicy, csv_path: Optional[str] = None):
+        self.db_path = db_path
+        self.policy = policy
+        self.connection = connect(db_path, timeout=30.0, isolation_level="IMMEDIATE", check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.__touched: dict = {}
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " sender TEXT NOT NULL,"
+            " importance_level TEXT NOT NULL,"
+            " email_subject TEXT,"
+            " email_subject_hash TEXT NOT NULL,"
+            " reasoning TEXT,"
+            " time_added TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " importance_level TEXT NOT NULL,"
+            " streak INTEGER NOT NULL,"
+            " time_added REAL NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " record_id INTEGER NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+        if csv_path:
+            self.__migrate_csv(csv_path)
+        self.rows = self.count()
+        self.entry_count = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if self.rows and not self.entry_count:
+            self.__rebuild_entries()
+
+    def __migrate_csv(self, csv_path: str) -> None:
+        migrated = self.connection.execute("SELECT value FROM metadata WHERE key = 'migrated_csv'").fetchone()
+        if migrated or not path.exists(csv_path):
+            return
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT INTO records (sender, importance_level, email_subject, email_subject_hash, reasoning, time_added)"
+                " VALUES (:sender, :importance_level, :email_subject, :email_subject_hash, :reasoning, :time_added)",
+                ({name: row.get(name) or '' for name in FIELDNAMES} for row in read_csv_rows(csv_path))
+            )
+            self.connection.execute("INSERT INTO metadata (key, value) VALUES ('migrated_csv', ?)", (csv_path,))
+        logger.info(f"Migrated {cursor.rowcount} cache records from {csv_path} to {self.db_path}")
+
+    def __rebuild_entries(self) -> None:
+        """Replay the record history into entries (databases created before entries existed)."""
+        entries = {}
+        records = self.connection.execute(
+            "SELECT id, sender, importance_level, email_subject_hash, time_added FROM records ORDER BY id"
+        )
+        for record_id, sender, importance_level, subject_hash, time_added in records:
+            for key in (('subject', subject_hash), ('sender', sender)):
+                if not key[1]:
+                    continue
+                previous = entries.get(key)
+                streak = self.policy.next_streak(previous and previous[:2], importance_level)
+                added = parse_time(time_added)
+                entries[key] = (importance_level, streak, added, added + self.policy.ttl_for(streak), record_id)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO entries (kind, key, importance_level, streak, time_added, expires_at, last_used, record_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((kind, key, level, streak, added, expires, added, record_id)
+                 for (kind, key), (level, streak, added, expires, record_id) in entries.items())
+            )
+        self.entry_count = len(entries)
+
+    def append(self, rows: list) -> None:
+        with self.connection:
+            for row in rows:
+                self.__insert(row)
+        self.rows += len(rows)
+
+    def __insert(self, row: dict) -> None:
+        added = parse_time(row.get('time_added'))
+        record_id = self.connection.execute(
+            "INSERT INTO records (sender, importance_level, email_subject, email_subject_hash, reasoning, time_added)"
+            " VALUES (:sender, :importance_level, :email_subject, :email_subject_hash, :reasoning, :time_added)",
+            row
+        ).lastrowid
+        for kind, column in KEYS:
+            previous = self.connection.execute(
+                "SELECT importance_level, streak FROM entries WHERE kind = ? AND key = ?", (kind, row[column])
+            ).fetchone()
+            streak = self.policy.next_streak(previous, row['importance_level'])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, importance_level, streak, time_added, expires_at, last_used, record_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, row[column], row['importance_level'], streak, added, added + self.policy.ttl_for(streak),
+                 self.policy.clock(), record_id)
+            )
+            self.entry_count += previous is None
+
+    def lookup(self, subject_hash: str, sender: str) -> Optional[dict]:
+        now = self.policy.clock()
+        found = self.connection.execute(
+            "SELECT kind, key, importance_level, streak, expires_at FROM entries"
+            " WHERE ((kind = 'subject' AND key = ?) OR (kind = 'sender' AND key = ?)) AND expires_at > ?"
+            " ORDER BY time_added DESC",
+            (subject_hash, sender, now)
+        ).fetchall()
+        if not found:
+            return None
+        for kind, key, *_ in found:
+            self.__touched[(kind, key)] = now
+        if len(self.__touched) >= TOUCH_BATCH:
+            self.__flush_touched()
+        _, _, importance_level, streak, expires_at = found[0]
+        return {'importance_level': importance_level, 'streak': streak, 'expires_at': expires_at}
+
+    def __flush_touched(self) -> None:
+        """Write the buffered last_used times; lookups don't pay for a commit each."""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE entries SET last_used = ? WHERE kind = ? AND key = ?",
+                ((now, kind, key) for (kind, key), now in self.__touched.items())
+            )
+        self.__touched.clear()
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def history(self):
+        columns = ('sender', 'importance_level', 'email_subject', 'email_subject_hash', 'reasoning', 'time_added')
+        for values in self.connection.execute(f"SELECT {', '.join(columns)} FROM records ORDER BY id"):
+            yield dict(zip(columns, values))
+
+    def compaction_due(self) -> bool:
+        return self.entry_count > self.policy.max_entries or self.policy.compaction_due(self.rows, self.entry_count)
+
+    def finish_compaction(self, state) -> None:
+        self.__flush_touched()
+        with self.connection:
+            self.connection.execute("DELETE FROM entries WHERE expires_at < ?", (self.policy.clock() - self.policy.ttl,))
+            self.connection.execute(
+                "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.policy.max_entries,)
+            )
+            self.connection.execute("DELETE FROM records WHERE id NOT IN (SELECT record_id FROM entries)")
+        before = self.rows
+        self.rows = self.count()
+        self.entry_count = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        logger.info(f"Compacted cache database from {before} to {self.rows} records")
+
+    def close(self) -> None:
+        self.__flush_touched()
+        self.connection.close()
+
+
+def create_backend(config: ConfigParser, csv_path: str, base_dir: str) -> CacheBackend:
+    backend = config.get("CACHE", "cache_backend", fallback="csv")
+    policy = ExpiryPolicy(config)
+    if backend == "csv":
+        return CsvLogBackend(csv_path, policy)
+    if backend == "sqlite":
+        db_file = config.get("CACHE", "cache_db_file", fallback="cache.sqlite3")
+        return SqliteBackend(path.join(base_dir, db_file), policy, csv_path)
+    raise ValueError(f"Unknown cache_backend '{backend}'. Use 'csv' or 'sqlite'.")
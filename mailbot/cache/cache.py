@@ -1,11 +1,21 @@
-from os import path
+from os import getpid, path, remove, rename
 from configparser import ConfigParser
 from enum import Enum
-from csv import DictWriter, DictReader
 from datetime import datetime
 from mail.emailwrapper import EmailWrapper
 from hashlib import sha256
+from fcntl import LOCK_EX, LOCK_NB, flock
+from glob import escape, glob
+from json import JSONDecodeError, dumps, loads
+from threading import Lock, Thread, Timer
 from typing import Optional
+from uuid import uuid4
+from weakref import WeakKeyDictionary
+from loguru import logger
+from cache.backends import FIELDNAMES, create_backend
+from cache.reputation import ReputationIndex
+from cache.simhash import NearDuplicateIndex
+from cache.semantic import SemanticIndex
 
 # Define an Enum for clarity and type safety for importance levels
 class ImportanceLevel(Enum):
@@ -25,35 +35,72 @@ class Cache:
             config["CACHE"]["cache_file"]
         )
 
-        self.fieldnames = [
-            'sender',
-            'importance_level',
-            'email_subject',
-            'email_subject_hash',
-            'reasoning',
-            'time_added'
-        ]
-        self.__ensure_file()
+        self.fieldnames = FIELDNAMES
+        # Mailboxes are processed by concurrent workers that share one cache
+        self.lock = Lock()
+        self.backend = create_backend(config, self.cache_file_path, self.__get_current_base_dir())
+        self.compaction: Optional[Thread] = None
+        self.reputation = ReputationIndex(config) if config.getboolean("REPUTATION", "reputation_enabled", fallback=True) else None
+        if self.reputation:
+            # A new index starts from the verdicts the cache already holds instead of from nothing
+            self.reputation.backfill(self.backend.history(), self.cache_file_path)
+        self.near_duplicates = (
+            NearDuplicateIndex(config) if config.getboolean("NEAR_DUPLICATES", "near_duplicate_enabled", fallback=True) else None
+        )
+        self.semantic = SemanticIndex(config) if config.getboolean("SEMANTIC", "semantic_enabled", fallback=False) else None
+        # Embeddings computed by semantic_match, kept until the LLM verdict for the same email is recorded
+        self.semantic_vectors = WeakKeyDictionary()
+
+        # Write-behind: records are buffered and written in batches. Every buffered record is first
+        # appended to a journal (one write to an open file), so a killed process loses nothing the
+        # OS already has. Each Cache instance has its own journal and holds a lock on it while alive;
+        # journals nobody holds belong to dead processes and are replayed on start.
+        self.write_buffer_size = config.getint("CACHE", "write_buffer_size", fallback=64)
+        self.write_buffer_seconds = config.getint("CACHE", "write_buffer_ms", fallback=1000) / 1000
+        self.pending: list = []
+        self.flush_timer: Optional[Timer] = None
+        self.__replay_journals()
+        self.journal = None
+        if self.write_buffer_size > 1:
+            # Locked before it gets a name other processes look for, or they would take it for a dead one
+            name = f"{getpid()}-{uuid4().hex[:8]}"
+            self.journal_path = f"{self.cache_file_path}.journal.{name}"
+            self.journal = open(f"{self.cache_file_path}.{name}.new-journal", 'a', encoding='utf-8')
+            flock(self.journal, LOCK_EX)
+            rename(self.journal.name, self.journal_path)
 
     def __get_current_base_dir(self) -> str:
         """Get the current base directory of the script."""
         return path.dirname(path.abspath(__file__))
     
-    def __ensure_file(self) -> None:
-        """Create the CSV file with headers if it doesn't exist."""
-        if not path.exists(self.cache_file_path):
-            try:
-                with open(self.cache_file_path, 'w', newline='') as file:
-                    writer = DictWriter(file, fieldnames=self.fieldnames)
-                    writer.writeheader()
-            except Exception as e:
-                raise Exception(f"Failed to create cache file: {e}")
-    
+    def __replay_journals(self) -> None:
+        """Write records that were journaled but never flushed by a process that has died."""
+        for journal_path in glob(escape(self.cache_file_path) + '.journal*'):
+            with open(journal_path, 'r', encoding='utf-8') as journal:
+                try:
+                    flock(journal, LOCK_EX | LOCK_NB)
+                except BlockingIOError:
+                    continue
+                rows = []
+                for line in journal:
+                    try:
+                        rows.append(loads(line))
+                    except JSONDecodeError:
+                        # The last line can be torn if the process died while writing it
+                        continue
+                # A process killed between writing a batch and truncating its journal leaves records that
+                # are already stored; writing them again would count them twice
+                rows = [row for row, stored in zip(rows, self.backend.stored(rows)) if not stored] if rows else []
+                if rows:
+                    logger.warning(f"Recovering {len(rows)} unflushed cache records from {journal_path}")
+                    self.__write(rows)
+                remove(journal_path)
+
     def __get_current_time(self) -> str:
         """Get the current time in a suitable format for the cache."""
         return datetime.now().isoformat()
 
-    def add_record(self, email: EmailWrapper, importance_level: ImportanceLevel, reasoning: str) -> None:
+    def add_record(self, email: EmailWrapper, importance_level: ImportanceLevel, reasoning: str, confidence: Optional[float] = None) -> None:
         """Add a record to the cache."""
         row = {
             'sender': email.sender,
@@ -61,14 +108,87 @@ class Cache:
             'email_subject': email.subject,
             'email_subject_hash': sha256(email.subject.encode('utf-8')).hexdigest(),
             'reasoning': reasoning,
-            'time_added': self.__get_current_time()
+            'time_added': self.__get_current_time(),
+            # Only for the reputation and near-duplicate indexes and the journal; the backends don't store them
+            'confidence': confidence,
+            'simhash': self.near_duplicates.fingerprint(email) if self.near_duplicates else None
         }
         try:
-            with open(self.cache_file_path, 'a', newline='') as file:
-                writer = DictWriter(file, fieldnames=self.fieldnames)
-                writer.writerow(row)
+            with self.lock:
+                if self.journal is None:
+                    self.__write([row])
+                else:
+                    self.__buffer(row)
         except Exception as e:
             raise Exception(f"Failed to add record to cache: {e}")
+        if self.semantic:
+            self.__add_embedding(email, importance_level)
+
+    def __add_embedding(self, email: EmailWrapper, importance_level: ImportanceLevel) -> None:
+        try:
+            with self.lock:
+                vector = self.semantic_vectors.pop(email, None)
+            if vector is None:
+                vector = self.semantic.embed([email])
+            self.semantic.add(vector, [importance_level.value])
+        except Exception as e:
+            # The record itself is stored; the email is just not available for semantic matches
+            logger.warning(f'Failed to add "{email.subject}" to the semantic index: {e}')
+
+    def __buffer(self, row: dict) -> None:
+        self.journal.write(dumps(row) + '\n')
+        self.journal.flush()
+        self.pending.append(row)
+        if len(self.pending) >= self.write_buffer_size:
+            self.__flush()
+        elif self.flush_timer is None:
+            self.flush_timer = Timer(self.write_buffer_seconds, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self) -> None:
+        """Write buffered records to the backing store."""
+        with self.lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.pending:
+            return
+        self.__write(self.pending)
+        self.pending = []
+        self.journal.truncate(0)
+
+    def __write(self, rows: list) -> None:
+        self.backend.append(rows)
+        if self.reputation:
+            self.reputation.record([(row['sender'], row['importance_level'], row.get('confidence')) for row in rows])
+        if self.near_duplicates:
+            self.near_duplicates.record([
+                (row['sender'], row['simhash'], row['importance_level']) for row in rows if row.get('simhash') is not None
+            ])
+        self.__start_compaction_if_due()
+
+    def __start_compaction_if_due(self) -> None:
+        if self.backend.compaction_due() and not (self.compaction and self.compaction.is_alive()):
+            self.compaction = Thread(target=self.compact, name="cache-compaction", daemon=True)
+            self.compaction.start()
+
+    def compact(self) -> None:
+        """Drop expired and evicted entries from the backing store."""
+        try:
+            with self.lock:
+                state = self.backend.begin_compaction()
+            # The slow rewrite runs without the lock, so lookups and new records are not held up
+            state = self.backend.write_compaction(state)
+            with self.lock:
+                self.backend.finish_compaction(state)
+        except Exception as e:
+            logger.exception(f"Cache compaction failed: {e}")
+            with self.lock:
+                self.backend.abort_compaction()
     
     def __evaluate_row(self, row) -> Optional[ImportanceLevel]:
         try:
@@ -78,18 +198,82 @@ class Cache:
 
     def exists(self, email: EmailWrapper) -> Optional[ImportanceLevel]:
         subject_hash = sha256(email.subject.encode('utf-8')).hexdigest()
-        with open(self.cache_file_path, 'r', newline='') as file:
-            reader = DictReader(file) 
-            for row in reader:
-                if 'email_subject_hash' not in row or 'sender' not in row:
-                    return None
-                
-                if row['email_subject_hash'] == subject_hash:
-                    return self.__evaluate_row(row)
-                
-                if row['sender'] == email.sender:
-                    return self.__evaluate_row(row)
-        return None
-    
+        with self.lock:
+            # Buffered records are the newest verdicts
+            row = next(
+                (row for row in reversed(self.pending) if row['email_subject_hash'] == subject_hash or row['sender'] == email.sender),
+                None
+            ) or self.backend.lookup(subject_hash, email.sender)
+        if row is None and self.reputation:
+            row = self.reputation.verdict(email.sender)
+            if row:
+                logger.info(
+                    f"{row['scope'].capitalize()} {row['key']} settled on {row['importance_level']} "
+                    f"({row['agreement']:.0%} of {row['verdicts']} verdicts, confidence {row['confidence']:.2f})"
+                )
+        return self.__evaluate_row(row) if row else None
+
+    def near_duplicate(self, email: EmailWrapper) -> Optional[ImportanceLevel]:
+        """The verdict of a near-identical email from the same domain. Needs the body, so unlike exists it
+        can only be asked once the body was fetched."""
+        if not self.near_duplicates:
+            return None
+        fingerprint = self.near_duplicates.fingerprint(email)
+        if fingerprint is None:
+            return None
+        row = self.near_duplicates.lookup(email.sender, fingerprint)
+        if row:
+            logger.info(f'Email "{email.subject}" is a near duplicate ({row["distance"]} bits) of one marked as {row["importance_level"]}')
+        return self.__evaluate_row(row) if row else None
+
+    def semantic_match(self, email: EmailWrapper) -> Optional[ImportanceLevel]:
+        """The verdict its nearest neighbours in embedding space agree on, if they are close enough."""
+        if not self.semantic:
+            return None
+        try:
+            vector = self.semantic.embed([email])
+            row = self.semantic.classify(vector)[0]
+        except Exception as e:
+            logger.warning(f'Semantic lookup for "{email.subject}" failed: {e}')
+            return None
+        if row is None:
+            with self.lock:
+                self.semantic_vectors[email] = vector
+            return None
+        logger.info(
+            f'Email "{email.subject}" resembles {row["votes"]} emails marked as {row["importance_level"]} '
+            f'(similarity {row["similarity"]:.3f}, agreement {row["agreement"]:.0%})'
+        )
+        return self.__evaluate_row(row)
+
+    def close(self) -> None:
+        """Flush buffered records, wait for a running compaction and release the storage backend."""
+        if self.journal is not None:
+            self.flush()
+        if self.compaction:
+            self.compaction.join()
+        with self.lock:
+            if self.journal is not None:
+                remove(self.journal_path)
+                self.journal.close()
+            self.backend.close()
+        if self.reputation:
+            self.reputation.close()
+        if self.near_duplicates:
+            stats = self.near_duplicates.stats()
+            if stats['lookups']:
+                logger.info(
+                    f"Near duplicates: {stats['hits']} of {stats['lookups']} lookups hit ({stats['hit_rate']:.1%}), "
+                    f"{stats['mean_lookup_ms']:.2f} ms per lookup"
+                )
+            self.near_duplicates.close()
+        if self.semantic:
+            stats = self.semantic.stats()
+            if stats['lookups']:
+                logger.info(
+                    f"Semantic cache: {stats['hits']} of {stats['lookups']} lookups hit ({stats['hit_rate']:.1%}), "
+                    f"{stats['mean_lookup_ms']:.2f} ms per lookup over {stats['entries']} embeddings"
+                )
+            self.semantic.close()
+
     # TODO - implement a method to clear the cache
-    # TODO - implement a method in which cache is evaluated three times. if it is still in the same category, then increment to exponential.
\ No newline at end of file
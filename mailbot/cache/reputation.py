@@ -0,0 +1,161 @@
+from os import path
+from configparser import ConfigParser
+from email.utils import parseaddr
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from typing import Iterable, Optional
+from loguru import logger
+
+# Mailbox providers whose users have nothing in common; their domain never gets a reputation
+SHARED_DOMAINS = (
+    "gmail.com, googlemail.com, outlook.com, hotmail.com, live.com, msn.com, yahoo.com, ymail.com, icloud.com, "
+    "me.com, mac.com, aol.com, proton.me, protonmail.com, gmx.com, gmx.de, gmx.net, web.de, mail.com, zoho.com"
+)
+# Public suffixes with two labels, so that shop.example.co.uk is registered as example.co.uk. Not the
+# whole public suffix list, just the ones common enough to matter for mail.
+TWO_LABEL_SUFFIXES = frozenset((
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "com.au", "net.au", "org.au", "co.nz", "co.jp", "ne.jp",
+    "co.in", "co.kr", "co.za", "com.br", "com.cn", "com.mx", "com.sg", "com.tr", "com.ar", "com.hk", "com.tw"
+))
+
+
+def normalize_address(sender: str) -> str:
+    """The bare, lower-cased address of a From header, without a +tag."""
+    address = parseaddr(sender)[1].strip().lower()
+    local, at, domain = address.rpartition('@')
+    if not at:
+        return address
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def registrable_domain(address: str) -> str:
+    """The domain a sender registered, e.g. mail.shop.example.co.uk -> example.co.uk."""
+    labels = address.rpartition('@')[2].strip('.').split('.')
+    if len(labels) <= 2:
+        return '.'.join(labels)
+    if '.'.join(labels[-2:]) in TWO_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+# Running distribution of LLM verdicts (and their confidences) per normalized sender address and per
+# registrable domain. Once the history of an address, or failing that of its domain, is large and
+# consistent enough, Cache serves its verdict without asking the LLM. Kept in SQLite (WAL) next to the
+# cache, so several processes can share it like the cache itself.
+class ReputationIndex:
+    def __init__(self, config: ConfigParser):
+        reputation_file = config.get("REPUTATION", "reputation_file", fallback="reputation.sqlite3")
+        self.reputation_file_path = path.join(path.dirname(path.abspath(__file__)), reputation_file)
+        self.min_samples = config.getint("REPUTATION", "min_samples", fallback=5)
+        self.min_agreement = config.getfloat("REPUTATION", "min_agreement", fallback=0.9)
+        self.min_confidence = config.getfloat("REPUTATION", "min_confidence", fallback=0.8)
+        self.shared_domains = frozenset(
+            domain.strip().lower()
+            for domain in config.get("REPUTATION", "shared_domains", fallback=SHARED_DOMAINS).split(',')
+            if domain.strip()
+        )
+
+        self.lock = Lock()
+        self.connection = connect(self.reputation_file_path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS reputation ("
+            " scope TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " importance_level TEXT NOT NULL,"
+            " verdicts INTEGER NOT NULL,"
+            " confidence_sum REAL NOT NULL,"
+            " confidence_count INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (scope, key, importance_level))"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+
+    def __keys(self, sender: str) -> list:
+        address = normalize_address(sender)
+        if not address:
+            return []
+        keys = [('address', address)]
+        domain = registrable_domain(address)
+        if domain and domain not in self.shared_domains:
+            keys.append(('domain', domain))
+        return keys
+
+    def __add(self, verdicts: Iterable) -> None:
+        now = time()
+        self.connection.executemany(
+            "INSERT INTO reputation (scope, key, importance_level, verdicts, confidence_sum, confidence_count, updated_at)"
+            " VALUES (?, ?, ?, 1, ?, ?, ?)"
+            " ON CONFLICT (scope, key, importance_level) DO UPDATE SET"
+            " verdicts = verdicts + 1, confidence_sum = confidence_sum + excluded.confidence_sum,"
+            " confidence_count = confidence_count + excluded.confidence_count, updated_at = excluded.updated_at",
+            (
+                (scope, key, importance_level, confidence or 0.0, int(confidence is not None), now)
+                for sender, importance_level, confidence in verdicts
+                for scope, key in self.__keys(sender)
+            )
+        )
+
+    def record(self, verdicts: list) -> None:
+        """Add LLM verdicts, given as (sender, importance_level, confidence or None), to the histories."""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.__add(verdicts)
+            self.connection.execute("COMMIT")
+
+    def backfill(self, rows: Iterable, source: str) -> None:
+        """Seed a new index with the verdicts already in the cache, given as cache rows. Runs once per index:
+        an index that already has histories only gets the marker. The cache keeps no confidences, so the seeded
+        verdicts count towards min_samples and agreement, and the first confident live verdict settles them."""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.connection.execute("SELECT 1 FROM metadata WHERE key = 'backfilled'").fetchone():
+                    self.connection.execute("ROLLBACK")
+                    return
+                verdicts = []
+                if not self.connection.execute("SELECT 1 FROM reputation LIMIT 1").fetchone():
+                    verdicts = [(row['sender'], row['importance_level'], None) for row in rows if row.get('sender')]
+                    self.__add(verdicts)
+                self.connection.execute("INSERT INTO metadata (key, value) VALUES ('backfilled', ?)", (source,))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if verdicts:
+            logger.info(f"Seeded sender reputations with {len(verdicts)} verdicts from {source}")
+
+    def __judge(self, rows: list) -> Optional[dict]:
+        total = sum(verdicts for _, verdicts, _, _ in rows)
+        if total < self.min_samples:
+            return None
+        importance_level, verdicts, confidence_sum, confidence_count = max(rows, key=lambda row: row[1])
+        agreement = verdicts / total
+        confidence = confidence_sum / confidence_count if confidence_count else 0.0
+        if agreement < self.min_agreement or confidence < self.min_confidence:
+            return None
+        return {'importance_level': importance_level, 'agreement': agreement, 'confidence': confidence, 'verdicts': total}
+
+    def verdict(self, sender: str) -> Optional[dict]:
+        """The settled verdict for the sender's address, else for its domain, or None."""
+        for scope, key in self.__keys(sender):
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT importance_level, verdicts, confidence_sum, confidence_count FROM reputation WHERE scope = ? AND key = ?",
+                    (scope, key)
+                ).fetchall()
+            if not rows:
+                continue
+            judged = self.__judge(rows)
+            if judged:
+                return dict(judged, scope=scope, key=key)
+            if sum(row[1] for row in rows) >= self.min_samples:
+                # A known address with a mixed history is not overruled by its domain
+                return None
+        return None
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,276 @@
+from os import O_CREAT, O_RDWR, close, open as os_open, path, pread, pwrite, stat, truncate
+from configparser import ConfigParser
+from contextlib import contextmanager
+from fcntl import LOCK_EX, LOCK_SH, LOCK_UN, flock
+from hashlib import blake2b
+from json import JSONDecodeError, dumps, loads
+from re import compile as compile_regex
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Optional
+import numpy as np
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+from loguru import logger
+from llm.ollamallm.session import RETRY_STATUSES, backoff, create_session
+from mail.emailwrapper import EmailWrapper
+
+# Verdicts are stored as their position in this tuple
+LEVELS = ('least_important', 'medium_important', 'most_important', 'scam')
+HEADER_BYTES = 256
+INITIAL_CAPACITY = 1024
+# Rows dequantized at a time when the vectors are stored as int8; small enough to stay in cache
+CHUNK_ROWS = 4096
+WORDS = compile_regex(r"\w+")
+
+
+def email_text(email: EmailWrapper, body_chars: int) -> str:
+    return f"From: {email.sender}\nSubject: {email.subject}\n\n{(email.body or '')[:body_chars]}"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Embeddings from Ollama's /api/embed endpoint, which takes a batch of inputs. Uses a pooled keep-alive
+# session and retries connection errors and 5xx answers like the LLM client, with its [OLLAMA] settings.
+class OllamaEmbedder:
+    def __init__(self, config: ConfigParser):
+        self.ollama_url: str = config["OLLAMA"]["ollama_base_url"]
+        self.model_name: str = config.get("SEMANTIC", "embedding_model", fallback="nomic-embed-text")
+        self.connect_timeout: float = config.getfloat("OLLAMA", "connect_timeout", fallback=5.0)
+        self.timeout: float = config.getfloat("SEMANTIC", "embedding_timeout", fallback=60.0)
+        self.max_retries: int = config.getint("OLLAMA", "max_retries", fallback=3)
+        self.retry_backoff: float = config.getfloat("OLLAMA", "retry_backoff_seconds", fallback=0.5)
+        self.retry_backoff_max: float = config.getfloat("OLLAMA", "retry_backoff_max_seconds", fallback=8.0)
+        self.session = create_session(config.getint("OLLAMA", "pool_size", fallback=4), {"Content-Type": "application/json"})
+
+    def embed(self, texts: list) -> np.ndarray:
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    f"{self.ollama_url}/embed",
+                    data=dumps({"model": self.model_name, "input": texts}),
+                    timeout=(self.connect_timeout, self.timeout)
+                )
+            except (ConnectionError, ChunkedEncodingError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Ollama embed connection failed ({e}); retrying")
+            else:
+                if response.status_code == 200:
+                    return np.asarray(response.json()["embeddings"], dtype=np.float32)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise Exception(f"Error calling Ollama embed API: {response.text}")
+                logger.warning(f"Ollama embed answered {response.status_code}; retrying")
+            attempt += 1
+            sleep(backoff(attempt, self.retry_backoff, self.retry_backoff_max))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+# Offline stand-in for an embedding model: words and word pairs hashed into a fixed number of
+# dimensions with a random sign. Similar wording gives similar vectors, which is enough for tests and
+# benchmarks, not for meaning.
+class HashingEmbedder:
+    def __init__(self, config: ConfigParser):
+        self.dimensions = config.getint("SEMANTIC", "embedding_dimensions", fallback=256)
+        self.model_name = f"hashing-{self.dimensions}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORDS.findall(text.lower())
+            for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+                digest = int.from_bytes(blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+                vectors[row, digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        return vectors
+
+
+def create_embedder(config: ConfigParser):
+    embedding_backend = config.get("SEMANTIC", "embedding_backend", fallback="ollama").strip().lower()
+    if embedding_backend == "ollama":
+        return OllamaEmbedder(config)
+    if embedding_backend == "hashing":
+        return HashingEmbedder(config)
+    raise ValueError(f"Unknown embedding_backend: {embedding_backend}")
+
+
+# Embeddings of the emails the LLM classified, with their verdicts, in memory-mapped files next to the
+# cache: <semantic_file>.vectors (one unit vector per row, float32 or int8 with a per-row scale in
+# .scales) and .labels. A new email is classified by a vote of its k nearest neighbours, found with one
+# matrix product over all rows; only neighbours above min_similarity vote.
+# Several processes share the files like the CSV cache: the row count lives in the header of the
+# .lock file, appends hold an exclusive flock on it and readers map whatever the files have grown to.
+class SemanticIndex:
+    def __init__(self, config: ConfigParser, embedder=None):
+        semantic_file = config.get("SEMANTIC", "semantic_file", fallback="semantic")
+        self.base_path = path.join(path.dirname(path.abspath(__file__)), semantic_file)
+        self.embedder = embedder or create_embedder(config)
+        self.body_chars = config.getint("SEMANTIC", "body_chars", fallback=1000)
+        self.dtype = "int8" if config.getboolean("SEMANTIC", "quantize", fallback=True) else "float32"
+        self.neighbours = config.getint("SEMANTIC", "neighbours", fallback=5)
+        self.min_similarity = config.getfloat("SEMANTIC", "min_similarity", fallback=0.9)
+        self.min_votes = config.getint("SEMANTIC", "min_votes", fallback=2)
+        self.min_agreement = config.getfloat("SEMANTIC", "min_agreement", fallback=0.8)
+
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+
+        self.lock = Lock()
+        self.count = 0
+        self.capacity = 0
+        self.dimensions: Optional[int] = None
+        self.vectors = self.scales = self.labels = None
+        self.lock_descriptor = os_open(self.base_path + '.lock', O_RDWR | O_CREAT, 0o644)
+        with self.__file_lock(LOCK_EX):
+            header = self.__read_header()
+            if header and (header['dtype'] != self.dtype or header['model'] != self.embedder.model_name):
+                logger.warning(
+                    f"Semantic index {self.base_path} holds {header['model']} {header['dtype']} vectors; "
+                    f"starting over with {self.embedder.model_name} {self.dtype}"
+                )
+                header = None
+            if header is None:
+                for suffix in ('.vectors', '.scales', '.labels'):
+                    open(self.base_path + suffix, 'wb').close()
+                header = {'count': 0, 'dimensions': None, 'dtype': self.dtype, 'model': self.embedder.model_name}
+                self.__write_header(header)
+        self.__load(header)
+
+    @contextmanager
+    def __file_lock(self, operation: int):
+        flock(self.lock_descriptor, operation)
+        try:
+            yield
+        finally:
+            flock(self.lock_descriptor, LOCK_UN)
+
+    def __read_header(self) -> Optional[dict]:
+        try:
+            return loads(pread(self.lock_descriptor, HEADER_BYTES, 0))
+        except (JSONDecodeError, UnicodeDecodeError):
+            return None
+
+    def __write_header(self, header: dict) -> None:
+        pwrite(self.lock_descriptor, dumps(header).ljust(HEADER_BYTES).encode(), 0)
+
+    def __load(self, header: dict) -> None:
+        """Map the files as far as they have grown (by this or another process)."""
+        self.count = header['count']
+        self.dimensions = header['dimensions']
+        capacity = stat(self.base_path + '.labels').st_size
+        if self.dimensions is None or capacity == self.capacity:
+            return
+        self.capacity = capacity
+        self.vectors = np.memmap(self.base_path + '.vectors', dtype=self.dtype, mode='r+', shape=(capacity, self.dimensions))
+        self.labels = np.memmap(self.base_path + '.labels', dtype=np.int8, mode='r+', shape=(capacity,))
+        if self.dtype == "int8":
+            self.scales = np.memmap(self.base_path + '.scales', dtype=np.float32, mode='r+', shape=(capacity,))
+
+    def __grow(self, header: dict, rows: int) -> None:
+        capacity = max(INITIAL_CAPACITY, self.capacity)
+        while capacity < rows:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        truncate(self.base_path + '.vectors', capacity * header['dimensions'] * np.dtype(self.dtype).itemsize)
+        truncate(self.base_path + '.labels', capacity)
+        if self.dtype == "int8":
+            truncate(self.base_path + '.scales', capacity * 4)
+        self.__load(header)
+
+    def embed(self, emails: list) -> np.ndarray:
+        """Unit-length embeddings of the emails, one row each."""
+        return normalize(self.embedder.embed([email_text(email, self.body_chars) for email in emails]))
+
+    def add(self, vectors: np.ndarray, importance_levels: list) -> None:
+        """Store embeddings (from embed) with the verdicts the LLM gave them."""
+        vectors = normalize(vectors)
+        labels = np.array([LEVELS.index(level) for level in importance_levels], dtype=np.int8)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            vectors = np.rint(vectors / scales[:, None]).astype(np.int8)
+        with self.lock, self.__file_lock(LOCK_EX):
+            header = self.__read_header()
+            if header['dimensions'] is None:
+                header['dimensions'] = vectors.shape[1]
+            elif header['dimensions'] != vectors.shape[1]:
+                raise ValueError(f"Expected {header['dimensions']}-dimensional embeddings, got {vectors.shape[1]}")
+            self.__load(header)
+            start = header['count']
+            self.__grow(header, start + len(vectors))
+            self.vectors[start:start + len(vectors)] = vectors
+            self.labels[start:start + len(vectors)] = labels
+            if self.dtype == "int8":
+                self.scales[start:start + len(vectors)] = scales
+            header['count'] = start + len(vectors)
+            self.__write_header(header)
+            self.count = header['count']
+
+    def __similarities(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every stored row (axis 0) with every query (axis 1)."""
+        if self.dtype == "float32":
+            return self.vectors[:self.count] @ queries.T
+        similarities = np.empty((self.count, len(queries)), dtype=np.float32)
+        for start in range(0, self.count, CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, self.count)
+            np.matmul(self.vectors[start:end].astype(np.float32), queries.T, out=similarities[start:end])
+            similarities[start:end] *= self.scales[start:end, None]
+        return similarities
+
+    def classify(self, vectors: np.ndarray) -> list:
+        """The k-NN verdict for each embedding, or None where the neighbours are too far or disagree."""
+        started = perf_counter()
+        queries = normalize(vectors)
+        results = [None] * len(queries)
+        with self.lock:
+            with self.__file_lock(LOCK_SH):
+                self.__load(self.__read_header())
+            if self.count:
+                similarities = self.__similarities(queries)
+                k = min(self.neighbours, self.count)
+                nearest = np.argpartition(-similarities, k - 1, axis=0)[:k]
+                for column in range(len(queries)):
+                    rows = nearest[:, column]
+                    close = rows[similarities[rows, column] >= self.min_similarity]
+                    if len(close) < self.min_votes:
+                        continue
+                    weights = np.bincount(self.labels[close], weights=similarities[close, column], minlength=len(LEVELS))
+                    winner = int(weights.argmax())
+                    agreement = weights[winner] / weights.sum()
+                    if agreement >= self.min_agreement:
+                        results[column] = {
+                            'importance_level': LEVELS[winner],
+                            'similarity': float(similarities[close, column].max()),
+                            'votes': len(close),
+                            'agreement': float(agreement),
+                        }
+            self.lookups += len(queries)
+            self.hits += sum(result is not None for result in results)
+            self.lookup_seconds += perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': self.count,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'mean_lookup_ms': self.lookup_seconds / self.lookups * 1000 if self.lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            for mapping in (self.vectors, self.scales, self.labels):
+                if mapping is not None:
+                    mapping.flush()
+            self.vectors = self.scales = self.labels = None
+            close(self.lock_descriptor)
+        if hasattr(self.embedder, 'close'):
+            self.embedder.close()
@@ -0,0 +1,182 @@
+from os import path
+from configparser import ConfigParser
+from hashlib import blake2b
+from re import compile as compile_regex
+from sqlite3 import connect
+from threading import Lock
+from time import perf_counter, time
+from typing import Optional
+from mail.emailwrapper import EmailWrapper
+from cache.backends import ExpiryPolicy
+from cache.reputation import normalize_address, registrable_domain
+
+BITS = 64
+# Candidates compared per lookup; a template seen thousands of times only needs its newest copies
+MAX_CANDIDATES = 256
+URLS = compile_regex(r"https?://\S+|www\.\S+")
+NUMBERS = compile_regex(r"\d+(?:[.,:/-]\d+)*")
+TOKENS = compile_regex(r"\w+")
+REPLY_PREFIXES = compile_regex(r"^(?:\s*(?:re|fwd?|aw|wg)\s*:)+")
+
+
+def signed(value: int) -> int:
+    """SQLite integers are signed 64 bit."""
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def features(subject: str, body: str) -> list:
+    """Words and word pairs of the normalized text. Numbers, dates and links, which is what templated
+    mail varies, are all reduced to one token each."""
+    text = REPLY_PREFIXES.sub("", subject.lower()) + "\n" + body.lower()
+    tokens = TOKENS.findall(NUMBERS.sub(" 0 ", URLS.sub(" url ", text)))
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+def simhash(items: list) -> int:
+    if not items:
+        return 0
+    bits = [format(int.from_bytes(blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big'), '064b') for item in items]
+    half = len(bits) / 2
+    return int(''.join('1' if column.count('1') > half else '0' for column in zip(*bits)), 2)
+
+
+# SimHash fingerprints of the emails the LLM classified, for templated mail (shipping notices,
+# newsletters) whose subject changes with every order number or date. Fingerprints within
+# max_distance bits of each other are near duplicates. They are found through LSH bands: the 64 bits
+# are split into max_distance + 1 bands, so two fingerprints that close agree exactly on at least one
+# band, and only fingerprints sharing a band are compared. Matches are limited to the sender's
+# registrable domain, so a phishing copy of a shop's template does not inherit the shop's verdict.
+class NearDuplicateIndex:
+    def __init__(self, config: ConfigParser):
+        near_duplicate_file = config.get("NEAR_DUPLICATES", "near_duplicate_file", fallback="near_duplicates.sqlite3")
+        self.near_duplicate_file_path = path.join(path.dirname(path.abspath(__file__)), near_duplicate_file)
+        self.body_chars = config.getint("NEAR_DUPLICATES", "body_chars", fallback=500)
+        self.min_tokens = config.getint("NEAR_DUPLICATES", "min_tokens", fallback=8)
+        self.max_distance = config.getint("NEAR_DUPLICATES", "max_distance", fallback=6)
+        self.ttl = ExpiryPolicy(config).ttl
+
+        bands = self.max_distance + 1
+        if not 0 < bands <= BITS:
+            raise ValueError(f"max_distance must be between 0 and {BITS - 1}")
+        edges = [band * BITS // bands for band in range(bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+
+        self.lock = Lock()
+        self.connection = connect(self.near_duplicate_file_path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " id INTEGER PRIMARY KEY,"
+            " fingerprint INTEGER NOT NULL,"
+            " domain TEXT NOT NULL,"
+            " importance_level TEXT NOT NULL,"
+            " added_at REAL NOT NULL,"
+            " UNIQUE (fingerprint, domain, importance_level))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS bands ("
+            " domain TEXT NOT NULL, band INTEGER NOT NULL, value INTEGER NOT NULL, id INTEGER NOT NULL,"
+            " PRIMARY KEY (domain, band, value, id)) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.__prepare()
+
+    def __prepare(self) -> None:
+        """Forget expired fingerprints and re-band the rest if max_distance changed."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            cutoff = time() - self.ttl
+            self.connection.execute("DELETE FROM bands WHERE id IN (SELECT id FROM fingerprints WHERE added_at < ?)", (cutoff,))
+            self.connection.execute("DELETE FROM fingerprints WHERE added_at < ?", (cutoff,))
+            layout = self.connection.execute("SELECT value FROM metadata WHERE key = 'bands'").fetchone()
+            if layout is None or int(layout[0]) != len(self.bands):
+                self.connection.execute("DELETE FROM bands")
+                for record_id, fingerprint, domain in self.connection.execute("SELECT id, fingerprint, domain FROM fingerprints").fetchall():
+                    self.__insert_bands(record_id, fingerprint % (1 << BITS), domain)
+                self.connection.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('bands', ?)", (str(len(self.bands)),))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def __band_values(self, fingerprint: int) -> list:
+        return [(band, signed((fingerprint >> start) & mask)) for band, (start, mask) in enumerate(self.bands)]
+
+    def __insert_bands(self, record_id: int, fingerprint: int, domain: str) -> None:
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO bands (domain, band, value, id) VALUES (?, ?, ?, ?)",
+            [(domain, band, value, record_id) for band, value in self.__band_values(fingerprint)]
+        )
+
+    def fingerprint(self, email: EmailWrapper) -> Optional[int]:
+        """The SimHash of the subject and the start of the body, or None if there is too little text to tell."""
+        items = features(email.subject or "", (email.body or "")[:self.body_chars])
+        # Word pairs are one fewer than words
+        if (len(items) + 1) // 2 < self.min_tokens:
+            return None
+        return simhash(items)
+
+    def record(self, fingerprints: list) -> None:
+        """Add LLM verdicts, given as (sender, fingerprint, importance_level)."""
+        now = time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for sender, fingerprint, importance_level in fingerprints:
+                    domain = registrable_domain(normalize_address(sender))
+                    # A template seen again only refreshes its fingerprint
+                    record_id = self.connection.execute(
+                        "INSERT INTO fingerprints (fingerprint, domain, importance_level, added_at) VALUES (?, ?, ?, ?)"
+                        " ON CONFLICT (fingerprint, domain, importance_level) DO UPDATE SET added_at = excluded.added_at"
+                        " RETURNING id",
+                        (signed(fingerprint), domain, importance_level, now)
+                    ).fetchone()[0]
+                    self.__insert_bands(record_id, fingerprint, domain)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def lookup(self, sender: str, fingerprint: int) -> Optional[dict]:
+        """The verdict of the nearest (then newest) fingerprint within max_distance bits from the sender's domain."""
+        started = perf_counter()
+        band_values = self.__band_values(fingerprint)
+        query = (
+            "SELECT fingerprint, importance_level FROM fingerprints WHERE domain = ? AND added_at >= ? AND id IN ("
+            + " UNION ".join("SELECT id FROM bands WHERE domain = ? AND band = ? AND value = ?" for _ in band_values)
+            + ") ORDER BY added_at DESC LIMIT ?"
+        )
+        domain = registrable_domain(normalize_address(sender))
+        parameters = [domain, time() - self.ttl]
+        for band, value in band_values:
+            parameters += [domain, band, value]
+        with self.lock:
+            rows = self.connection.execute(query, parameters + [MAX_CANDIDATES]).fetchall()
+        best = None
+        for candidate, importance_level in rows:
+            distance = (fingerprint ^ candidate % (1 << BITS)).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best['distance']):
+                best = {'importance_level': importance_level, 'distance': distance}
+        with self.lock:
+            self.lookups += 1
+            self.hits += best is not None
+            self.lookup_seconds += perf_counter() - started
+        return best
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'mean_lookup_ms': self.lookup_seconds / self.lookups * 1000 if self.lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
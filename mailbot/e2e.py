@@ -1,79 +1,373 @@
 import configparser
-from typing import Optional
+from argparse import ArgumentParser
+from asyncio import Queue, create_task, gather, run, to_thread
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from signal import signal, SIGINT, SIGTERM
+from threading import Event, Lock, Thread
+from typing import AsyncIterator, Iterator, Optional, Union
 
-from mail.imapservice import ImapService
 from mail.emailwrapper import EmailWrapper
+from mail.imapservice import ImapService
+from mail.asyncimapservice import AsyncImapService
+from mail.imappool import ImapConnectionPool
+from mail.syncstate import SyncState
+from workqueue.workqueue import WorkQueue
 from llm.ollamallm.llm import LLM
+from llm.ollamallm.options import DEFAULT_NUM_CTX
 from cache.cache import Cache, ImportanceLevel
+from triage.triage import PreClassifier
+from pipeline import Pipeline, PipelineSettings, serialized
 from prompt.importance_evaluator import ImportanceEvaulator
+from prompt.batch_importance_evaluator import BatchImportanceEvaluator
 from loguru import logger
 
 
-def process_mailbox(imapService: ImapService, cacheService: Optional[Cache], llm: LLM, mailbox: str, max_retries: int = 2):
-    attempts = 0
-    while attempts <= max_retries:
-        email_ids = imapService.fetch_email_ids(mailbox)
-        logger.info(f"Processing {len(email_ids)} email(s) from {mailbox} (Attempt {attempts + 1})")
-        failed = False
-
-        for email_id in email_ids:
-            email_data: Optional[EmailWrapper] = imapService.fetch_email(email_id)
-            if not email_data:
-                logger.warning(f"Failed to fetch email ID {email_id}. Restarting and retrying whole mailbox...")
-                failed = True
-                break 
-
-            importance_level: Optional[ImportanceLevel] = None
-            if cacheService:
-                importance_level = cacheService.exists(email_data)
-
-            if importance_level:
-                logger.info(f'Email "{email_data.subject}" already marked as {importance_level.value}')
-                imapService.move_to_folder_and_mark_unread(email_id, importance_level)
-                continue
-
-            prompt = ImportanceEvaulator(email_data)
-            llm_response = llm.generate(prompt)
-
-            if llm_response["importance"] > 0 and llm_response["confidence"] > 0:
-                if llm_response["importance"] == -1:
-                    importance = ImportanceLevel.SCAM
-                elif llm_response["importance"] > 0.75:
-                    importance = ImportanceLevel.MOST_IMPORTANT
-                elif llm_response["importance"] > 0.4:
-                    importance = ImportanceLevel.MEDIUM_IMPORTANT
-                else:
-                    importance = ImportanceLevel.LEAST_IMPORTANT
-                if cacheService:
-                    cacheService.add_record(email_data, importance, llm_response["reasoning"])
-                    logger.info(f'Email "{email_data.subject}" cached and moved to {importance.value}')
-                else:
-                    logger.info(f'Email "{email_data.subject}" processed and moved to {importance.value} (cache disabled)')
-
-                imapService.move_to_folder_and_mark_unread(email_id, importance)
-        
-        if not failed:
-            break
+# The trained pre-classifier only looks at the sender and subject, so it can decide before the body is fetched.
+def pre_classify(email_data: EmailWrapper, preClassifier: PreClassifier) -> Optional[ImportanceLevel]:
+    prediction = preClassifier.predict(email_data)
+    if not prediction:
+        return None
+    importance, confidence = prediction
+    logger.info(f'Email "{email_data.subject}" pre-classified as {importance.value} (confidence {confidence:.3f})')
+    return importance
+
+
+# The verdict layers in front of the LLM; None means the email has to be escalated. pre_classified tells
+# that the pipeline already asked the pre-classifier when it had the headers.
+def quick_verdict(email_data: EmailWrapper, cacheService: Optional[Cache],
+                  preClassifier: Optional[PreClassifier] = None, pre_classified: bool = False) -> Optional[ImportanceLevel]:
+    # Templated mail (new order number, same shipping notice) reuses the verdict of an earlier copy, and
+    # an email close enough to several already classified ones gets the verdict they agree on
+    if cacheService:
+        importance = cacheService.near_duplicate(email_data) or cacheService.semantic_match(email_data)
+        if importance:
+            return importance
+
+    # Only what the trained pre-classifier is unsure about is escalated to the LLM
+    if preClassifier and not pre_classified:
+        return pre_classify(email_data, preClassifier)
+    return None
+
+
+# Maps an LLM verdict to a folder and teaches it to the cache and the pre-classifier.
+def record_llm_verdict(email_data: EmailWrapper, llm_response: dict, cacheService: Optional[Cache],
+                       preClassifier: Optional[PreClassifier] = None) -> Optional[ImportanceLevel]:
+    if llm_response["importance"] > 0 and llm_response["confidence"] > 0:
+        if llm_response["importance"] == -1:
+            importance = ImportanceLevel.SCAM
+        elif llm_response["importance"] > 0.75:
+            importance = ImportanceLevel.MOST_IMPORTANT
+        elif llm_response["importance"] > 0.4:
+            importance = ImportanceLevel.MEDIUM_IMPORTANT
         else:
-            imapService.restart()
-            attempts += 1
+            importance = ImportanceLevel.LEAST_IMPORTANT
+        if preClassifier:
+            preClassifier.learn(email_data, importance)
+        if cacheService:
+            cacheService.add_record(email_data, importance, llm_response["reasoning"], llm_response["confidence"])
+            logger.info(f'Email "{email_data.subject}" cached and moved to {importance.value}')
+        else:
+            logger.info(f'Email "{email_data.subject}" processed and moved to {importance.value} (cache disabled)')
+        return importance
+    return None
 
-    if attempts > max_retries:
-        logger.error(f"Failed to process mailbox {mailbox} after {max_retries} retries.")
 
+def classify_email(email_data: EmailWrapper, cacheService: Optional[Cache], llm: LLM,
+                   preClassifier: Optional[PreClassifier] = None, pre_classified: bool = False) -> Optional[ImportanceLevel]:
+    importance = quick_verdict(email_data, cacheService, preClassifier, pre_classified)
+    if importance:
+        return importance
+    prompt = ImportanceEvaulator(email_data)
+    return record_llm_verdict(email_data, llm.generate(prompt), cacheService, preClassifier)
+
+
+# The safe_* variants return the exception instead of raising it (like gather(return_exceptions=True)),
+# so callers can tell a failed classification, which is retried, from an email the LLM gave no verdict for.
+def safe_llm_verdict(email_data: EmailWrapper, cacheService: Optional[Cache], llm: LLM,
+                     preClassifier: Optional[PreClassifier] = None) -> Union[ImportanceLevel, Exception, None]:
+    try:
+        return record_llm_verdict(email_data, llm.generate(ImportanceEvaulator(email_data)), cacheService, preClassifier)
+    except Exception as e:
+        logger.exception(f'Failed to classify email "{email_data.subject}": {e}')
+        return e
+
+
+# Classifies several emails, sending the ones the quick layers cannot decide to the LLM max_batch at a
+# time (fewer when they would not fit the context window). Emails a batched answer leaves out are
+# classified one at a time. Returns the verdicts in the order of the emails, with the exception in place of
+# the verdict of an email whose classification failed.
+def classify_emails(emails: list, cacheService: Optional[Cache], llm: LLM, preClassifier: Optional[PreClassifier] = None,
+                    max_batch: int = 8, pre_classified: bool = False) -> list:
+    verdicts = {}
+    escalated = []
+    for email_data in emails:
+        try:
+            verdicts[id(email_data)] = quick_verdict(email_data, cacheService, preClassifier, pre_classified)
+        except Exception as e:
+            logger.exception(f'Failed to classify email "{email_data.subject}": {e}')
+            verdicts[id(email_data)] = e
+            continue
+        if verdicts[id(email_data)] is None:
+            escalated.append(email_data)
+
+    num_ctx = llm.options.num_ctx or DEFAULT_NUM_CTX
+    for batch in BatchImportanceEvaluator.pack(escalated, num_ctx, max_batch):
+        if len(batch) == 1:
+            verdicts[id(batch[0])] = safe_llm_verdict(batch[0], cacheService, llm, preClassifier)
+            continue
+        prompt = BatchImportanceEvaluator(batch)
+        try:
+            answers = llm.generate(prompt)
+        except Exception as e:
+            logger.warning(f"Batched classification of {len(batch)} emails failed: {e}. Classifying them one at a time")
+            answers = {}
+        for email_id, llm_response in answers.items():
+            email_data = prompt.emails[email_id]
+            try:
+                verdicts[id(email_data)] = record_llm_verdict(email_data, llm_response, cacheService, preClassifier)
+            except Exception as e:
+                logger.exception(f'Failed to record the verdict for email "{email_data.subject}": {e}')
+                verdicts[id(email_data)] = e
+        for email_data in prompt.unanswered(answers):
+            verdicts[id(email_data)] = safe_llm_verdict(email_data, cacheService, llm, preClassifier)
+    return [verdicts[id(email_data)] for email_data in emails]
+
+
+# Returns True when the cache already knows the email or the pre-classifier is confident about its headers;
+# the move is then queued without a body fetch or an LLM call.
+def record_header_verdict(email_data: EmailWrapper, cacheService: Optional[Cache], workQueue: WorkQueue, mailbox: str,
+                          uidvalidity: int, pending_moves: dict, preClassifier: Optional[PreClassifier] = None) -> bool:
+    importance_level: Optional[ImportanceLevel] = None
+    if cacheService:
+        importance_level = cacheService.exists(email_data)
+        if importance_level:
+            logger.info(f'Email "{email_data.subject}" already marked as {importance_level.value}')
+    if not importance_level and preClassifier:
+        importance_level = pre_classify(email_data, preClassifier)
+    if not importance_level:
+        workQueue.mark_fetched(mailbox, uidvalidity, [email_data.uid])
+        return False
+    workQueue.mark_classified(mailbox, uidvalidity, email_data.uid, importance_level.value)
+    pending_moves[importance_level].append(email_data.uid)
+    return True
+
+
+# A failed classification is retried with backoff; an email the LLM deliberately gave no verdict for
+# (importance or confidence <= 0) stays where it is and is not asked about again.
+def record_classification(email_data: EmailWrapper, importance: Union[ImportanceLevel, Exception, None], workQueue: WorkQueue,
+                          mailbox: str, uidvalidity: int, pending_moves: dict) -> None:
+    if isinstance(importance, Exception):
+        workQueue.mark_failed(mailbox, uidvalidity, [email_data.uid], f"classification failed: {importance}")
+    elif importance:
+        workQueue.mark_classified(mailbox, uidvalidity, email_data.uid, importance.value)
+        pending_moves[importance].append(email_data.uid)
+    else:
+        workQueue.mark_skipped(mailbox, uidvalidity, [email_data.uid], "no usable classification")
+
+
+def safe_classify_email(email_data: EmailWrapper, cacheService: Optional[Cache], llm: LLM,
+                        preClassifier: Optional[PreClassifier] = None, pre_classified: bool = False) -> Union[ImportanceLevel, Exception, None]:
+    try:
+        return classify_email(email_data, cacheService, llm, preClassifier, pre_classified)
+    except Exception as e:
+        logger.exception(f'Failed to classify email "{email_data.subject}": {e}')
+        return e
+
+
+# Marks what was fetched but never classified, or never fetched at all, as failed. Returns the number of such emails.
+def record_unfinished(to_fetch: list, fetched: set, misses: set, classified: set, workQueue: WorkQueue, mailbox: str, uidvalidity: int) -> int:
+    missing = [uid for uid in to_fetch if uid not in fetched]
+    if missing:
+        workQueue.mark_failed(mailbox, uidvalidity, missing, "fetch failed")
+    unread = [uid for uid in misses if uid not in classified]
+    if unread:
+        workQueue.mark_failed(mailbox, uidvalidity, unread, "body fetch failed")
+    if missing or unread:
+        logger.warning(f"Failed to fetch {len(missing) + len(unread)} email(s) from {mailbox}. They will be retried with backoff.")
+    return len(missing) + len(unread)
+
+
+# Enqueues the UIDs found by fetch_email_ids and returns the due work as (uids_to_fetch, {importance: [uid, ...]}).
+def checkpoint_mailbox(imapService, workQueue: WorkQueue, mailbox: str, email_ids: list) -> tuple:
+    uidvalidity = (imapService.selected_state or {}).get('uidvalidity') or 0
+    if email_ids:
+        workQueue.enqueue(mailbox, uidvalidity, email_ids)
+    imapService.commit_sync_state(mailbox)
+
+    to_fetch, to_move = workQueue.due(mailbox, uidvalidity)
+    pending_moves: dict[ImportanceLevel, list] = defaultdict(list)
+    for uid, importance_level in to_move:
+        pending_moves[ImportanceLevel(importance_level)].append(uid)
+    if to_fetch or to_move:
+        logger.info(f"Processing {len(to_fetch)} email(s) and {len(to_move)} pending move(s) from {mailbox}")
+    return uidvalidity, to_fetch, pending_moves
+
+
+# Every UID found by the search is checkpointed in the work queue before the sync state moves past it, so a
+# failure only retries (with backoff) the messages that failed instead of re-running the whole mailbox.
+# The mailbox runs as a pipeline: fetch -> cache lookup -> (partial) body fetch -> LLM -> move, so the
+# connection keeps fetching and moving while the LLM works. The connection runs one command at a time, so
+# the fetch, body and move stages take turns on it between commands.
+def process_mailbox(imapService: ImapService, cacheService: Optional[Cache], llm: LLM, workQueue: WorkQueue, mailbox: str,
+                    preClassifier: Optional[PreClassifier] = None, settings: Optional[PipelineSettings] = None):
+    settings = settings or PipelineSettings()
+    email_ids = imapService.fetch_email_ids(mailbox)
+    uidvalidity, to_fetch, pending_moves = checkpoint_mailbox(imapService, workQueue, mailbox, email_ids)
+    if not to_fetch and not pending_moves:
+        return
+    fetched, misses, classified = set(), set(), set()
+    connection = Lock()
+    pipeline = Pipeline(f"pipeline-{mailbox}")
+
+    def fetch(uids: list) -> None:
+        emails = imapService.fetch_headers(uids) if imapService.header_first_fetch else imapService.fetch_emails(uids)
+        for email_data in serialized(emails, connection):
+            fetched.add(email_data.uid)
+            pipeline.put("lookup", email_data)
+
+    # Cache hits and confident pre-classifications are decided on headers alone; only the rest go on to the
+    # (partial) body fetch
+    def lookup(email_data: EmailWrapper) -> None:
+        hits = defaultdict(list)
+        if record_header_verdict(email_data, cacheService, workQueue, mailbox, uidvalidity, hits, preClassifier):
+            pipeline.put_all("move", hits.items())
+        else:
+            misses.add(email_data.uid)
+            pipeline.put("bodies" if imapService.header_first_fetch else "classify", email_data)
+
+    def bodies(emails: list) -> None:
+        with connection:
+            complete = list(imapService.fetch_partial_bodies(emails))
+        pipeline.put_all("classify", complete)
+
+    def classify(email_data: EmailWrapper) -> None:
+        classified.add(email_data.uid)
+        importance = safe_classify_email(email_data, cacheService, llm, preClassifier, pre_classified=True)
+        moves = defaultdict(list)
+        record_classification(email_data, importance, workQueue, mailbox, uidvalidity, moves)
+        pipeline.put_all("move", moves.items())
+
+    def classify_batch(emails: list) -> None:
+        classified.update(email_data.uid for email_data in emails)
+        moves = defaultdict(list)
+        for email_data, importance in zip(emails, classify_emails(emails, cacheService, llm, preClassifier, settings.llm_batch_size, pre_classified=True)):
+            record_classification(email_data, importance, workQueue, mailbox, uidvalidity, moves)
+        pipeline.put_all("move", moves.items())
+
+    # UIDs stay valid across moves, so every folder in a batch gets one move (and at most one expunge)
+    def move(batch: list) -> None:
+        by_folder = defaultdict(list)
+        for importance, uids in batch:
+            by_folder[importance].extend(uids)
+        for importance, uids in by_folder.items():
+            with connection:
+                moved = imapService.move_emails(uids, importance)
+            if moved:
+                workQueue.mark_moved(mailbox, uidvalidity, uids)
+            else:
+                workQueue.mark_failed(mailbox, uidvalidity, uids, f"move to {importance.value} failed")
+
+    pipeline.add_stage("fetch", fetch, queue_size=1)
+    pipeline.add_stage("lookup", lookup, workers=settings.lookup_workers, queue_size=settings.queue_size)
+    pipeline.add_stage("bodies", bodies, queue_size=settings.queue_size, batch_size=settings.body_batch_size)
+    if settings.llm_batch_size > 1:
+        pipeline.add_stage("classify", classify_batch, workers=settings.llm_workers, queue_size=settings.queue_size,
+                           batch_size=settings.llm_batch_size, linger=settings.llm_batch_linger_seconds)
+    else:
+        pipeline.add_stage("classify", classify, workers=settings.llm_workers, queue_size=settings.queue_size)
+    pipeline.add_stage("move", move, queue_size=settings.queue_size, batch_size=settings.move_batch_size,
+                       linger=settings.move_linger_seconds)
+    with pipeline:
+        pipeline.put_all("move", pending_moves.items())
+        pipeline.put("fetch", to_fetch)
+
+    if record_unfinished(to_fetch, fetched, misses, classified, workQueue, mailbox, uidvalidity):
+        imapService.restart()
+
+
+# asyncio engine: the fetches of a mailbox are pipelined on one connection and every email is classified in a
+# worker thread while the following chunks are still downloading.
+async def process_mailbox_async(imapService: AsyncImapService, cacheService: Optional[Cache], llm: LLM, workQueue: WorkQueue, mailbox: str,
+                                preClassifier: Optional[PreClassifier] = None):
+    email_ids = await imapService.fetch_email_ids(mailbox)
+    uidvalidity, to_fetch, pending_moves = checkpoint_mailbox(imapService, workQueue, mailbox, email_ids)
+    if not to_fetch and not pending_moves:
+        return
+    fetched, misses, classified = set(), set(), set()
+    to_classify: Queue = Queue(maxsize=imapService.fetch_chunk_size)
+
+    async def classify_worker():
+        while (email_data := await to_classify.get()) is not None:
+            classified.add(email_data.uid)
+            importance = await to_thread(safe_classify_email, email_data, cacheService, llm, preClassifier, pre_classified=True)
+            record_classification(email_data, importance, workQueue, mailbox, uidvalidity, pending_moves)
+
+    async def cache_misses(emails: AsyncIterator[EmailWrapper]) -> AsyncIterator[EmailWrapper]:
+        async for email_data in emails:
+            fetched.add(email_data.uid)
+            if not record_header_verdict(email_data, cacheService, workQueue, mailbox, uidvalidity, pending_moves, preClassifier):
+                misses.add(email_data.uid)
+                yield email_data
+
+    worker = create_task(classify_worker())
+    try:
+        if imapService.header_first_fetch:
+            headers = [email_data async for email_data in cache_misses(imapService.fetch_headers(to_fetch))]
+            emails_to_classify = imapService.fetch_partial_bodies(headers)
+        else:
+            emails_to_classify = cache_misses(imapService.fetch_emails(to_fetch))
+        async for email_data in emails_to_classify:
+            await to_classify.put(email_data)
+    finally:
+        await to_classify.put(None)
+        await worker
+
+    results = await imapService.move_many(pending_moves)
+    for importance, moved in results.items():
+        if moved:
+            workQueue.mark_moved(mailbox, uidvalidity, pending_moves[importance])
+        else:
+            workQueue.mark_failed(mailbox, uidvalidity, pending_moves[importance], f"move to {importance.value} failed")
+
+    if record_unfinished(to_fetch, fetched, misses, classified, workQueue, mailbox, uidvalidity):
+        await imapService.restart()
+
+
+def process_mailbox_from_pool(pool: ImapConnectionPool, config: configparser.ConfigParser, sync_state: Optional[SyncState],
+                              cacheService: Optional[Cache], llm: LLM, workQueue: WorkQueue, mailbox: str,
+                              preClassifier: Optional[PreClassifier] = None):
+    with pool.connection() as client_wrapper:
+        imapService = ImapService(config, client_wrapper, sync_state)
+        process_mailbox(imapService, cacheService, llm, workQueue, mailbox, preClassifier, PipelineSettings.from_config(config))
 
-def process_emails(config: configparser.ConfigParser):
-    imapService = ImapService(config)
-    llm = LLM(config)
 
+def create_cache_service(config: configparser.ConfigParser) -> Optional[Cache]:
     cache_enabled = config.getboolean("CACHE", "cache_enabled", fallback=True)
-    cacheService: Optional[Cache] = None
     if cache_enabled:
-        cacheService = Cache(config)
         logger.info("Cache service initialized.")
-    else:
-        logger.info("Cache service disabled by configuration.")
+        return Cache(config)
+    logger.info("Cache service disabled by configuration.")
+    return None
+
+
+def create_pre_classifier(config: configparser.ConfigParser, cacheService: Optional[Cache]) -> Optional[PreClassifier]:
+    if config.getboolean("TRIAGE", "triage_enabled", fallback=True):
+        return PreClassifier(config, cacheService.cache_file_path if cacheService else None)
+    logger.info("Pre-classifier disabled by configuration.")
+    return None
+
+
+def close_services(llm: LLM, workQueue: WorkQueue, cacheService: Optional[Cache], preClassifier: Optional[PreClassifier]) -> None:
+    llm.close()
+    workQueue.close()
+    if cacheService:
+        cacheService.close()
+    if preClassifier:
+        preClassifier.close()
+
 
+def filter_candidate_mailboxes(mailboxes: list, config: configparser.ConfigParser) -> list:
     most_important_folder = config["IMAP"]["most_important_folder"]
     medium_important_folder = config["IMAP"]["medium_important_folder"]
     less_important_folder = config["IMAP"]["less_important_folder"]
@@ -83,23 +377,170 @@ def process_emails(config: configparser.ConfigParser):
         "Important", "Sent", "Drafts", "Trash", "Spam", "Junk", "Archive"
     ]
 
+    candidates = []
+    for mailbox in mailboxes:
+        if mailbox in exception_list:
+            logger.info(f"{mailbox} is in the exception list. Skipping...")
+            continue
+        candidates.append(mailbox)
+    return candidates
+
+
+def get_candidate_mailboxes(imapService: ImapService, config: configparser.ConfigParser) -> list:
+    return filter_candidate_mailboxes(imapService.get_mailbox_list(), config)
+
+
+def process_emails(config: configparser.ConfigParser):
+    pool = ImapConnectionPool(config)
+    llm = LLM(config)
+    cacheService = create_cache_service(config)
+    preClassifier = create_pre_classifier(config, cacheService)
+    workQueue = WorkQueue(config)
+
     try:
-        mailbox_list = imapService.get_mailbox_list()
-        for mailbox in mailbox_list:
-            if mailbox in exception_list:
-                logger.info(f"{mailbox} is in the exception list. Skipping...")
-                continue
+        with pool.connection() as client_wrapper:
+            imapService = ImapService(config, client_wrapper)
+            sync_state = imapService.sync_state
+            active_mailboxes = imapService.scan_mailboxes(
+                get_candidate_mailboxes(imapService, config), pending=workQueue.mailboxes_with_due_work()
+            )
 
-            process_mailbox(imapService, cacheService, llm, mailbox)
+        # Every mailbox gets its own pooled connection since a connection can only have one SELECTed folder
+        with ThreadPoolExecutor(max_workers=pool.max_size, thread_name_prefix="mailbox") as executor:
+            futures = {
+                executor.submit(process_mailbox_from_pool, pool, config, sync_state, cacheService, llm, workQueue, mailbox, preClassifier): mailbox
+                for mailbox in active_mailboxes
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.exception(f"Unexpected error while processing {futures[future]}: {e}")
 
     except Exception as e:
         logger.exception(f"Unexpected error during processing: {e}")
 
     finally:
-        imapService.shutdown()
+        pool.close()
+        close_services(llm, workQueue, cacheService, preClassifier)
+
+
+async def process_emails_async(config: configparser.ConfigParser):
+    llm = LLM(config)
+    cacheService = create_cache_service(config)
+    preClassifier = create_pre_classifier(config, cacheService)
+    workQueue = WorkQueue(config)
+    listing = AsyncImapService(config)
+    workers = [listing]
+
+    try:
+        mailboxes: Queue = Queue()
+        for mailbox in filter_candidate_mailboxes(await listing.get_mailbox_list(), config):
+            mailboxes.put_nowait(mailbox)
+
+        # One connection per worker, since a connection can only have one SELECTed folder
+        async def mailbox_worker(imapService: AsyncImapService):
+            while not mailboxes.empty():
+                mailbox = mailboxes.get_nowait()
+                try:
+                    await process_mailbox_async(imapService, cacheService, llm, workQueue, mailbox, preClassifier)
+                except Exception as e:
+                    logger.exception(f"Unexpected error while processing {mailbox}: {e}")
+
+        worker_count = min(config.getint("IMAP", "pool_size", fallback=4), mailboxes.qsize())
+        workers += [AsyncImapService(config, sync_state=listing.sync_state) for _ in range(worker_count - 1)]
+        await gather(*(mailbox_worker(imapService) for imapService in workers))
+
+    except Exception as e:
+        logger.exception(f"Unexpected error during processing: {e}")
+
+    finally:
+        for imapService in workers:
+            await imapService.shutdown()
+        close_services(llm, workQueue, cacheService, preClassifier)
+
+
+# Keeps one connection in IDLE on the mailbox and classifies new mail as soon as the server reports it.
+def watch_mailbox(pool: ImapConnectionPool, config: configparser.ConfigParser, sync_state: Optional[SyncState],
+                  cacheService: Optional[Cache], llm: LLM, workQueue: WorkQueue, mailbox: str, stop_event: Event,
+                  preClassifier: Optional[PreClassifier] = None):
+    idle_timeout = config.getfloat("IMAP", "idle_timeout", fallback=1500.0)
+    reconnect_delay = config.getfloat("IMAP", "idle_reconnect_delay", fallback=30.0)
+    settings = PipelineSettings.from_config(config)
+    while not stop_event.is_set():
+        try:
+            with pool.connection() as client_wrapper:
+                imapService = ImapService(config, client_wrapper, sync_state)
+                while not stop_event.is_set():
+                    process_mailbox(imapService, cacheService, llm, workQueue, mailbox, preClassifier, settings)
+                    if imapService.wait_for_new_mail(idle_timeout, stop_event):
+                        logger.info(f"New mail in {mailbox}")
+        except Exception as e:
+            logger.exception(f"IDLE on {mailbox} failed: {e}. Reconnecting in {reconnect_delay}s...")
+            stop_event.wait(reconnect_delay)
+
+
+def run_idle(config: configparser.ConfigParser):
+    llm = LLM(config)
+    cacheService = create_cache_service(config)
+    preClassifier = create_pre_classifier(config, cacheService)
+    workQueue = WorkQueue(config)
+    stop_event = Event()
+
+    def request_stop(signum, _frame):
+        logger.info(f"Received signal {signum}. Stopping IDLE workers...")
+        stop_event.set()
+
+    signal(SIGTERM, request_stop)
+    signal(SIGINT, request_stop)
+
+    watched = [mailbox.strip() for mailbox in config.get("IMAP", "idle_mailboxes", fallback="").split(",") if mailbox.strip()]
+    setup_pool = ImapConnectionPool(config, max_size=1)
+    try:
+        with setup_pool.connection() as client_wrapper:
+            imapService = ImapService(config, client_wrapper)
+            sync_state = imapService.sync_state
+            if not watched:
+                watched = get_candidate_mailboxes(imapService, config)
+    finally:
+        setup_pool.close()
+
+    if not watched:
+        logger.error("No mailboxes to watch.")
+        close_services(llm, workQueue, cacheService, preClassifier)
+        return
+
+    # IDLE holds the connection, so every watched mailbox needs its own
+    pool = ImapConnectionPool(config, max_size=len(watched))
+    logger.info(f"Watching {len(watched)} mailbox(es) with IDLE: {', '.join(watched)}")
+    workers = [
+        Thread(target=watch_mailbox, args=(pool, config, sync_state, cacheService, llm, workQueue, mailbox, stop_event, preClassifier), name=f"idle-{mailbox}")
+        for mailbox in watched
+    ]
+    try:
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1.0)
+    finally:
+        stop_event.set()
+        pool.close()
+        close_services(llm, workQueue, cacheService, preClassifier)
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Classify unread emails and move them into importance folders.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--idle", action="store_true", help="Run as a daemon that uses IMAP IDLE instead of a single pass.")
+    mode.add_argument("--async", dest="use_async", action="store_true", help="Run a single pass on the asyncio IMAP engine with pipelined commands.")
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('config/config.ini')
-    process_emails(config)
\ No newline at end of file
+    if args.idle:
+        run_idle(config)
+    elif args.use_async:
+        run(process_emails_async(config))
+    else:
+        process_emails(config)
@@ -1,8 +1,12 @@
 from llm.hugginfacellm.available_models import AvailableModels
+from collections import OrderedDict
 from configparser import ConfigParser
-from torch import cuda, device as torch_device, backends, bfloat16
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from copy import deepcopy
+from typing import Union
+from torch import cat, cuda, device as torch_device, backends, bfloat16, no_grad, ones_like
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, pipeline
 from loguru import logger
+from prompt.prompt import Prompt
 
 class LLM:
     def __init__(self, config: ConfigParser, model_name: AvailableModels = AvailableModels.GOOGLE_GEMMA_2_B_IT):
@@ -13,6 +17,9 @@ class LLM:
         self.auto_tokenizer: AutoTokenizer = None
         self.casual_llm_model: AutoModelForCausalLM = None
         self.generator: pipeline = None
+        # KV caches of the static prompt prefixes (one per prompt type), most recently used last
+        self.prefix_cache_size: int = config.getint("HUGGINGFACE", "prefix_cache_size", fallback=4)
+        self.prefix_cache: OrderedDict = OrderedDict()
     
     def __set_torch_device(self) -> None:
         if cuda.is_available():
@@ -65,14 +72,54 @@ class LLM:
             logger.info(f"Unable to setup llm package: {e}")
             raise
 
-    def generate(self, prompt: str) -> str:
+    # Runs the static prefix through the model once and keeps its KV cache, so later prompts that start
+    # with it only evaluate their own tokens.
+    def __prefix(self, system: str) -> tuple:
+        cached = self.prefix_cache.get(system)
+        if cached is not None:
+            self.prefix_cache.move_to_end(system)
+            return cached
+        prefix_ids = self.auto_tokenizer(system, return_tensors="pt").input_ids.to(self.device)
+        with no_grad():
+            past_key_values = self.casual_llm_model(prefix_ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+        self.prefix_cache[system] = (prefix_ids, past_key_values)
+        if len(self.prefix_cache) > self.prefix_cache_size:
+            self.prefix_cache.popitem(last=False)
+        logger.info(f"Cached the KV prefix of a {prefix_ids.shape[1]}-token system prompt")
+        return prefix_ids, past_key_values
+
+    def __generate_with_prefix(self, prompt: Prompt) -> str:
+        prefix_ids, past_key_values = self.__prefix(prompt.get_system_prompt())
+        # Tokenized apart and joined, so the prefix tokens are exactly the cached ones
+        user_ids = self.auto_tokenizer(
+            "\n\n" + prompt.get_user_prompt(), return_tensors="pt", add_special_tokens=False
+        ).input_ids.to(self.device)
+        input_ids = cat([prefix_ids, user_ids], dim=1)
+        stop = {"stop_strings": list(prompt.stop_sequences), "tokenizer": self.auto_tokenizer} if prompt.stop_sequences else {}
+        with no_grad():
+            output = self.casual_llm_model.generate(
+                input_ids,
+                attention_mask=ones_like(input_ids),
+                # generate() extends the cache in place; the copy keeps the prefix reusable
+                past_key_values=deepcopy(past_key_values),
+                max_new_tokens=prompt.max_tokens or self.max_new_tokens,
+                **stop,
+            )
+        return self.auto_tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    # A plain string is generated as before and the text returned. A Prompt reuses the cached KV prefix of
+    # its system part and is answered with its parsed response, like the Ollama LLM.
+    def generate(self, prompt: Union[str, Prompt]) -> Union[str, dict]:
         if not hasattr(self, 'generator'):
             raise ValueError("Generator is not set up. Call setup() first.")
+        if isinstance(prompt, Prompt):
+            return prompt.extract_response(self.__generate_with_prefix(prompt))
         output = self.generator(prompt, max_new_tokens=self.max_new_tokens)
         logger.info(output)
         return output[0]['generated_text'] if output else ""
     
     def tear_down(self):
+        self.prefix_cache.clear()
         cuda.empty_cache()
         if hasattr(self, 'generator'):
             del self.generator
@@ -1,51 +1,128 @@
 from configparser import ConfigParser
 from llm.ollamallm.available_models import AvailableModels
-from requests import post
+from llm.ollamallm.options import GenerationOptions
+from llm.ollamallm.session import RETRY_STATUSES, backoff, create_session
+from dataclasses import replace
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Optional
+from requests.exceptions import ChunkedEncodingError, ConnectionError
 from json import dumps
+from loguru import logger
 from prompt.prompt import Prompt
 
+# Talks to one Ollama server over a pooled keep-alive session. Connection errors (refused, reset) and
+# 5xx answers are retried up to max_retries times with jittered exponential backoff; a read timeout is
+# not, since a generation that hung once would most likely hang again.
 class LLM:
     def __init__(self, config: ConfigParser, model_name: AvailableModels = AvailableModels.DEEPSEEK_R1_14_B):
         self.model_name: str = model_name.value
         self.ollama_url: str = config["OLLAMA"]["ollama_base_url"]
         self.think: bool = config.getboolean("OLLAMA", "think", fallback=False)
         self.stream: bool = config.getboolean("OLLAMA", "stream", fallback=False)
-        self.keep_alive: int = config.getint("OLLAMA", "keep_alive", fallback=1)  # minutes
+        self.keep_alive: int = config.getint("OLLAMA", "keep_alive", fallback=30)  # minutes
+        # Send a prompt's static part as the system prompt. The rendered prefix is then byte-identical on
+        # every call, so the server reuses its KV cache and only evaluates the email.
+        self.system_prompt: bool = config.getboolean("OLLAMA", "system_prompt", fallback=True)
+        self.options: GenerationOptions = GenerationOptions.from_config(config)
+        self.connect_timeout: float = config.getfloat("OLLAMA", "connect_timeout", fallback=5.0)
+        self.read_timeout: float = config.getfloat("OLLAMA", "read_timeout", fallback=300.0)
+        self.max_retries: int = config.getint("OLLAMA", "max_retries", fallback=3)
+        self.retry_backoff: float = config.getfloat("OLLAMA", "retry_backoff_seconds", fallback=0.5)
+        self.retry_backoff_max: float = config.getfloat("OLLAMA", "retry_backoff_max_seconds", fallback=8.0)
+        # As many connections as the server runs requests in parallel (OLLAMA_NUM_PARALLEL)
+        self.pool_size: int = config.getint("OLLAMA", "pool_size", fallback=4)
         self.headers: dict[str, str] = {
             "Content-Type": "application/json"
         }
+        self.session = create_session(self.pool_size, self.headers)
+
+        self.lock = Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.call_seconds = 0.0
+        self.max_call_seconds = 0.0
         self.__setup()
 
     # Warms the LLM and performs a basic setup check by sending a test prompt.
     def __setup(self) -> None:
         try:
-            self.__call_ollama_api("Hello, how are you?")
+            self.__call_ollama_api("Hello, how are you?", replace(self.options, num_predict=1))
         except Exception as e:
             raise Exception(f"Failed to setup Ollama LLM: {e}")
 
     # Ref: https://github.com/ollama/ollama/blob/main/docs/api.md
-    def __call_ollama_api(self, prompt: str) -> str:
+    def __call_ollama_api(self, prompt: str, options: GenerationOptions, system: Optional[str] = None) -> str:
         data = {
             "model": self.model_name,
             "prompt": prompt,
             "think": self.think,
             "stream": self.stream,
-            "keep_alive": self.keep_alive,
-            "temperature": 0.3,
-            "stop": ["</answer>"]
+            # A bare number would be read as seconds; the cached prefix goes when the model is unloaded
+            "keep_alive": f"{self.keep_alive}m",
+            "options": options.to_dict()
         }
+        if system:
+            data["system"] = system
 
-        response = post(
-            f"{self.ollama_url}/generate",
-            headers=self.headers,
-            data=dumps(data)
-        )
+        started = perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = self.session.post(
+                        f"{self.ollama_url}/generate",
+                        data=dumps(data),
+                        timeout=(self.connect_timeout, self.read_timeout)
+                    )
+                except (ConnectionError, ChunkedEncodingError) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.warning(f"Ollama connection failed ({e}); retrying")
+                else:
+                    if response.status_code == 200:
+                        return response.json().get("response", "")
+                    if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                        raise Exception(f"Error calling Ollama API: {response.text}")
+                    logger.warning(f"Ollama answered {response.status_code}; retrying")
+                attempt += 1
+                sleep(backoff(attempt, self.retry_backoff, self.retry_backoff_max))
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            logger.debug(f"Ollama call took {elapsed:.2f}s with {attempt} retries")
+            with self.lock:
+                self.calls += 1
+                self.retries += attempt
+                self.call_seconds += elapsed
+                self.max_call_seconds = max(self.max_call_seconds, elapsed)
 
-        if response.status_code != 200:
-            raise Exception(f"Error calling Ollama API: {response.text}")
+    def generate(self, prompt: Prompt) -> dict:
+        options = self.options.for_prompt(prompt)
+        if self.system_prompt:
+            response = self.__call_ollama_api(prompt.get_user_prompt(), options, prompt.get_system_prompt())
+        else:
+            response = self.__call_ollama_api(prompt.get_prompt(), options)
+        return prompt.extract_response(response)
 
-        return response.json().get("response", "")
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'failures': self.failures,
+                'retries': self.retries,
+                'mean_call_seconds': self.call_seconds / self.calls if self.calls else 0.0,
+                'max_call_seconds': self.max_call_seconds,
+            }
 
-    def generate(self, prompt: Prompt) -> dict:
-        response = self.__call_ollama_api(prompt.get_prompt())
-        return prompt.extract_response(response)
\ No newline at end of file
+    def close(self) -> None:
+        stats = self.stats()
+        logger.info(
+            f"Ollama: {stats['calls']} calls, {stats['failures']} failed, {stats['retries']} retries, "
+            f"{stats['mean_call_seconds']:.2f}s mean and {stats['max_call_seconds']:.2f}s max per call"
+        )
+        self.session.close()
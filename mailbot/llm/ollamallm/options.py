@@ -0,0 +1,47 @@
+from configparser import ConfigParser
+from dataclasses import asdict, dataclass, replace
+from typing import Optional
+from prompt.prompt import Prompt
+
+# Context window Ollama gives a model when num_ctx is not set
+DEFAULT_NUM_CTX = 2048
+
+
+def optional(config: ConfigParser, key: str, convert):
+    value = config.get("OLLAMA", key, fallback="").strip()
+    return convert(value) if value else None
+
+
+# Sampling and length options of /api/generate. Ollama only reads them from the "options" object of the
+# request; at the top level they are silently ignored. Unset (None) options are left to the model's
+# defaults. A prompt's own token budget and stop markers take precedence over the configured ones.
+@dataclass(frozen=True)
+class GenerationOptions:
+    num_predict: Optional[int] = None
+    num_ctx: Optional[int] = None
+    stop: Optional[tuple] = None
+    temperature: Optional[float] = None
+    top_k: Optional[int] = None
+    num_thread: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> "GenerationOptions":
+        stop = optional(config, "stop", lambda value: tuple(marker.strip() for marker in value.split(',') if marker.strip()))
+        return cls(
+            num_predict=optional(config, "num_predict", int),
+            num_ctx=optional(config, "num_ctx", int),
+            stop=stop or None,
+            temperature=config.getfloat("OLLAMA", "temperature", fallback=0.3),
+            top_k=optional(config, "top_k", int),
+            num_thread=optional(config, "num_thread", int),
+        )
+
+    def for_prompt(self, prompt: Prompt) -> "GenerationOptions":
+        return replace(
+            self,
+            num_predict=prompt.max_tokens or self.num_predict,
+            stop=tuple(prompt.stop_sequences) or self.stop,
+        )
+
+    def to_dict(self) -> dict:
+        return {key: list(value) if key == "stop" else value for key, value in asdict(self).items() if value is not None}
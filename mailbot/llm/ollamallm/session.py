@@ -0,0 +1,22 @@
+from random import uniform
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+# Ollama answers 5xx while a model is loading or when its queue is full; worth another try
+RETRY_STATUSES = frozenset(range(500, 600))
+
+
+def create_session(pool_size: int, headers: dict) -> Session:
+    """A keep-alive session with up to pool_size connections to the server; callers beyond that wait for one.
+    Retries are left to the caller, which knows which requests are safe to repeat."""
+    session = Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full jitter: a random wait up to the exponential backoff, so retrying callers spread out."""
+    return uniform(0, min(cap, base * 2 ** (attempt - 1)))
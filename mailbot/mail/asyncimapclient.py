@@ -0,0 +1,187 @@
+from asyncio import CancelledError, Lock, StreamReader, StreamWriter, Task, create_task, get_running_loop, open_connection, wait_for
+from collections import defaultdict
+from configparser import ConfigParser
+from re import compile as re_compile
+from ssl import create_default_context
+from typing import Iterable, Optional
+from loguru import logger
+
+LITERAL_PATTERN = re_compile(rb'\{(\d+)\}$')
+UNTAGGED_PATTERN = re_compile(rb'^(?:(\d+) )?([A-Za-z-]+)(?: (.*))?$')
+RESPONSE_CODE_PATTERN = re_compile(rb'^\[([A-Za-z-]+)(?: ([^\]]*))?\]')
+FETCH_UID_PATTERN = re_compile(rb'[( ]UID (\d+)')
+
+class AsyncImapError(Exception):
+    pass
+
+def quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+# asyncio IMAP4rev1 client that pipelines tagged commands (RFC 3501 5.5). Any number of commands can be
+# in flight on one connection; a single reader task matches tagged completions to their commands.
+# Untagged responses carry no tag, so they are handed to every command in flight and each caller picks
+# out what belongs to it (e.g. by UID). Responses use the same shape as imaplib, so mail.imapparser
+# works on both: a literal arrives as a (text_before, literal_bytes) tuple followed by the rest of the line.
+class AsyncImapClient:
+    def __init__(self, config: ConfigParser):
+        self.imap_port: int = int(config["IMAP"]["port"])
+        self.imap_server: str = config["IMAP"]["server"]
+        self.imap_username: str = config["IMAP"]["username"]
+        self.imap_password: str = config["IMAP"]["password"]
+        self.use_ssl = config.getboolean("IMAP", "ssl", fallback=True)
+        self.command_timeout = config.getfloat("IMAP", "command_timeout", fallback=300.0)
+        self.capabilities: tuple = ()
+        self.reader: Optional[StreamReader] = None
+        self.writer: Optional[StreamWriter] = None
+        self.__reader_task: Optional[Task] = None
+        self.__write_lock = Lock()
+        self.__pending: dict = {}
+        self.__tag_counter = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.__reader_task is not None and not self.__reader_task.done()
+
+    async def connect(self) -> None:
+        ssl_context = create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await wait_for(
+            open_connection(self.imap_server, self.imap_port, ssl=ssl_context), self.command_timeout
+        )
+        greeting = await wait_for(self.__read_response(), self.command_timeout)
+        first_line = greeting[0][0] if isinstance(greeting[0], tuple) else greeting[0]
+        if not first_line.startswith((b'* OK', b'* PREAUTH')):
+            raise AsyncImapError(f"Unexpected IMAP greeting: {first_line!r}")
+        self.__reader_task = create_task(self.__read_loop())
+
+        status, responses, _ = await self.command('CAPABILITY')
+        if status == 'OK' and responses['CAPABILITY']:
+            self.capabilities = tuple(responses['CAPABILITY'][-1].decode('ascii', errors='replace').upper().split())
+        if not first_line.startswith(b'* PREAUTH'):
+            status, _, text = await self.command('LOGIN', quote(self.imap_username), quote(self.imap_password))
+            if status != 'OK':
+                raise AsyncImapError(f"Login failed: {text}")
+        logger.info("Connected to IMAP server (asyncio).")
+
+    async def __read_response(self) -> list:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("IMAP connection closed by server")
+        elements = []
+        while True:
+            line = line.rstrip(b'\r\n')
+            match = LITERAL_PATTERN.search(line)
+            if not match:
+                elements.append(line)
+                return elements
+            literal = await self.reader.readexactly(int(match.group(1)))
+            elements.append((line, literal))
+            line = await self.reader.readline()
+
+    async def __read_loop(self) -> None:
+        try:
+            while True:
+                elements = await self.__read_response()
+                first = elements[0][0] if isinstance(elements[0], tuple) else elements[0]
+                if first.startswith(b'* '):
+                    self.__dispatch_untagged(elements)
+                elif first.startswith(b'+'):
+                    logger.debug(f"Ignoring unexpected continuation request: {first!r}")
+                else:
+                    self.__complete(first)
+        except (Exception, CancelledError) as e:
+            for future, _, _ in self.__pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"IMAP connection lost: {e!r}"))
+            self.__pending.clear()
+            if isinstance(e, CancelledError):
+                raise
+
+    def __dispatch_untagged(self, elements: list) -> None:
+        first = elements[0]
+        line = (first[0] if isinstance(first, tuple) else first)[2:]
+        match = UNTAGGED_PATTERN.match(line)
+        if not match:
+            logger.debug(f"Unparsed untagged response: {line!r}")
+            return
+        number, response_type, rest = match.groups()
+        response_type = response_type.decode('ascii').upper()
+        # imaplib keeps the message number in front of the data (b'1 (UID 10 ...'), so FETCH data stays parseable
+        data = b' '.join(part for part in (number, rest) if part is not None)
+        data_elements = [(data, first[1]) if isinstance(first, tuple) else data] + elements[1:]
+
+        received = [(response_type, data_elements)]
+        code = RESPONSE_CODE_PATTERN.match(rest or b'') if response_type in ('OK', 'NO', 'BAD', 'PREAUTH') else None
+        if code:
+            received.append((code.group(1).decode('ascii').upper(), [code.group(2) or b'']))
+
+        recipients = self.__pending.values()
+        if response_type == 'FETCH':
+            # Pipelined UID FETCHes each get only their own messages instead of a copy of every response
+            uid = self.__fetch_uid(data_elements)
+            owners = [entry for entry in recipients if entry[2] is not None and uid in entry[2]]
+            recipients = owners or [entry for entry in recipients if entry[2] is None]
+        for _, responses, _ in recipients:
+            for response_type, data_elements in received:
+                responses[response_type].extend(data_elements)
+
+    def __fetch_uid(self, data_elements: list) -> Optional[str]:
+        for element in data_elements:
+            match = FETCH_UID_PATTERN.search(element[0] if isinstance(element, tuple) else element)
+            if match:
+                return match.group(1).decode('ascii')
+        return None
+
+    def __complete(self, line: bytes) -> None:
+        tag, _, rest = line.partition(b' ')
+        entry = self.__pending.pop(tag.decode('ascii', errors='replace'), None)
+        if entry is None:
+            logger.debug(f"Response for unknown tag: {line!r}")
+            return
+        future, responses, _ = entry
+        status, _, text = rest.partition(b' ')
+        code = RESPONSE_CODE_PATTERN.match(text)
+        if code:
+            responses[code.group(1).decode('ascii').upper()].append(code.group(2) or b'')
+        if not future.done():
+            future.set_result((status.decode('ascii', errors='replace').upper(), responses, text.decode('utf-8', errors='replace')))
+
+    # Sends one tagged command and waits for its completion. Returns (status, {type: [data, ...]}, text).
+    # Callers that want pipelining simply run several command() coroutines concurrently. uids marks the
+    # UIDs a UID FETCH asked for, so untagged FETCH responses only go to the command that requested them.
+    async def command(self, name: str, *args: str, uids: Optional[Iterable] = None) -> tuple:
+        if self.writer is None or (self.__reader_task is not None and self.__reader_task.done()):
+            raise ConnectionError("IMAP connection is not open")
+        self.__tag_counter += 1
+        tag = f"A{self.__tag_counter:04d}"
+        future = get_running_loop().create_future()
+        self.__pending[tag] = (future, defaultdict(list), frozenset(uids) if uids is not None else None)
+        line = ' '.join((tag, name) + args).encode('utf-8') + b'\r\n'
+        async with self.__write_lock:
+            self.writer.write(line)
+            await self.writer.drain()
+        try:
+            return await wait_for(future, self.command_timeout)
+        finally:
+            self.__pending.pop(tag, None)
+
+    async def uid(self, name: str, *args: str, uids: Optional[Iterable] = None) -> tuple:
+        return await self.command(f'UID {name}', *args, uids=uids)
+
+    async def logout(self) -> None:
+        try:
+            if self.connected:
+                await self.command('LOGOUT')
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self.__reader_task is not None:
+            self.__reader_task.cancel()
+            self.__reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception as e:
+                logger.debug(f"Error while closing IMAP connection: {e}")
+            self.writer = None
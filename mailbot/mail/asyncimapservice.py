@@ -0,0 +1,409 @@
+from asyncio import create_task, gather
+from collections import defaultdict, deque
+from configparser import ConfigParser
+from email import message_from_bytes
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional
+from mail.asyncimapclient import AsyncImapClient, AsyncImapError, quote
+from mail.bodyextractor import BodyExtractor
+from mail.emailwrapper import EmailWrapper
+from mail.imapparser import decode_mailbox_name, find_text_part, get_body_section, parse_fetch_items
+from mail.imapservice import ImapService
+from mail.streamparser import StreamingBodyExtractor
+from mail.syncstate import SyncState, incremental_search_criteria
+from mail.utils import chunked, decode_partial_text, to_sequence_set
+from cache.cache import ImportanceLevel
+from loguru import logger
+
+# asyncio counterpart of ImapService with the same surface, built on AsyncImapClient.
+# Independent commands are pipelined on the one connection: the UID FETCHes of up to pipeline_depth chunks
+# are in flight together and the moves of different folders overlap. Commands that depend on each other
+# (SELECT before anything else, STORE \Deleted before EXPUNGE, COPY before STORE \Deleted) are still awaited
+# in order, since RFC 3501 5.5 forbids pipelining them. Only one mailbox can be selected per connection.
+class AsyncImapService:
+    FETCH_ITEMS = ImapService.FETCH_ITEMS
+    HEADER_FIELDS = ImapService.HEADER_FIELDS
+
+    def __init__(self, config: ConfigParser, client: Optional[AsyncImapClient] = None, sync_state: Optional[SyncState] = None):
+        self.client = client or AsyncImapClient(config)
+        self.folders = {
+            ImportanceLevel.LEAST_IMPORTANT: config["IMAP"]["less_important_folder"],
+            ImportanceLevel.MEDIUM_IMPORTANT: config["IMAP"]["medium_important_folder"],
+            ImportanceLevel.MOST_IMPORTANT: config["IMAP"]["most_important_folder"],
+            ImportanceLevel.SCAM: config["IMAP"]["likely_junk_folder"]
+        }
+        self.fetch_chunk_size = config.getint("IMAP", "fetch_chunk_size", fallback=50)
+        self.header_first_fetch = config.getboolean("IMAP", "header_first_fetch", fallback=True)
+        self.body_fetch_bytes = config.getint("IMAP", "body_fetch_bytes", fallback=4096)
+        self.stream_window_bytes = config.getint("IMAP", "stream_window_bytes", fallback=64 * 1024)
+        self.max_message_bytes = config.getint("IMAP", "max_message_bytes", fallback=4 * 1024 * 1024)
+        self.max_body_bytes = config.getint("IMAP", "max_body_bytes", fallback=256 * 1024)
+        self.body_extractor = BodyExtractor(config)
+        self.pipeline_depth = max(1, config.getint("IMAP", "pipeline_depth", fallback=8))
+        self.sync_state: Optional[SyncState] = None
+        if config.getboolean("IMAP", "incremental_sync", fallback=True):
+            self.sync_state = sync_state or SyncState(config)
+        self.mailbox_list_ttl = config.getint("IMAP", "mailbox_list_ttl", fallback=3600)
+        self.selected_state: dict = {}
+        self.__pending_sync: dict = {}
+        self.__text_parts: dict = {}
+        self.__condstore_enabled = False
+
+    async def start(self) -> None:
+        if not self.client.connected:
+            await self.client.connect()
+            self.__condstore_enabled = False
+
+    def __has_capability(self, capability: str) -> bool:
+        return capability in self.client.capabilities
+
+    async def get_mailbox_list(self) -> list:
+        cached = self.sync_state.get_mailbox_list(self.mailbox_list_ttl) if self.sync_state else None
+        if cached is not None:
+            logger.info(f"Using cached mailbox list ({len(cached)} mailboxes)")
+            return cached
+        try:
+            await self.start()
+            status, responses, text = await self.client.command('LIST', '""', '"*"')
+            if status != 'OK':
+                raise AsyncImapError(f"LIST failed: {status} {text}")
+            mailbox_list = []
+            for mailbox in responses['LIST']:
+                # Names with special characters may arrive as literals
+                name = mailbox[1].decode('utf-8', errors='replace') if isinstance(mailbox, tuple) else decode_mailbox_name(mailbox)
+                if name:
+                    mailbox_list.append(name)
+            if self.sync_state:
+                self.sync_state.set_mailbox_list(mailbox_list)
+            return mailbox_list
+        except Exception as e:
+            logger.info(f"Failed to retrieve mailbox list: {e}")
+            return []
+
+    # ENABLE is only valid before the first SELECT, so it is sent once per connection.
+    async def __enable_condstore(self) -> None:
+        if self.__condstore_enabled:
+            return
+        self.__condstore_enabled = True
+        if self.__has_capability('CONDSTORE') or self.__has_capability('QRESYNC'):
+            try:
+                await self.client.command('ENABLE', 'CONDSTORE')
+                logger.info("CONDSTORE enabled for this connection.")
+            except Exception as e:
+                logger.info(f"Failed to enable CONDSTORE: {e}")
+
+    def __response_code_value(self, responses: dict, code: str) -> Optional[int]:
+        try:
+            values = responses.get(code)
+            return int(values[-1].split()[0]) if values else None
+        except (IndexError, ValueError):
+            return None
+
+    async def fetch_email_ids(self, mailbox_name: str) -> list:
+        try:
+            await self.start()
+            await self.__enable_condstore()
+            status, responses, text = await self.client.command('SELECT', quote(mailbox_name))
+            if status != 'OK':
+                raise AsyncImapError(f"Failed to select mailbox '{mailbox_name}': {status} {text}")
+            self.selected_state = {
+                'uidvalidity': self.__response_code_value(responses, 'UIDVALIDITY'),
+                'uidnext': self.__response_code_value(responses, 'UIDNEXT'),
+                'highestmodseq': self.__response_code_value(responses, 'HIGHESTMODSEQ')
+            }
+            self.__pending_sync[mailbox_name] = self.selected_state
+
+            stored = self.sync_state.get(mailbox_name) if self.sync_state else None
+            criteria, last_uidnext = incremental_search_criteria(mailbox_name, stored, self.selected_state)
+            if criteria is None:
+                logger.info(f"No new emails in {mailbox_name} since the last sync")
+                return []
+
+            status, responses, text = await self.client.uid('SEARCH', *criteria)
+            if status != 'OK':
+                raise AsyncImapError(f"UID SEARCH failed: {status} {text}")
+            formatted_ids = b' '.join(item for item in responses['SEARCH'] if isinstance(item, bytes)).decode('ascii').split()
+            if last_uidnext:
+                # "n:*" always matches the highest UID, even when it is below n
+                formatted_ids = [email_id for email_id in formatted_ids if int(email_id) >= last_uidnext]
+            logger.info(f"Found {len(formatted_ids)} unseen emails in {mailbox_name}")
+            return formatted_ids
+        except Exception as e:
+            self.__pending_sync.pop(mailbox_name, None)
+            logger.info(f"Failed to fetch emails: {e}")
+            return []
+
+    # Same contract as ImapService.commit_sync_state.
+    def commit_sync_state(self, mailbox_name: str) -> None:
+        state = self.__pending_sync.pop(mailbox_name, None)
+        if not self.sync_state or not state or state.get('uidvalidity') is None:
+            return
+        self.sync_state.update(mailbox_name, state['uidvalidity'], state['uidnext'], state['highestmodseq'])
+
+    # Runs fetch(chunk) for every chunk with up to pipeline_depth of them in flight and yields
+    # (chunk, result) in chunk order. A failed chunk is logged and yields an empty result.
+    async def __pipelined(self, chunks: Iterable, fetch: Callable[[list], Awaitable[dict]]) -> AsyncIterator[tuple]:
+        in_flight: deque = deque()
+
+        async def next_result() -> tuple:
+            chunk, task = in_flight.popleft()
+            try:
+                return chunk, await task
+            except Exception as e:
+                logger.exception(f"Failed to fetch a chunk of {len(chunk)} email(s): {e}")
+                return chunk, {}
+
+        try:
+            for chunk in chunks:
+                in_flight.append((chunk, create_task(fetch(chunk))))
+                if len(in_flight) >= self.pipeline_depth:
+                    yield await next_result()
+            while in_flight:
+                yield await next_result()
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+
+    # Async version of ImapService's windowed streaming fetch for one chunk of UIDs.
+    async def __stream_chunk(self, uids: list) -> dict:
+        extractors = {}
+        for fetch_item in self.FETCH_ITEMS:
+            active = [uid for uid in uids if uid not in extractors]
+            offset = 0
+            while active and offset < self.max_message_bytes:
+                sequence_set = to_sequence_set(active)
+                status, responses, _ = await self.client.uid(
+                    'FETCH', sequence_set, f'(UID {fetch_item}<{offset}.{self.stream_window_bytes}>)', uids=active
+                )
+                if status != 'OK':
+                    logger.warning(f"Failed to fetch UIDs {sequence_set} with ({fetch_item}). Status: {status}")
+                    break
+                payloads = {item.get('UID'): get_body_section(item) for item in parse_fetch_items(responses['FETCH'])}
+
+                still_reading = []
+                for uid in active:
+                    payload = payloads.get(uid)
+                    if payload is None:
+                        continue
+                    extractor = extractors.setdefault(uid, StreamingBodyExtractor(self.max_body_bytes))
+                    extractor.feed(payload)
+                    if not extractor.done and len(payload) >= self.stream_window_bytes:
+                        still_reading.append(uid)
+                active = still_reading
+                offset += self.stream_window_bytes
+
+        missing = [uid for uid in uids if uid not in extractors]
+        if missing:
+            logger.warning(f"Could not extract email content for UIDs {to_sequence_set(missing)}")
+        return extractors
+
+    def __construct_email(self, msg, body, uid: str = None) -> EmailWrapper:
+        return EmailWrapper(
+            subject=msg.get('Subject', 'No Subject'),
+            body=body,
+            sender=msg.get('From', 'Unknown Sender'),
+            recipient=msg.get('To', 'Unknown Recipient'),
+            date=msg.get('Date', 'Unknown Date'),
+            message_id=msg.get('Message-ID', 'No Message ID'),
+            uid=uid
+        )
+
+    async def fetch_emails(self, uids: list, chunk_size: Optional[int] = None) -> AsyncIterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        await self.start()
+        async for chunk, extractors in self.__pipelined(chunked([str(uid) for uid in uids], chunk_size), self.__stream_chunk):
+            for uid in chunk:
+                if uid not in extractors:
+                    continue
+                try:
+                    extractor = extractors.pop(uid)
+                    msg, body = extractor.close()
+                    yield self.__construct_email(msg, self.body_extractor.from_text(body, extractor.content_subtype), uid)
+                except Exception as e:
+                    logger.exception(f"Failed to parse email with UID {uid}: {e}")
+
+    async def __fetch_header_chunk(self, uids: list) -> dict:
+        sequence_set = to_sequence_set(uids)
+        status, responses, _ = await self.client.uid(
+            'FETCH', sequence_set, f'(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({self.HEADER_FIELDS})])', uids=uids
+        )
+        if status != 'OK':
+            logger.warning(f"Failed to fetch headers for UIDs {sequence_set}. Status: {status}")
+            return {}
+        return {item.get('UID'): item for item in parse_fetch_items(responses['FETCH'])}
+
+    # Header-first phase one, see ImapService.fetch_headers.
+    async def fetch_headers(self, uids: list, chunk_size: Optional[int] = None) -> AsyncIterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        await self.start()
+        self.__text_parts = {}
+        async for chunk, items in self.__pipelined(chunked([str(uid) for uid in uids], chunk_size), self.__fetch_header_chunk):
+            for uid in chunk:
+                item = items.get(uid)
+                header = get_body_section(item, 'BODY[HEADER') if item else None
+                if header is None:
+                    continue
+                try:
+                    self.__text_parts[uid] = find_text_part(item.get('BODYSTRUCTURE'))
+                    yield self.__construct_email(message_from_bytes(header), "", uid)
+                except Exception as e:
+                    logger.exception(f"Failed to parse headers of email with UID {uid}: {e}")
+
+    async def __fetch_section(self, section: str, entries: list) -> dict:
+        uids = [email.uid for email, _ in entries]
+        sequence_set = to_sequence_set(uids)
+        status, responses, _ = await self.client.uid(
+            'FETCH', sequence_set, f'(UID BODY.PEEK[{section}]<0.{self.body_fetch_bytes}>)', uids=uids
+        )
+        if status != 'OK':
+            logger.warning(f"Failed to fetch section {section} for UIDs {sequence_set}. Status: {status}")
+            return {}
+        return {item.get('UID'): get_body_section(item) for item in parse_fetch_items(responses['FETCH'])}
+
+    # The sections of one chunk are fetched with pipelined commands instead of one after the other.
+    async def __fetch_partial_chunk(self, entries: list) -> dict:
+        by_section = defaultdict(list)
+        for entry in entries:
+            by_section[entry[1]['section']].append(entry)
+        results = await gather(*(self.__fetch_section(section, grouped) for section, grouped in by_section.items()))
+        payloads = {}
+        for result in results:
+            payloads.update(result)
+        return payloads
+
+    # Header-first phase two, see ImapService.fetch_partial_bodies.
+    async def fetch_partial_bodies(self, emails: Iterable[EmailWrapper], chunk_size: Optional[int] = None) -> AsyncIterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        with_text_part = []
+        full_fetch = []
+        for email in emails:
+            text_part = self.__text_parts.pop(email.uid, None)
+            if text_part is None:
+                full_fetch.append(email.uid)
+            else:
+                with_text_part.append((email, text_part))
+
+        async for entries, payloads in self.__pipelined(chunked(with_text_part, chunk_size), self.__fetch_partial_chunk):
+            for email, text_part in entries:
+                payload = payloads.get(email.uid)
+                if payload is None:
+                    logger.warning(f"No body returned for email with UID {email.uid}")
+                    continue
+                text = decode_partial_text(payload, text_part['encoding'], text_part['charset'])
+                email.body = self.body_extractor.from_text(text, text_part['subtype'])
+                yield email
+
+        if full_fetch:
+            async for email in self.fetch_emails(full_fetch):
+                yield email
+
+    async def fetch_email(self, email_id: str) -> Optional[EmailWrapper]:
+        async for email in self.fetch_emails([email_id], chunk_size=1):
+            return email
+        return None
+
+    # Returns True when the messages are gone from the mailbox, or "expunge" when they are copied and
+    # flagged \Deleted but still need a plain EXPUNGE (no UIDPLUS).
+    async def __move(self, email_ids: list, importance: ImportanceLevel, mark_unread: bool) -> object:
+        sequence_set = to_sequence_set(email_ids)
+        try:
+            folder_to_move = self.folders.get(importance)
+            if not folder_to_move:
+                raise ValueError(f"No folder is configured for {importance}.")
+            flag_command = '-FLAGS.SILENT' if mark_unread else '+FLAGS.SILENT'
+            status, _, text = await self.client.uid('STORE', sequence_set, flag_command, '(\\Seen)')
+            if status != 'OK':
+                raise AsyncImapError(f"UID STORE \\Seen failed: {status} {text}")
+
+            if self.__has_capability('MOVE'):
+                status, _, text = await self.client.uid('MOVE', sequence_set, quote(folder_to_move))
+                if status != 'OK':
+                    raise AsyncImapError(f"UID MOVE failed: {status} {text}")
+                result = True
+            else:
+                status, _, text = await self.client.uid('COPY', sequence_set, quote(folder_to_move))
+                if status != 'OK':
+                    raise AsyncImapError(f"UID COPY failed: {status} {text}")
+                status, _, text = await self.client.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Deleted)')
+                if status != 'OK':
+                    raise AsyncImapError(f"UID STORE \\Deleted failed: {status} {text}")
+                if self.__has_capability('UIDPLUS'):
+                    status, _, text = await self.client.uid('EXPUNGE', sequence_set)
+                    # The copies exist and the originals are flagged; a plain EXPUNGE still removes them
+                    result = True if status == 'OK' else "expunge"
+                else:
+                    result = "expunge"
+            logger.info(f"{len(email_ids)} email(s) with UIDs {sequence_set} moved to {folder_to_move}.")
+            return result
+        except Exception as e:
+            logger.info(f"Failed to move emails with UIDs {sequence_set} to folder: {e}. Emails are marked unread")
+            await self.mark_email_as_unread(sequence_set)
+            return False
+
+    async def __expunge(self) -> None:
+        try:
+            await self.client.command('EXPUNGE')
+        except Exception as e:
+            logger.info(f"EXPUNGE failed: {e}")
+
+    async def move_emails(self, email_ids: list, importance: ImportanceLevel, mark_unread: bool = True) -> bool:
+        if not email_ids:
+            return True
+        result = await self.__move(email_ids, importance, mark_unread)
+        if result == "expunge":
+            await self.__expunge()
+        return bool(result)
+
+    # Moves every {importance: [uid, ...]} group at once. The groups touch disjoint UID sets, so their
+    # commands are pipelined; a plain EXPUNGE (without UIDPLUS) is sent once after all of them.
+    async def move_many(self, pending_moves: dict, mark_unread: bool = True) -> dict:
+        groups = [(importance, uids) for importance, uids in pending_moves.items() if uids]
+        results = await gather(*(self.__move(uids, importance, mark_unread) for importance, uids in groups))
+        if "expunge" in results:
+            await self.__expunge()
+        return {importance: bool(result) for (importance, _), result in zip(groups, results)}
+
+    async def move_to_folder_and_mark_read(self, email_id: str, importance: ImportanceLevel) -> None:
+        await self.move_emails([email_id], importance, mark_unread=False)
+
+    async def move_to_folder_and_mark_unread(self, email_id: str, importance: ImportanceLevel) -> None:
+        await self.move_emails([email_id], importance)
+
+    async def mark_email_as_read(self, email_id: str) -> None:
+        try:
+            await self.client.uid('STORE', email_id, '+FLAGS', '(\\Seen)')
+            logger.info(f"Email with ID {email_id} marked as read.")
+        except Exception as e:
+            logger.info(f"Failed to mark email with ID {email_id} as read: {e}")
+
+    async def mark_email_as_deleted(self, email_id: str) -> None:
+        try:
+            await self.client.uid('STORE', email_id, '+FLAGS', '(\\Deleted)')
+            logger.info(f"Email with ID {email_id} marked as deleted.")
+        except Exception as e:
+            logger.info(f"Failed to mark email with ID {email_id} as deleted: {e}")
+
+    async def mark_email_as_unread(self, email_id: str) -> None:
+        try:
+            status, _, text = await self.client.uid('STORE', email_id, '-FLAGS', '(\\Seen)')
+            if status != 'OK':
+                raise AsyncImapError(f"UID STORE failed: {status} {text}")
+            logger.info(f"Email with ID {email_id} marked as unread.")
+        except Exception as e:
+            logger.info(f"Failed to mark email with ID {email_id} as unread: {e}")
+
+    async def restart(self) -> None:
+        try:
+            await self.client.logout()
+            logger.info("Restarting IMAP client...")
+        except Exception as e:
+            logger.warning(f"Error during IMAP logout: {e}")
+        finally:
+            await self.start()
+            logger.info("IMAP client restarted successfully.")
+
+    async def shutdown(self) -> None:
+        try:
+            await self.client.logout()
+            logger.info("Disconnected from IMAP server.")
+        except Exception as e:
+            logger.info(f"Failed to disconnect: {e}")
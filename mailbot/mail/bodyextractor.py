@@ -0,0 +1,88 @@
+from configparser import ConfigParser
+from email import message_from_bytes, message_from_string
+from email.message import Message
+from re import IGNORECASE, compile as re_compile
+from typing import Optional, Union
+import html2text
+from mail.htmltext import HtmlTextConverter
+
+BLANK_LINES_PATTERN = re_compile(r'\n\s*\n\s*\n+')
+HTML_START_PATTERN = re_compile(r'^\s*<(?:!doctype|html)', IGNORECASE)
+
+# The one place where message text becomes the body the prompts see. A message is parsed at most once,
+# the best part (text/plain, else text/html, never attachments) is decoded with its declared charset,
+# HTML is converted to text and the result is capped at the prompt budget (max_body_chars).
+# HTML goes through the streaming HtmlTextConverter unless [EVALUATION] html_converter = html2text.
+# The services hand over text they already decoded while streaming, so EmailWrapper never re-parses it.
+class BodyExtractor:
+    def __init__(self, config: Optional[ConfigParser] = None):
+        self.max_body_chars = config.getint("EVALUATION", "max_body_chars", fallback=2000) if config else 2000
+        self.html_converter = config.get("EVALUATION", "html_converter", fallback="builtin") if config else "builtin"
+        if self.html_converter not in ("builtin", "html2text"):
+            raise ValueError(f"Unknown html_converter '{self.html_converter}'. Use 'builtin' or 'html2text'.")
+        self.__streaming_converter = HtmlTextConverter(self.max_body_chars)
+        self.html_settings = {
+            'ignore_links': False,
+            'ignore_images': True,
+            'bypass_tables': False,
+            'body_width': 0
+        }
+
+    # html2text keeps parser state (open <pre>, lists, quotes) across handle() calls, so the settings are
+    # configured once and applied to a fresh instance per document; construction costs ~10us.
+    def __html_converter(self) -> html2text.HTML2Text:
+        converter = html2text.HTML2Text()
+        for name, value in self.html_settings.items():
+            setattr(converter, name, value)
+        return converter
+
+    def __cap(self, text: str) -> str:
+        text = BLANK_LINES_PATTERN.sub('\n\n', text.strip())
+        if len(text) <= self.max_body_chars:
+            return text
+        return text[:self.max_body_chars].rstrip()
+
+    def from_text(self, text: str, subtype: str = 'plain') -> str:
+        if not text:
+            return ""
+        if subtype == 'html':
+            if self.html_converter == "html2text":
+                text = self.__html_converter().handle(text)
+            else:
+                text = self.__streaming_converter.convert(text)
+        return self.__cap(text)
+
+    def __decode(self, part: Message) -> str:
+        payload = part.get_payload(decode=True)
+        if not payload:
+            return ""
+        charset = part.get_content_charset() or 'utf-8'
+        try:
+            return payload.decode(charset, errors='replace')
+        except LookupError:
+            return payload.decode('utf-8', errors='replace')
+
+    def from_message(self, msg: Message) -> str:
+        html_part: Optional[Message] = None
+        for part in msg.walk():
+            if part.is_multipart() or part.get_content_disposition() == 'attachment':
+                continue
+            content_type = part.get_content_type()
+            if content_type == 'text/plain':
+                text = self.__decode(part)
+                if text.strip():
+                    return self.from_text(text)
+            elif content_type == 'text/html' and html_part is None:
+                html_part = part
+        if html_part is not None:
+            return self.from_text(self.__decode(html_part), 'html')
+        return ""
+
+    def from_raw(self, raw_email: Union[str, bytes]) -> str:
+        if isinstance(raw_email, str):
+            if HTML_START_PATTERN.match(raw_email):
+                return self.from_text(raw_email, 'html')
+            msg = message_from_string(raw_email)
+        else:
+            msg = message_from_bytes(raw_email)
+        return self.from_message(msg)
@@ -1,10 +1,9 @@
-from mail.utils import extract_best_body
-
 class EmailWrapper:
-    def __init__(self, subject: str, body: str, sender: str, recipient: str, date: str, message_id: str):
+    def __init__(self, subject: str, body: str, sender: str, recipient: str, date: str, message_id: str, uid: str = None):
         self.subject = subject
-        self.body = extract_best_body(body)
+        self.body = body
         self.sender = sender
         self.recipient = recipient
         self.date = date
-        self.message_id = message_id
\ No newline at end of file
+        self.message_id = message_id
+        self.uid = uid
\ No newline at end of file
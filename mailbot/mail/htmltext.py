@@ -0,0 +1,139 @@
+from html.parser import HTMLParser
+from re import IGNORECASE, compile as re_compile
+
+WHITESPACE_PATTERN = re_compile(r'\s+')
+HIDDEN_STYLE_PATTERN = re_compile(
+    r'display\s*:\s*none|visibility\s*:\s*hidden|mso-hide\s*:\s*all|max-height\s*:\s*0(?![.\d])|opacity\s*:\s*0(?![.\d])',
+    IGNORECASE
+)
+SKIPPED_TAGS = frozenset(('style', 'script', 'head', 'title', 'noscript', 'template', 'svg', 'object'))
+BLOCK_TAGS = frozenset((
+    'p', 'div', 'br', 'tr', 'table', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote',
+    'section', 'article', 'header', 'footer', 'hr', 'pre', 'center', 'dd', 'dt', 'form'
+))
+VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'))
+
+# Streaming HTML-to-text converter for prompts. Unlike html2text it never builds the whole document:
+# the HTML is fed in slices and parsing stops as soon as max_chars of text were produced, so the
+# tracking tables at the bottom of a 200 KB marketing mail are never looked at.
+# <style>, <script>, <head> and elements hidden with inline styles or the hidden attribute are dropped,
+# whitespace is collapsed, block elements become line breaks and links keep their href as [text](href).
+# One instance can convert any number of documents, but not from several threads at once.
+class HtmlTextConverter(HTMLParser):
+    def __init__(self, max_chars: int = 2000, feed_size: int = 8192):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.feed_size = feed_size
+        self.consumed = 0
+        self.__start_document()
+
+    def __start_document(self) -> None:
+        self.__pieces: list = []
+        self.__length = 0
+        self.__pending_space = False
+        self.__pending_breaks = 0
+        self.__skip_tag = None
+        self.__skip_nesting = 0
+        self.__href = None
+        self.__link_open = False
+        self.__done = False
+
+    def convert(self, html: str) -> str:
+        self.reset()
+        self.__start_document()
+        self.consumed = 0
+        for offset in range(0, len(html), self.feed_size):
+            self.feed(html[offset:offset + self.feed_size])
+            self.consumed = min(len(html), offset + self.feed_size)
+            if self.__done:
+                break
+        if not self.__done:
+            self.close()
+        return ''.join(self.__pieces)[:self.max_chars].strip()
+
+    def __emit(self, text: str) -> None:
+        if self.__pieces:
+            if self.__pending_breaks:
+                text = '\n' * min(self.__pending_breaks, 2) + text
+            elif self.__pending_space:
+                text = ' ' + text
+        self.__pending_breaks = 0
+        self.__pending_space = False
+        self.__pieces.append(text)
+        self.__length += len(text)
+        if self.__length >= self.max_chars:
+            self.__done = True
+
+    def __is_hidden(self, attrs: list) -> bool:
+        for name, value in attrs:
+            if name == 'hidden' or (name == 'aria-hidden' and value == 'true'):
+                return True
+            if name == 'style' and value and HIDDEN_STYLE_PATTERN.search(value):
+                return True
+        return False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if self.__done:
+            return
+        if self.__skip_tag is not None:
+            if tag == self.__skip_tag:
+                self.__skip_nesting += 1
+            return
+        if tag not in VOID_TAGS and (tag in SKIPPED_TAGS or self.__is_hidden(attrs)):
+            self.__skip_tag = tag
+            self.__skip_nesting = 1
+            return
+
+        if tag in BLOCK_TAGS:
+            self.__pending_breaks = max(self.__pending_breaks, 2 if tag in ('p', 'h1', 'h2', 'h3', 'table') else 1)
+            if tag == 'li':
+                self.__emit('- ')
+        elif tag in ('td', 'th'):
+            self.__pending_space = True
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            self.__href = href if href and not href.startswith(('#', 'javascript:')) else None
+            self.__link_open = False
+
+    def handle_startendtag(self, tag: str, attrs: list) -> None:
+        # <br/>, <img/> etc. never open an element, even when they carry hidden styles
+        if tag in BLOCK_TAGS and self.__skip_tag is None and not self.__done:
+            self.__pending_breaks = max(self.__pending_breaks, 1)
+
+    def handle_endtag(self, tag: str) -> None:
+        if self.__done:
+            return
+        if self.__skip_tag is not None:
+            if tag == self.__skip_tag:
+                self.__skip_nesting -= 1
+                if self.__skip_nesting == 0:
+                    self.__skip_tag = None
+            return
+
+        if tag == 'a':
+            if self.__link_open:
+                self.__pieces.append(f']({self.__href})')
+                self.__length += len(self.__href) + 3
+                self.__done = self.__length >= self.max_chars
+            self.__href = None
+            self.__link_open = False
+        elif tag in BLOCK_TAGS:
+            self.__pending_breaks = max(self.__pending_breaks, 2 if tag in ('p', 'h1', 'h2', 'h3', 'table') else 1)
+
+    def handle_data(self, data: str) -> None:
+        if self.__done or self.__skip_tag is not None:
+            return
+        collapsed = WHITESPACE_PATTERN.sub(' ', data)
+        if not collapsed.strip():
+            if collapsed:
+                self.__pending_space = True
+            return
+        if collapsed[0] == ' ':
+            self.__pending_space = True
+        text = collapsed.strip()
+        if self.__href is not None and not self.__link_open:
+            self.__link_open = True
+            text = '[' + text
+        self.__emit(text)
+        if collapsed[-1] == ' ':
+            self.__pending_space = True
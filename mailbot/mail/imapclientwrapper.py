@@ -1,5 +1,5 @@
 from configparser import ConfigParser
-from imaplib import IMAP4_SSL
+from imaplib import IMAP4, IMAP4_SSL
 from loguru import logger
 
 # This code defines an IMAP client that connects to an IMAP server using credentials from a configuration file.
@@ -10,11 +10,14 @@ class ImapClientWrapper:
         self.imap_server: str = config["IMAP"]["server"]
         self.imap_username: str = config["IMAP"]["username"]
         self.imap_password: str = config["IMAP"]["password"]
+        # Plain IMAP is only meant for local servers (tests, benchmarks, a bridge on localhost)
+        self.use_ssl: bool = config.getboolean("IMAP", "ssl", fallback=True)
         self.imap_client: IMAP4_SSL = None
 
     def __create_client(self) -> None:
         try:
-            self.imap_client = IMAP4_SSL(self.imap_server, self.imap_port)
+            client_class = IMAP4_SSL if self.use_ssl else IMAP4
+            self.imap_client = client_class(self.imap_server, self.imap_port)
             logger.info("IMAP client created successfully.")
         except Exception as e:
             logger.info(f"Failed to create IMAP client. Detailed error: {e}")
@@ -0,0 +1,184 @@
+from re import compile as re_compile
+from typing import Optional
+from loguru import logger
+
+# Minimal parser for imaplib FETCH responses. imaplib only splits the response at literals:
+# every literal arrives as a (text_before, literal_bytes) tuple and the rest of the line as plain bytes.
+# Tokens are str for atoms/quoted strings, bytes for literals, None for NIL and lists for parenthesized groups.
+
+MAILBOX_NAME_PATTERN = re_compile(r'(?:"((?:[^"\\]|\\.)*)"|([^\s"]+))\s*$')
+
+
+def _read_quoted(segment: bytes, index: int) -> tuple:
+    value = bytearray()
+    index += 1
+    while index < len(segment):
+        char = segment[index]
+        if char == 0x5C and index + 1 < len(segment):  # backslash escape
+            value.append(segment[index + 1])
+            index += 2
+            continue
+        if char == 0x22:  # closing quote
+            return value.decode('utf-8', errors='replace'), index + 1
+        value.append(char)
+        index += 1
+    return value.decode('utf-8', errors='replace'), index
+
+
+def _read_atom(segment: bytes, index: int) -> tuple:
+    start = index
+    bracket_depth = 0
+    while index < len(segment):
+        char = segment[index:index + 1]
+        if char == b'[':
+            bracket_depth += 1
+        elif char == b']':
+            bracket_depth -= 1
+        elif bracket_depth == 0 and char in b' ()\r\n':
+            break
+        index += 1
+    atom = segment[start:index].decode('utf-8', errors='replace')
+    return (None if atom.upper() == 'NIL' else atom), index
+
+
+def _tokenize(segment: bytes, tokens: list) -> None:
+    index = 0
+    while index < len(segment):
+        char = segment[index:index + 1]
+        if char in b' \r\n':
+            index += 1
+        elif char in b'()':
+            tokens.append(char.decode('ascii'))
+            index += 1
+        elif char == b'"':
+            value, index = _read_quoted(segment, index)
+            tokens.append(('quoted', value))
+        elif char == b'{':
+            # Literal size marker; the literal itself is the next element of the imaplib tuple
+            end = segment.find(b'}', index)
+            index = len(segment) if end == -1 else end + 1
+        else:
+            atom, index = _read_atom(segment, index)
+            tokens.append(('atom', atom))
+
+
+def _build(tokens: list, index: int) -> tuple:
+    values = []
+    while index < len(tokens):
+        token = tokens[index]
+        if token == '(':
+            nested, index = _build(tokens, index + 1)
+            values.append(nested)
+        elif token == ')':
+            return values, index + 1
+        else:
+            values.append(token[1] if isinstance(token, tuple) else token)
+            index += 1
+    return values, index
+
+
+def tokenize_response(data: list) -> list:
+    tokens = []
+    for item in data or []:
+        if isinstance(item, tuple):
+            _tokenize(item[0] if isinstance(item[0], bytes) else b'', tokens)
+            if len(item) > 1 and isinstance(item[1], bytes):
+                tokens.append(('literal', item[1]))
+        elif isinstance(item, bytes):
+            _tokenize(item, tokens)
+    values, _ = _build(tokens, 0)
+    return values
+
+
+# Turns the data of a (UID) FETCH command into one dict per message, e.g.
+# [{'UID': '10', 'BODYSTRUCTURE': [...], 'BODY[HEADER.FIELDS (FROM)]': b'From: ...'}]
+def parse_fetch_items(data: list) -> list:
+    values = tokenize_response(data)
+    messages = []
+    for index in range(len(values) - 1):
+        if isinstance(values[index], str) and values[index].isdigit() and isinstance(values[index + 1], list):
+            attributes = values[index + 1]
+            items = {}
+            for key, value in zip(attributes[::2], attributes[1::2]):
+                if isinstance(key, str):
+                    items[key.upper()] = value
+            messages.append(items)
+    return messages
+
+
+def get_body_section(items: dict, prefix: str = 'BODY[') -> Optional[bytes]:
+    for key, value in items.items():
+        if key.startswith(prefix) and isinstance(value, (bytes, str)):
+            return value.encode('utf-8') if isinstance(value, str) else value
+    return None
+
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {
+        str(key).lower(): param
+        for key, param in zip(value[::2], value[1::2])
+        if key is not None
+    }
+
+
+def _is_attachment(part: list) -> bool:
+    # Extension data of a text part: [..., size, lines, md5, disposition, language, location]
+    for extension in part[8:]:
+        if isinstance(extension, list) and extension and isinstance(extension[0], str):
+            return extension[0].lower() == 'attachment'
+    return False
+
+
+def _walk_text_parts(structure: list, section: str, found: list) -> None:
+    if not structure:
+        return
+    if isinstance(structure[0], list):
+        child_number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            child_number += 1
+            child_section = f"{section}.{child_number}" if section else str(child_number)
+            _walk_text_parts(child, child_section, found)
+        return
+
+    if len(structure) < 7 or not isinstance(structure[0], str) or not isinstance(structure[1], str):
+        return
+    if structure[0].lower() != 'text' or _is_attachment(structure):
+        return
+    found.append({
+        'section': section or '1',
+        'subtype': structure[1].lower(),
+        'charset': _params(structure[2]).get('charset') or 'utf-8',
+        'encoding': (structure[5] or '7bit').lower(),
+        'size': int(structure[6]) if str(structure[6]).isdigit() else None
+    })
+
+
+# Finds the section of the first text/plain part (falling back to text/html) in a BODYSTRUCTURE.
+# Non-multipart messages only have section "1" (RFC 3501 6.4.5).
+def find_text_part(structure) -> Optional[dict]:
+    if not isinstance(structure, list):
+        return None
+    found = []
+    _walk_text_parts(structure, '', found)
+    for subtype in ('plain', 'html'):
+        for part in found:
+            if part['subtype'] == subtype:
+                return part
+    return None
+
+
+# Extracts the mailbox name from a LIST response line such as b'(\\HasNoChildren) "/" "Sent Items"'.
+def decode_mailbox_name(mailbox_name: bytes) -> str:
+    try:
+        decoded = mailbox_name.decode('utf-8')
+        match = MAILBOX_NAME_PATTERN.search(decoded)
+        if match:
+            return match.group(1) if match.group(1) is not None else match.group(2)
+        return decoded
+    except Exception as e:
+        logger.info(f"Failed to decode mailbox name '{mailbox_name}': {e}")
+        return ""
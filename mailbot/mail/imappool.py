@@ -0,0 +1,99 @@
+from configparser import ConfigParser
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from typing import Iterator, Optional
+from mail.imapclientwrapper import ImapClientWrapper
+from loguru import logger
+
+# A bounded pool of logged-in IMAP connections. Each connection can only have one mailbox SELECTed,
+# so every worker that processes a mailbox leases its own connection from here.
+class ImapConnectionPool:
+    def __init__(self, config: ConfigParser, max_size: Optional[int] = None):
+        self.config = config
+        self.max_size: int = max_size or config.getint("IMAP", "pool_size", fallback=4)
+        if self.max_size < 1:
+            raise ValueError("IMAP pool size must be at least 1.")
+        self.acquire_timeout: float = config.getfloat("IMAP", "pool_acquire_timeout", fallback=300.0)
+        self.permits = BoundedSemaphore(self.max_size)
+        self.lock = Lock()
+        self.idle: list = []
+        self.closed = False
+
+    def __is_healthy(self, client_wrapper: ImapClientWrapper) -> bool:
+        client = client_wrapper.imap_client
+        if client is None or getattr(client, 'state', None) not in ('AUTH', 'SELECTED'):
+            return False
+        try:
+            return client.noop()[0] == 'OK'
+        except Exception as e:
+            logger.info(f"IMAP connection failed health check: {e}")
+            return False
+
+    def __close_quietly(self, client_wrapper: ImapClientWrapper) -> None:
+        if client_wrapper.imap_client is None:
+            return
+        try:
+            client_wrapper.disconnect()
+        except Exception as e:
+            logger.debug(f"Error while closing IMAP connection: {e}")
+
+    def acquire(self) -> ImapClientWrapper:
+        if self.closed:
+            raise Exception("IMAP connection pool is closed.")
+        if not self.permits.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"Timed out waiting for an IMAP connection after {self.acquire_timeout}s")
+
+        try:
+            with self.lock:
+                client_wrapper = self.idle.pop() if self.idle else ImapClientWrapper(self.config)
+
+            if not self.__is_healthy(client_wrapper):
+                # Stale or never connected: drop the old socket and log in again
+                self.__close_quietly(client_wrapper)
+                client_wrapper.initialize()
+                if not self.__is_healthy(client_wrapper):
+                    raise Exception("Unable to establish a healthy IMAP connection.")
+            return client_wrapper
+        except Exception:
+            self.permits.release()
+            raise
+
+    def release(self, client_wrapper: ImapClientWrapper, discard: bool = False) -> None:
+        try:
+            if discard or self.closed:
+                self.__close_quietly(client_wrapper)
+            else:
+                with self.lock:
+                    self.idle.append(client_wrapper)
+        finally:
+            self.permits.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[ImapClientWrapper]:
+        client_wrapper = self.acquire()
+        discard = False
+        try:
+            yield client_wrapper
+        except Exception:
+            # The connection may be in an unknown protocol state; do not hand it to the next worker
+            discard = True
+            raise
+        finally:
+            self.release(client_wrapper, discard)
+
+    # Waits for leased connections to come back, then logs every connection out.
+    def close(self) -> None:
+        self.closed = True
+        drained = 0
+        for _ in range(self.max_size):
+            if self.permits.acquire(timeout=self.acquire_timeout):
+                drained += 1
+            else:
+                logger.warning("Timed out waiting for a leased IMAP connection during shutdown.")
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for client_wrapper in idle:
+            self.__close_quietly(client_wrapper)
+        for _ in range(drained):
+            self.permits.release()
+        logger.info(f"IMAP connection pool closed ({len(idle)} connection(s) logged out).")
@@ -1,41 +1,161 @@
 from imaplib import IMAP4_SSL
 from configparser import ConfigParser
-from typing import Optional
+from collections import defaultdict
+from typing import Iterable, Iterator, Optional
 from mail.imapclientwrapper import ImapClientWrapper
-from re import search
+from re import compile as re_compile
+from select import select
+from ssl import SSLWantReadError
+from threading import Event
+from time import monotonic
 from email import message_from_bytes
+from mail.bodyextractor import BodyExtractor
 from mail.emailwrapper import EmailWrapper
+from mail.syncstate import SyncState, incremental_search_criteria
+from mail.imapparser import decode_mailbox_name, find_text_part, get_body_section, parse_fetch_items
+from mail.streamparser import StreamingBodyExtractor
+from mail.utils import chunked, decode_partial_text, to_sequence_set
 from cache.cache import ImportanceLevel
 from loguru import logger
 
+EXISTS_PATTERN = re_compile(rb'^\* \d+ EXISTS')
+STATUS_PATTERN = re_compile(r'^(?:"((?:[^"\\]|\\.)*)"|(\S+))\s+\((.*)\)$')
+
 class ImapService:
-    def __init__(self, config: ConfigParser):
-        self.client_wrapper = ImapClientWrapper(config)
-        self.imap_client: IMAP4_SSL = self.client_wrapper.initialize()
+    # Fetch items tried in order for every chunk; later items are only used for UIDs the previous ones could not return.
+    FETCH_ITEMS = ('BODY.PEEK[]', 'BODY[]')
+    STATUS_ITEMS = 'UNSEEN UIDNEXT UIDVALIDITY'
+    # Everything the cache lookup and EmailWrapper need, without downloading the body
+    HEADER_FIELDS = 'FROM TO SUBJECT DATE MESSAGE-ID CONTENT-TYPE'
+
+    # client_wrapper and sync_state can be passed in when the connection is leased from an ImapConnectionPool
+    # and several services share one sync state file.
+    def __init__(self, config: ConfigParser, client_wrapper: Optional[ImapClientWrapper] = None, sync_state: Optional[SyncState] = None):
+        self.client_wrapper = client_wrapper or ImapClientWrapper(config)
+        self.imap_client: IMAP4_SSL = self.client_wrapper.imap_client or self.client_wrapper.initialize()
         self.most_important_folder = config["IMAP"]["most_important_folder"]
         self.medium_important_folder = config["IMAP"]["medium_important_folder"]
         self.less_important_folder = config["IMAP"]["less_important_folder"]
         self.likely_junk_folder = config["IMAP"]["likely_junk_folder"]
+        self.fetch_chunk_size = config.getint("IMAP", "fetch_chunk_size", fallback=50)
+        self.header_first_fetch = config.getboolean("IMAP", "header_first_fetch", fallback=True)
+        self.body_fetch_bytes = config.getint("IMAP", "body_fetch_bytes", fallback=4096)
+        self.stream_window_bytes = config.getint("IMAP", "stream_window_bytes", fallback=64 * 1024)
+        self.max_message_bytes = config.getint("IMAP", "max_message_bytes", fallback=4 * 1024 * 1024)
+        self.max_body_bytes = config.getint("IMAP", "max_body_bytes", fallback=256 * 1024)
+        self.body_extractor = BodyExtractor(config)
+        self.__text_parts: dict = {}
+        self.sync_state: Optional[SyncState] = None
+        if config.getboolean("IMAP", "incremental_sync", fallback=True):
+            self.sync_state = sync_state or SyncState(config)
+        self.idle_poll_interval = config.getfloat("IMAP", "idle_poll_interval", fallback=5.0)
+        self.mailbox_list_ttl = config.getint("IMAP", "mailbox_list_ttl", fallback=3600)
+        self.__mailbox_list_cache: tuple = (0.0, None)
+        self.selected_state: dict = {}
+        self.__pending_sync: dict = {}
+        self.__condstore_client: Optional[IMAP4_SSL] = None
     
     def get_mailbox_list(self) -> list:
+        cached = self.__get_cached_mailbox_list()
+        if cached is not None:
+            logger.info(f"Using cached mailbox list ({len(cached)} mailboxes)")
+            return cached
         try:
             _, mailboxes = self.imap_client.list()
-            return [self.__decode_mailbox_name(mailbox) for mailbox in mailboxes]
+            mailbox_list = [decode_mailbox_name(mailbox) for mailbox in mailboxes]
+            self.__cache_mailbox_list(mailbox_list)
+            return mailbox_list
         except Exception as e:
             logger.info(f"Failed to retrieve mailbox list: {e}")
             return []
-    
-    def __decode_mailbox_name(self, mailbox_name: bytes) -> str:
+
+    def __get_cached_mailbox_list(self) -> Optional[list]:
+        if self.sync_state:
+            return self.sync_state.get_mailbox_list(self.mailbox_list_ttl)
+        listed_at, mailbox_list = self.__mailbox_list_cache
+        if mailbox_list is None or monotonic() - listed_at > self.mailbox_list_ttl:
+            return None
+        return list(mailbox_list)
+
+    def __cache_mailbox_list(self, mailbox_list: list) -> None:
+        if self.sync_state:
+            self.sync_state.set_mailbox_list(mailbox_list)
+        else:
+            self.__mailbox_list_cache = (monotonic(), list(mailbox_list))
+
+    # Parses b'"INBOX" (UNSEEN 2 UIDNEXT 10 UIDVALIDITY 1)' into ("INBOX", {"UNSEEN": 2, ...})
+    def __parse_status(self, response: bytes) -> Optional[tuple]:
+        if not isinstance(response, bytes):
+            return None
+        match = STATUS_PATTERN.match(response.decode('utf-8', errors='replace').strip())
+        if not match:
+            return None
+        mailbox_name = match.group(1) if match.group(1) is not None else match.group(2)
+        items = match.group(3).split()
+        values = {}
+        for key, value in zip(items[::2], items[1::2]):
+            try:
+                values[key.upper()] = int(value)
+            except ValueError:
+                continue
+        return mailbox_name, values
+
+    # LIST-STATUS (RFC 5819) returns the folder list and the STATUS of every folder in one round trip.
+    # imaplib has no wrapper for the RETURN option, hence the lower level command.
+    def __list_status(self) -> Optional[dict]:
         try:
-            decoded = mailbox_name.decode('utf-8')
-            match = search(r'"([^"]+)"\s*$', decoded)
-            if match:
-                return match.group(1)
-            return decoded
+            status, data = self.imap_client._simple_command(
+                'LIST', '""', '"*"', 'RETURN', f'(STATUS {self.STATUS_ITEMS})'
+            )
+            if status != 'OK':
+                return None
+            _, mailboxes = self.imap_client._untagged_response(status, data, 'LIST')
+            _, status_responses = self.imap_client.response('STATUS')
+            self.__cache_mailbox_list([decode_mailbox_name(mailbox) for mailbox in mailboxes if mailbox])
+            parsed = [self.__parse_status(response) for response in status_responses or []]
+            return dict(item for item in parsed if item)
         except Exception as e:
-            logger.info(f"Failed to decode mailbox name '{mailbox_name}': {e}")
-            return ""
-    
+            logger.info(f"LIST-STATUS failed, falling back to STATUS per mailbox: {e}")
+            return None
+
+    def __status(self, mailbox_name: str) -> Optional[dict]:
+        try:
+            status, data = self.imap_client.status(f'"{mailbox_name}"', f'({self.STATUS_ITEMS})')
+            if status != 'OK' or not data:
+                return None
+            parsed = self.__parse_status(data[0])
+            return parsed[1] if parsed else None
+        except Exception as e:
+            logger.info(f"Failed to get STATUS for {mailbox_name}: {e}")
+            return None
+
+    def __has_work(self, mailbox_name: str, status: Optional[dict]) -> bool:
+        if status is None or 'UNSEEN' not in status:
+            return True
+        if status['UNSEEN'] == 0:
+            return False
+        stored = self.sync_state.get(mailbox_name) if self.sync_state else None
+        if stored and stored.get('uidvalidity') == status.get('UIDVALIDITY') and stored.get('uidnext'):
+            return status.get('UIDNEXT') != stored['uidnext']
+        return True
+
+    # Returns the subset of mailboxes that have unseen mail the bot has not looked at yet, without selecting any of them.
+    # Mailboxes in `pending` (those with queued retries or moves) are always kept.
+    def scan_mailboxes(self, mailboxes: list, pending: Iterable = ()) -> list:
+        if not self.imap_client or not self.imap_client.noop()[0] == 'OK':
+            self.imap_client = self.client_wrapper.initialize()
+        statuses = self.__list_status() if self.__has_capability('LIST-STATUS') else None
+        if statuses is None:
+            statuses = {mailbox: self.__status(mailbox) for mailbox in mailboxes}
+
+        active = []
+        for mailbox in mailboxes:
+            if mailbox in pending or self.__has_work(mailbox, statuses.get(mailbox)):
+                active.append(mailbox)
+            else:
+                logger.info(f"No new unseen emails in {mailbox}. Skipping...")
+        return active
+
     def __select_mailbox(self, mailbox_name: str) -> None:
         status, _ = self.imap_client.select(f'"{mailbox_name}"')
         if status != 'OK':
@@ -49,156 +169,212 @@ class ImapService:
             return [email_id.strip() for email_id in ids]
         return []
     
+    # ENABLE is only valid before the first SELECT, so it is sent once per (re)connected client.
+    def __enable_condstore(self) -> None:
+        if self.__condstore_client is self.imap_client:
+            return
+        self.__condstore_client = self.imap_client
+        if self.__has_capability('CONDSTORE') or self.__has_capability('QRESYNC'):
+            try:
+                self.imap_client.enable('CONDSTORE')
+                logger.info("CONDSTORE enabled for this connection.")
+            except Exception as e:
+                logger.info(f"Failed to enable CONDSTORE: {e}")
+
+    def __response_code_value(self, code: str) -> Optional[int]:
+        try:
+            _, data = self.imap_client.response(code)
+            return int(data[-1]) if data and data[-1] is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def __read_selected_state(self) -> dict:
+        return {
+            'uidvalidity': self.__response_code_value('UIDVALIDITY'),
+            'uidnext': self.__response_code_value('UIDNEXT'),
+            'highestmodseq': self.__response_code_value('HIGHESTMODSEQ')
+        }
+
     def fetch_email_ids(self, mailbox_name: str) -> list:
         try:
             if not self.imap_client or not self.imap_client.noop()[0] == 'OK':
                 self.imap_client = self.client_wrapper.initialize()
+            self.__enable_condstore()
             self.__select_mailbox(mailbox_name)
-            _, email_ids = self.imap_client.search(None, 'UNSEEN')
+            self.selected_state = self.__read_selected_state()
+            self.__pending_sync[mailbox_name] = self.selected_state
+
+            stored = self.sync_state.get(mailbox_name) if self.sync_state else None
+            criteria, last_uidnext = incremental_search_criteria(mailbox_name, stored, self.selected_state)
+            if criteria is None:
+                logger.info(f"No new emails in {mailbox_name} since the last sync")
+                return []
+
+            _, email_ids = self.imap_client.uid('SEARCH', None, *criteria)
             formatted_ids = self.__format_email_ids(email_ids)
+            if last_uidnext:
+                # "n:*" always matches the highest UID, even when it is below n
+                formatted_ids = [email_id for email_id in formatted_ids if int(email_id) >= last_uidnext]
             logger.info(f"Found {len(formatted_ids)} unseen emails in {mailbox_name}")
             return formatted_ids
         except Exception as e:
+            # A failed search must never be committed as if every UID up to UIDNEXT had been handled
+            self.__pending_sync.pop(mailbox_name, None)
             logger.info(f"Failed to fetch emails: {e}")
             return []
-    
-    def __fetch_raw_email(self, email_id: str) -> bytes:
-        # Method 1: Standard Body fetch
-        logger.debug(f"Attempting to fetch email ID {email_id} with (RFC822)")
-        status, data = self.imap_client.fetch(str(email_id), '(RFC822)')            
-        if status != 'OK':
-            logger.warning(f"Failed to fetch email ID {email_id} with (RFC822). Status: {status}")
-            raise Exception(f"Failed to fetch email with ID {email_id}: {status}")
-        
-        # Validate the fetch response
-        if not data or len(data) == 0:
-            logger.warning(f"No data returned for email ID {email_id} with (RFC822).")
-            raise Exception(f"No data returned for email ID {email_id}")
-        
-        # Handle different response formats
-        raw_email = None
-        
-        # Check if we got the expected tuple format
-        if isinstance(data[0], tuple) and len(data[0]) >= 2:
-            raw_email = data[0][1]
-        
-        # Handle the case where we get bytes response like b'5974 ()'
-        elif isinstance(data[0], bytes):
-            response_str = data[0].decode('utf-8')
-            if '()' in response_str:                    
-                # Try BODY.PEEK[]
-                logger.debug(f"Attempting to fetch email ID {email_id} with (BODY.PEEK[])")
-                status2, data2 = self.imap_client.fetch(str(email_id), '(BODY.PEEK[])')
-                if status2 == 'OK' and data2:
-                    if isinstance(data2[0], tuple) and len(data2[0]) >= 2:
-                        raw_email = data2[0][1]
-                
-                # If still no luck, try BODY[]
-                if raw_email is None:
-                    status3, data3 = self.imap_client.fetch(str(email_id), '(BODY[])')
-                    if status3 == 'OK' and data3:
-                        if isinstance(data3[0], tuple) and len(data3[0]) >= 2:
-                            raw_email = data3[0][1]
-                
-                # If still no luck, try FLAGS to see if email exists
-                if raw_email is None:
-                    status4, data4 = self.imap_client.fetch(str(email_id), '(FLAGS)')
-                    if status4 != 'OK':
-                        raise Exception(f"Email ID {email_id} may not exist or may have been deleted")
-                    else:
-                        raise Exception(f"Email ID {email_id} exists but content could not be retrieved")
-        
-        if raw_email is None:
-            raise Exception(f"Could not extract email content for ID {email_id}")
-        
-        # Ensure raw_email is bytes
-        if not isinstance(raw_email, bytes):
-            raise Exception(f"Expected bytes, got {type(raw_email)} for email ID {email_id}")
-        
-        return raw_email
-
-    def __construct_email(self, msg, body) -> EmailWrapper:
+
+    # Persists the state observed by the last fetch_email_ids call. Only call this once every returned UID
+    # has been handled, otherwise the unhandled ones are skipped by the next incremental sync.
+    def commit_sync_state(self, mailbox_name: str) -> None:
+        state = self.__pending_sync.pop(mailbox_name, None)
+        if not self.sync_state or not state or state.get('uidvalidity') is None:
+            return
+        self.sync_state.update(mailbox_name, state['uidvalidity'], state['uidnext'], state['highestmodseq'])
+
+    # Streams one chunk of UIDs through StreamingBodyExtractor using partial fetches of stream_window_bytes.
+    # Every round is a single UID FETCH for all messages that still need bytes, so a chunk costs as many
+    # round trips as its longest message needs windows (usually one). Messages that come back empty
+    # (e.g. b'5974 ()') are retried together with the next fetch item instead of one by one.
+    def __stream_chunk(self, uids: list) -> dict:
+        extractors = {}
+        for fetch_item in self.FETCH_ITEMS:
+            active = [uid for uid in uids if uid not in extractors]
+            offset = 0
+            while active and offset < self.max_message_bytes:
+                sequence_set = to_sequence_set(active)
+                logger.debug(f"Attempting to fetch UIDs {sequence_set} with ({fetch_item}<{offset}.{self.stream_window_bytes}>)")
+                status, data = self.imap_client.uid(
+                    'FETCH', sequence_set, f'(UID {fetch_item}<{offset}.{self.stream_window_bytes}>)'
+                )
+                if status != 'OK':
+                    logger.warning(f"Failed to fetch UIDs {sequence_set} with ({fetch_item}). Status: {status}")
+                    break
+                payloads = {item.get('UID'): get_body_section(item) for item in parse_fetch_items(data)}
+
+                still_reading = []
+                for uid in active:
+                    payload = payloads.get(uid)
+                    if payload is None:
+                        continue
+                    extractor = extractors.setdefault(uid, StreamingBodyExtractor(self.max_body_bytes))
+                    extractor.feed(payload)
+                    if not extractor.done and len(payload) >= self.stream_window_bytes:
+                        still_reading.append(uid)
+                active = still_reading
+                offset += self.stream_window_bytes
+
+        missing = [uid for uid in uids if uid not in extractors]
+        if missing:
+            logger.warning(f"Could not extract email content for UIDs {to_sequence_set(missing)}")
+        return extractors
+
+    def __construct_email(self, msg, body, uid: str = None) -> EmailWrapper:
         return EmailWrapper(
             subject=msg.get('Subject', 'No Subject'),
             body=body,
             sender=msg.get('From', 'Unknown Sender'),
             recipient=msg.get('To', 'Unknown Recipient'),
             date=msg.get('Date', 'Unknown Date'),
-            message_id=msg.get('Message-ID', 'No Message ID')
+            message_id=msg.get('Message-ID', 'No Message ID'),
+            uid=uid
         )
 
-    def __extract_email_body(self, msg) -> str:
-        body = ""
-        
-        try:
-            if msg.is_multipart():
-                # Handle multipart messages
-                for part in msg.walk():
-                    try:
-                        content_type = part.get_content_type()
-                        content_disposition = str(part.get("Content-Disposition", ""))
-                        
-                        # Skip attachments
-                        if "attachment" in content_disposition:
-                            continue
-                        
-                        # Look for text/plain parts first
-                        if content_type == "text/plain":
-                            payload = part.get_payload(decode=True)
-                            if payload is not None and isinstance(payload, bytes):
-                                body = payload.decode('utf-8', errors='replace')
-                                break
-                            elif payload is not None and isinstance(payload, str):
-                                body = payload
-                                break
-                        # Fall back to text/html if no plain text found
-                        elif content_type == "text/html" and not body:
-                            payload = part.get_payload(decode=True)
-                            if payload is not None and isinstance(payload, bytes):
-                                body = payload.decode('utf-8', errors='replace')
-                            elif payload is not None and isinstance(payload, str):
-                                body = payload
-                    except Exception as part_error:
-                        logger.info(f"Error processing email part: {part_error}")
-                        continue
-            else:
-                # Handle simple (non-multipart) messages
+    def fetch_emails(self, uids: list, chunk_size: Optional[int] = None) -> Iterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        if not self.imap_client:
+            self.imap_client = self.client_wrapper.initialize()
+        for chunk in chunked([str(uid) for uid in uids], chunk_size):
+            try:
+                extractors = self.__stream_chunk(chunk)
+            except Exception as e:
+                logger.exception(f"Failed to fetch UIDs {to_sequence_set(chunk)}: {e}")
+                continue
+            for uid in chunk:
+                if uid not in extractors:
+                    continue
                 try:
-                    payload = msg.get_payload(decode=True)
-                    if payload is not None and isinstance(payload, bytes):
-                        body = payload.decode('utf-8', errors='replace')
-                    elif payload is not None and isinstance(payload, str):
-                        body = payload
-                    else:
-                        # Try without decode=True
-                        payload = msg.get_payload()
-                        if isinstance(payload, str):
-                            body = payload
-                except Exception as payload_error:
-                    logger.info(f"Error getting payload: {payload_error}")
-                    # Last resort - try to get payload as string
-                    try:
-                        body = str(msg.get_payload())
-                    except:
-                        body = "Could not extract email body"
-        
-        except Exception as e:
-            logger.info(f"Error extracting email body: {e}")
-            body = "Error extracting email body"
-        
-        return body
-    
+                    extractor = extractors.pop(uid)
+                    msg, body = extractor.close()
+                    yield self.__construct_email(msg, self.body_extractor.from_text(body, extractor.content_subtype), uid)
+                except Exception as e:
+                    logger.exception(f"Failed to parse email with UID {uid}: {e}")
+
+    # Phase one of the header-first fetch: one UID FETCH per chunk for the BODYSTRUCTURE and a handful of
+    # header fields. The yielded emails have an empty body; pass the ones that need classifying to
+    # fetch_partial_bodies.
+    def fetch_headers(self, uids: list, chunk_size: Optional[int] = None) -> Iterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        if not self.imap_client:
+            self.imap_client = self.client_wrapper.initialize()
+        self.__text_parts = {}
+        for chunk in chunked([str(uid) for uid in uids], chunk_size):
+            sequence_set = to_sequence_set(chunk)
+            try:
+                status, data = self.imap_client.uid(
+                    'FETCH', sequence_set, f'(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({self.HEADER_FIELDS})])'
+                )
+                if status != 'OK':
+                    logger.warning(f"Failed to fetch headers for UIDs {sequence_set}. Status: {status}")
+                    continue
+                items = parse_fetch_items(data)
+            except Exception as e:
+                logger.exception(f"Failed to fetch headers for UIDs {sequence_set}: {e}")
+                continue
+
+            for item in items:
+                uid = item.get('UID')
+                header = get_body_section(item, 'BODY[HEADER')
+                if uid not in chunk or header is None:
+                    continue
+                try:
+                    self.__text_parts[uid] = find_text_part(item.get('BODYSTRUCTURE'))
+                    yield self.__construct_email(message_from_bytes(header), "", uid)
+                except Exception as e:
+                    logger.exception(f"Failed to parse headers of email with UID {uid}: {e}")
+
+    # Phase two: fetches only the first N bytes of the first text part of every email, grouped so emails
+    # whose text lives in the same section share one UID FETCH. Emails without a usable BODYSTRUCTURE
+    # fall back to a full fetch.
+    def fetch_partial_bodies(self, emails: Iterable[EmailWrapper], chunk_size: Optional[int] = None) -> Iterator[EmailWrapper]:
+        chunk_size = chunk_size or self.fetch_chunk_size
+        for chunk in chunked(emails, chunk_size):
+            by_section = defaultdict(list)
+            full_fetch = []
+            for email in chunk:
+                text_part = self.__text_parts.pop(email.uid, None)
+                if text_part is None:
+                    full_fetch.append(email.uid)
+                else:
+                    by_section[text_part['section']].append((email, text_part))
+
+            for section, entries in by_section.items():
+                sequence_set = to_sequence_set([email.uid for email, _ in entries])
+                try:
+                    status, data = self.imap_client.uid(
+                        'FETCH', sequence_set, f'(UID BODY.PEEK[{section}]<0.{self.body_fetch_bytes}>)'
+                    )
+                    if status != 'OK':
+                        logger.warning(f"Failed to fetch section {section} for UIDs {sequence_set}. Status: {status}")
+                        continue
+                    payloads = {item.get('UID'): get_body_section(item) for item in parse_fetch_items(data)}
+                except Exception as e:
+                    logger.exception(f"Failed to fetch section {section} for UIDs {sequence_set}: {e}")
+                    continue
+
+                for email, text_part in entries:
+                    payload = payloads.get(email.uid)
+                    if payload is None:
+                        logger.warning(f"No body returned for email with UID {email.uid}")
+                        continue
+                    text = decode_partial_text(payload, text_part['encoding'], text_part['charset'])
+                    email.body = self.body_extractor.from_text(text, text_part['subtype'])
+                    yield email
+
+            if full_fetch:
+                yield from self.fetch_emails(full_fetch)
+
     def fetch_email(self, email_id: str) -> Optional[EmailWrapper]:
-        try:
-            if not self.imap_client:
-                self.imap_client = self.client_wrapper.initialize()
-            raw_email = self.__fetch_raw_email(email_id)            
-            msg = message_from_bytes(raw_email)
-            body = self.__extract_email_body(msg)
-            return self.__construct_email(msg, body)
-        except Exception as e:
-            logger.exception(f"Failed to fetch email with ID {email_id}: {e}")
-            return None
+        return next(self.fetch_emails([email_id], chunk_size=1), None)
 
     def __importance_level_to_str(self, importance: ImportanceLevel) -> str:
         if importance == ImportanceLevel.LEAST_IMPORTANT:
@@ -212,56 +388,133 @@ class ImapService:
         else:
             raise Exception("Incorrect importance level passed. Please check if importance level is correct.")
 
-    def move_to_folder_and_mark_read(self, email_id: str, importance: ImportanceLevel) -> None:
+    def __has_capability(self, capability: str) -> bool:
+        return capability in (getattr(self.imap_client, 'capabilities', None) or ())
+
+    # Moves every UID in email_ids to the folder of the given importance level using a single sequence set.
+    # Uses UID MOVE (RFC 6851) when advertised, otherwise COPY + STORE \Deleted followed by one expunge
+    # (UID EXPUNGE when UIDPLUS is available so other deleted messages in the mailbox are left alone).
+    def move_emails(self, email_ids: list, importance: ImportanceLevel, mark_unread: bool = True) -> bool:
+        if not email_ids:
+            return True
+        sequence_set = to_sequence_set(email_ids)
         try:
             folder_to_move = self.__importance_level_to_str(importance)
             if not folder_to_move:
                 raise ValueError(f"{folder_to_move} is not configured in the config file.")
-            self.mark_email_as_read(email_id)
-            self.imap_client.copy(email_id, f'"{folder_to_move}"')
-            self.mark_email_as_deleted(email_id)
-            self.imap_client.expunge()
-            logger.info(f"Email with ID {email_id} moved to {folder_to_move}.")
+            flag_command = '-FLAGS.SILENT' if mark_unread else '+FLAGS.SILENT'
+            status, data = self.imap_client.uid('STORE', sequence_set, flag_command, '(\\Seen)')
+            if status != 'OK':
+                raise Exception(f"UID STORE \\Seen failed: {status} {data}")
+
+            if self.__has_capability('MOVE'):
+                status, data = self.imap_client.uid('MOVE', sequence_set, f'"{folder_to_move}"')
+                if status != 'OK':
+                    raise Exception(f"UID MOVE failed: {status} {data}")
+            else:
+                status, data = self.imap_client.uid('COPY', sequence_set, f'"{folder_to_move}"')
+                if status != 'OK':
+                    raise Exception(f"UID COPY failed: {status} {data}")
+                status, data = self.imap_client.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Deleted)')
+                if status != 'OK':
+                    raise Exception(f"UID STORE \\Deleted failed: {status} {data}")
+                status = None
+                if self.__has_capability('UIDPLUS'):
+                    status, data = self.imap_client.uid('EXPUNGE', sequence_set)
+                if status != 'OK':
+                    # Without UIDPLUS, or if UID EXPUNGE was refused, the copies exist and the originals are flagged
+                    status, data = self.imap_client.expunge()
+                    if status != 'OK':
+                        raise Exception(f"EXPUNGE failed: {status} {data}")
+            logger.info(f"{len(email_ids)} email(s) with UIDs {sequence_set} moved to {folder_to_move}.")
+            return True
         except Exception as e:
-            logger.info(f"Failed to move email with ID {email_id} to folder: {e}. Email is marked unread")
-            self.mark_email_as_unread(email_id)
-    
+            logger.info(f"Failed to move emails with UIDs {sequence_set} to folder: {e}. Emails are marked unread")
+            self.mark_email_as_unread(sequence_set)
+            return False
+
+    def move_to_folder_and_mark_read(self, email_id: str, importance: ImportanceLevel) -> None:
+        self.move_emails([email_id], importance, mark_unread=False)
+
     def move_to_folder_and_mark_unread(self, email_id: str, importance: ImportanceLevel) -> None:
-        try:
-            folder_to_move = self.__importance_level_to_str(importance)
-            if not folder_to_move:
-                raise ValueError(f"{folder_to_move} is not configured in the config file.")
-            self.mark_email_as_unread(email_id)
-            self.imap_client.copy(email_id, f'"{folder_to_move}"')
-            self.mark_email_as_read(email_id)
-            self.mark_email_as_deleted(email_id)
-            self.imap_client.expunge()
-            logger.info(f"Email with ID {email_id} moved to {folder_to_move}.")
-        except Exception as e:
-            logger.info(f"Failed to move email with ID {email_id} to folder: {e}. Email is marked unread")
-            self.mark_email_as_unread(email_id)
+        self.move_emails([email_id], importance)
 
     def mark_email_as_read(self, email_id: str) -> None:
         try:
-            self.imap_client.store(email_id, '+FLAGS', ('\\Seen',))
+            self.imap_client.uid('STORE', email_id, '+FLAGS', '(\\Seen)')
             logger.info(f"Email with ID {email_id} marked as read.")
         except Exception as e:
             logger.info(f"Failed to mark email with ID {email_id} as read: {e}")
 
     def mark_email_as_deleted(self, email_id: str) -> None:
         try:
-            self.imap_client.store(email_id, '+FLAGS', '\\Deleted')            
+            self.imap_client.uid('STORE', email_id, '+FLAGS', '(\\Deleted)')
             logger.info(f"Email with ID {email_id} marked as deleted.")
         except Exception as e:
             logger.info(f"Failed to mark email with ID {email_id} as deleted: {e}")
 
     def mark_email_as_unread(self, email_id: str) -> None:
         try:
-            self.imap_client.store(email_id, '-FLAGS', ('\\Seen',))
+            self.imap_client.uid('STORE', email_id, '-FLAGS', '(\\Seen)')
             logger.info(f"Email with ID {email_id} marked as unread.")
         except Exception as e:
             logger.info(f"Failed to mark email with ID {email_id} as unread: {e}")
     
+    # True when a response line is already buffered by imaplib's reader or the TLS layer, where select()
+    # cannot see it. The non-blocking peek reads at most what is already available.
+    def __response_buffered(self) -> bool:
+        sock = self.imap_client.sock
+        previous_timeout = sock.gettimeout()
+        sock.settimeout(0.0)
+        try:
+            return bool(self.imap_client.file.peek(1))
+        except (BlockingIOError, SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(previous_timeout)
+
+    # IMAP IDLE (RFC 2177) on the currently selected mailbox. imaplib has no IDLE support before Python 3.14,
+    # so the command is driven on the raw connection. Returns True when the server reported new mail (EXISTS).
+    # IDLE ends on the first untagged response, after `timeout` seconds (keep it below the 29 minute server
+    # limit) or when stop_event is set; callers re-check the mailbox and re-arm.
+    def wait_for_new_mail(self, timeout: float, stop_event: Optional[Event] = None) -> bool:
+        client = self.imap_client
+        tag = client._new_tag()
+        client.send(tag + b' IDLE\r\n')
+        response = client.readline()
+        if not response.startswith(b'+'):
+            raise Exception(f"Server rejected IDLE: {response!r}")
+
+        new_mail = False
+        deadline = monotonic() + timeout
+        try:
+            while not (stop_event and stop_event.is_set()):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                if not self.__response_buffered():
+                    readable, _, _ = select([client.sock], [], [], min(self.idle_poll_interval, remaining))
+                    if not readable:
+                        continue
+                response = client.readline()
+                if not response:
+                    raise client.abort("Connection closed during IDLE")
+                if EXISTS_PATTERN.match(response):
+                    new_mail = True
+                logger.debug(f"IDLE notification: {response!r}")
+                break
+        finally:
+            client.send(b'DONE\r\n')
+            while True:
+                response = client.readline()
+                if not response:
+                    raise client.abort("Connection closed while ending IDLE")
+                if response.startswith(tag):
+                    break
+                if EXISTS_PATTERN.match(response):
+                    new_mail = True
+        return new_mail
+
     def restart(self) -> None:
         try:
             if self.imap_client:
@@ -0,0 +1,150 @@
+from email.message import Message
+from email.parser import BytesFeedParser
+from typing import Optional
+
+# Extracts the first readable text part of a message that is fed in pieces (e.g. partial IMAP fetches)
+# without ever holding the whole message. Only header blocks and the selected text part are buffered;
+# everything else (attachments, inline images, preambles) is scanned for MIME boundaries and dropped.
+# The small buffered pieces are handed to BytesFeedParser for the actual header/transfer-encoding parsing.
+class StreamingBodyExtractor:
+    # Boundary lines are at most 70 characters plus dashes; longer partial lines in skipped parts are dropped
+    MAX_SKIPPED_LINE = 1024
+
+    def __init__(self, max_body_bytes: int = 256 * 1024, max_header_bytes: int = 64 * 1024):
+        self.max_body_bytes = max_body_bytes
+        self.max_header_bytes = max_header_bytes
+        self.headers: Optional[Message] = None
+        self.body: Optional[str] = None
+        self.content_subtype: Optional[str] = None
+        self.done = False
+        self.bytes_seen = 0
+        self.__state = 'headers'
+        self.__boundaries: list = []
+        self.__partial = b''
+        self.__header_block = bytearray()
+        self.__part_headers: Optional[bytes] = None
+        self.__part_body = bytearray()
+
+    def feed(self, data: bytes) -> None:
+        if self.done or not data:
+            return
+        self.bytes_seen += len(data)
+        data = self.__partial + data
+        lines = data.splitlines(keepends=True)
+        # A trailing b'\r' may be the first half of a CRLF split across two pieces
+        if lines and not lines[-1].endswith(b'\n'):
+            self.__partial = lines.pop()
+            if self.__state in ('skip', 'preamble') and len(self.__partial) > self.MAX_SKIPPED_LINE:
+                self.__partial = b''
+        else:
+            self.__partial = b''
+        for line in lines:
+            self.__process_line(line)
+            if self.done:
+                self.__partial = b''
+                return
+
+    # Finishes parsing and returns the top level headers and the decoded text of the selected part.
+    def close(self) -> tuple:
+        if not self.done:
+            if self.__partial:
+                self.__process_line(self.__partial)
+                self.__partial = b''
+            if self.__state == 'headers':
+                self.__end_headers()
+            if self.__state == 'keep':
+                self.__finish_part()
+        self.done = True
+        return self.headers or Message(), self.body or ""
+
+    def __parse_headers(self, header_block: bytes) -> Message:
+        parser = BytesFeedParser()
+        parser.feed(header_block + b'\r\n')
+        return parser.close()
+
+    def __match_boundary(self, line: bytes) -> tuple:
+        if not self.__boundaries or not line.startswith(b'--'):
+            return None, False
+        stripped = line.rstrip()
+        for depth in range(len(self.__boundaries) - 1, -1, -1):
+            marker = self.__boundaries[depth]
+            if stripped == marker:
+                return depth, False
+            if stripped == marker + b'--':
+                return depth, True
+        return None, False
+
+    def __process_line(self, line: bytes) -> None:
+        depth, closing = self.__match_boundary(line)
+        if depth is not None:
+            if self.__state == 'keep':
+                # The line break before a boundary belongs to the boundary (RFC 2046 5.1.1)
+                if self.__part_body.endswith(b'\r\n'):
+                    del self.__part_body[-2:]
+                elif self.__part_body.endswith(b'\n'):
+                    del self.__part_body[-1:]
+                self.__finish_part()
+                if self.done:
+                    return
+            del self.__boundaries[depth + 1:]
+            if closing:
+                self.__boundaries.pop()
+                self.__state = 'skip'
+            else:
+                self.__state = 'part_headers'
+                self.__header_block = bytearray()
+            return
+
+        if self.__state in ('headers', 'part_headers'):
+            if line in (b'\r\n', b'\n', b'\r'):
+                self.__end_headers()
+            elif len(self.__header_block) + len(line) <= self.max_header_bytes:
+                self.__header_block += line
+        elif self.__state == 'keep':
+            remaining = self.max_body_bytes - len(self.__part_body)
+            if len(line) > remaining:
+                # Memory ceiling reached: keep what fits and stop reading the message
+                self.__finish_part()
+                self.done = True
+                return
+            self.__part_body += line
+
+    def __end_headers(self) -> None:
+        header_block = bytes(self.__header_block)
+        headers = self.__parse_headers(header_block)
+        if self.__state == 'headers':
+            self.headers = headers
+        self.__header_block = bytearray()
+
+        if headers.get_content_maintype() == 'multipart':
+            boundary = headers.get_boundary()
+            if boundary:
+                self.__boundaries.append(b'--' + boundary.encode('utf-8', errors='replace'))
+                self.__state = 'preamble'
+                return
+        if headers.get_content_type() in ('text/plain', 'text/html') and headers.get_content_disposition() != 'attachment':
+            self.__part_headers = header_block
+            self.__part_body = bytearray()
+            self.content_subtype = headers.get_content_subtype()
+            self.__state = 'keep'
+        else:
+            self.__state = 'skip'
+
+    def __finish_part(self) -> None:
+        parser = BytesFeedParser()
+        parser.feed(self.__part_headers.rstrip(b'\r\n') + b'\r\n\r\n')
+        parser.feed(bytes(self.__part_body))
+        part = parser.close()
+        self.__part_body = bytearray()
+        self.__state = 'skip'
+
+        payload = part.get_payload(decode=True)
+        if not payload:
+            return
+        charset = part.get_content_charset() or 'utf-8'
+        try:
+            self.body = payload.decode(charset, errors='replace')
+        except LookupError:
+            self.body = payload.decode('utf-8', errors='replace')
+        self.content_subtype = part.get_content_subtype()
+        self.done = True
@@ -0,0 +1,109 @@
+from os import path, replace
+from configparser import ConfigParser
+from json import load, dump
+from threading import Lock
+from time import time
+from typing import Optional
+from loguru import logger
+
+# Persists the per-mailbox IMAP sync state (UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ when CONDSTORE is available)
+# so that every poll only has to look at mail that arrived after the previous one.
+class SyncState:
+    def __init__(self, config: ConfigParser):
+        state_file = config.get("IMAP", "sync_state_file", fallback="sync_state.json")
+        if not state_file:
+            raise ValueError("Sync state file path is not specified in the configuration.")
+
+        self.state_file_path = path.join(
+            self.__get_current_base_dir(),
+            state_file
+        )
+        self.lock = Lock()
+        state = self.__load()
+        self.mailboxes: dict = state.get('mailboxes', {})
+        self.mailbox_list: dict = state.get('mailbox_list', {})
+
+    def __get_current_base_dir(self) -> str:
+        """Get the current base directory of the script."""
+        return path.dirname(path.abspath(__file__))
+
+    def __load(self) -> dict:
+        """Load the persisted state, starting over if the file is missing or unreadable."""
+        if not path.exists(self.state_file_path):
+            return {}
+        try:
+            with open(self.state_file_path, 'r') as file:
+                state = load(file)
+            if not isinstance(state, dict):
+                return {}
+            # Older state files only held the per-mailbox entries
+            if 'mailboxes' not in state:
+                return {'mailboxes': state}
+            return state
+        except Exception as e:
+            logger.warning(f"Failed to read sync state, falling back to a full resync: {e}")
+            return {}
+
+    def __persist(self) -> None:
+        """Write the state to a temporary file and atomically replace the old one."""
+        temp_path = f"{self.state_file_path}.tmp"
+        with open(temp_path, 'w') as file:
+            dump({'mailboxes': self.mailboxes, 'mailbox_list': self.mailbox_list}, file, indent=2, sort_keys=True)
+        replace(temp_path, self.state_file_path)
+
+    def get(self, mailbox: str) -> Optional[dict]:
+        with self.lock:
+            state = self.mailboxes.get(mailbox)
+            return dict(state) if state else None
+
+    def update(self, mailbox: str, uidvalidity: Optional[int], uidnext: Optional[int], highestmodseq: Optional[int] = None) -> None:
+        with self.lock:
+            self.mailboxes[mailbox] = {
+                'uidvalidity': uidvalidity,
+                'uidnext': uidnext,
+                'highestmodseq': highestmodseq
+            }
+            try:
+                self.__persist()
+            except Exception as e:
+                logger.warning(f"Failed to persist sync state for {mailbox}: {e}")
+
+    def reset(self, mailbox: str) -> None:
+        with self.lock:
+            if self.mailboxes.pop(mailbox, None) is not None:
+                self.__persist()
+
+    def get_mailbox_list(self, max_age_seconds: int) -> Optional[list]:
+        with self.lock:
+            names = self.mailbox_list.get('names')
+            listed_at = self.mailbox_list.get('listed_at', 0)
+            if names is None or time() - listed_at > max_age_seconds:
+                return None
+            return list(names)
+
+    def set_mailbox_list(self, names: list) -> None:
+        with self.lock:
+            self.mailbox_list = {'names': list(names), 'listed_at': time()}
+            try:
+                self.__persist()
+            except Exception as e:
+                logger.warning(f"Failed to persist mailbox list: {e}")
+
+
+# Returns the UID SEARCH criteria for the selected mailbox and the lowest UID that counts as new,
+# or (None, None) when UIDNEXT has not moved since the last committed sync.
+def incremental_search_criteria(mailbox_name: str, stored: Optional[dict], current: dict) -> tuple:
+    if not stored or not stored.get('uidnext') or current.get('uidvalidity') is None \
+            or stored.get('uidvalidity') != current.get('uidvalidity'):
+        if stored:
+            logger.info(f"UIDVALIDITY changed for {mailbox_name}. Falling back to a full resync.")
+        return ('UNSEEN',), None
+
+    last_uidnext = stored['uidnext']
+    if current.get('uidnext') == last_uidnext:
+        return None, None
+
+    criteria = ('UID', f"{last_uidnext}:*", 'UNSEEN')
+    if stored.get('highestmodseq') and current.get('highestmodseq'):
+        criteria += ('MODSEQ', str(stored['highestmodseq'] + 1))
+    return criteria, last_uidnext
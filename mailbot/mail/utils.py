@@ -1,79 +1,55 @@
-from email import message_from_string
-from email.message import Message
-import html2text
-
-from email import message_from_string
-from email.message import Message
-import html2text
-
-# Written by LLM (se with caution)
-def extract_best_body(raw_email: str) -> str:
-    try:
-        if raw_email.lstrip().lower().startswith('<!doctype') or raw_email.lstrip().lower().startswith('<html'):
-            h = html2text.HTML2Text()
-            h.ignore_links = False
-            h.ignore_images = True
-            h.bypass_tables = False
-            h.body_width = 0
-            return h.handle(raw_email).strip()
-
-        msg: Message = message_from_string(raw_email)
-
-        if msg.is_multipart():
-            plain = html = None
-
-            for part in msg.walk():
-                if part.get_content_disposition() == 'attachment':
-                    continue
-
-                ctype = part.get_content_type()
-                charset = part.get_content_charset() or 'utf-8'
-                payload = part.get_payload(decode=True)
-                if not payload:
-                    continue
-
-                try:
-                    content = payload.decode(charset, errors='replace')
-                except Exception:
-                    content = payload.decode('utf-8', errors='replace')
-
-                if ctype == 'text/plain' and not plain:
-                    plain = content
-                elif ctype == 'text/html' and not html:
-                    html = content
-
-            if plain:
-                return plain.strip()
-            elif html:
-                h = html2text.HTML2Text()
-                h.ignore_links = False
-                h.ignore_images = True
-                h.bypass_tables = False
-                h.body_width = 0
-                return h.handle(html).strip()
+from base64 import b64decode
+from binascii import Error as BinasciiError
+from itertools import islice
+from quopri import decodestring
+from re import compile as re_compile
+from typing import Iterable
+
+WHITESPACE_PATTERN = re_compile(rb'\s+')
+TRUNCATED_QP_PATTERN = re_compile(rb'=[0-9A-Fa-f]?$')
+
+# Collapses a list of UIDs into an IMAP sequence set, e.g. [1, 2, 3, 50, 77] -> "1:3,50,77"
+def to_sequence_set(uids: Iterable) -> str:
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+    start = previous = None
+    for number in numbers:
+        if start is None:
+            start = previous = number
+        elif number == previous + 1:
+            previous = number
         else:
-            ctype = msg.get_content_type()
-            payload = msg.get_payload(decode=True)
-            if not payload:
-                return raw_email.strip()
-
-            charset = msg.get_content_charset() or 'utf-8'
-            try:
-                content = payload.decode(charset, errors='replace')
-            except Exception:
-                content = payload.decode('utf-8', errors='replace')
-
-            if ctype == 'text/plain':
-                return content.strip()
-            elif ctype == 'text/html':
-                h = html2text.HTML2Text()
-                h.ignore_links = False
-                h.ignore_images = True
-                h.bypass_tables = False
-                h.body_width = 0
-                return h.handle(content).strip()
-    except Exception:
+            ranges.append(f"{start}:{previous}" if start != previous else f"{start}")
+            start = previous = number
+    if start is not None:
+        ranges.append(f"{start}:{previous}" if start != previous else f"{start}")
+    return ",".join(ranges)
+
+# Splits any iterable into lists of at most chunk_size items, consuming it lazily
+def chunked(items: Iterable, chunk_size: int) -> Iterable[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, max(1, chunk_size)))
+        if not chunk:
+            return
+        yield chunk
+
+# Decodes the first bytes of a MIME part fetched with a partial BODY[section]<0.N> request.
+# The cut can land inside a base64 quantum, a quoted-printable escape or a multi-byte character,
+# so each of those is trimmed instead of failing.
+def decode_partial_text(payload: bytes, encoding: str, charset: str) -> str:
+    encoding = (encoding or '7bit').lower()
+    try:
+        if encoding == 'base64':
+            compact = WHITESPACE_PATTERN.sub(b'', payload)
+            payload = b64decode(compact[:len(compact) - len(compact) % 4])
+        elif encoding == 'quoted-printable':
+            payload = decodestring(TRUNCATED_QP_PATTERN.sub(b'', payload))
+    except (BinasciiError, ValueError):
         pass
 
-    # Fallback: return raw if all else fails
-    return raw_email.strip()
+    try:
+        text = payload.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        text = payload.decode('utf-8', errors='replace')
+    return text.rstrip('\ufffd')
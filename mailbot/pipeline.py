@@ -0,0 +1,171 @@
+from configparser import ConfigParser
+from dataclasses import dataclass
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+from typing import Callable, Iterable, Iterator
+from loguru import logger
+
+# Tells a worker to finish; every worker of a stage gets its own
+STOP = object()
+
+
+# Worker counts and queue bounds of the mailbox pipeline. The LLM stage runs as many requests at once as
+# the Ollama server does (OLLAMA_NUM_PARALLEL, mirrored by [OLLAMA] pool_size); more would only queue in
+# the connection pool.
+@dataclass(frozen=True)
+class PipelineSettings:
+    lookup_workers: int = 2
+    llm_workers: int = 4
+    # Emails sent to the LLM in one prompt (see BatchImportanceEvaluator); 1 keeps one prompt per email
+    llm_batch_size: int = 1
+    llm_batch_linger_seconds: float = 0.2
+    queue_size: int = 64
+    body_batch_size: int = 50
+    move_batch_size: int = 50
+    move_linger_seconds: float = 0.5
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> "PipelineSettings":
+        llm_workers = config.get("PIPELINE", "llm_workers", fallback="").strip()
+        return cls(
+            lookup_workers=config.getint("PIPELINE", "lookup_workers", fallback=2),
+            llm_workers=int(llm_workers) if llm_workers else config.getint("OLLAMA", "pool_size", fallback=4),
+            llm_batch_size=config.getint("PIPELINE", "llm_batch_size", fallback=1),
+            llm_batch_linger_seconds=config.getfloat("PIPELINE", "llm_batch_linger_seconds", fallback=0.2),
+            queue_size=config.getint("PIPELINE", "queue_size", fallback=64),
+            body_batch_size=config.getint("IMAP", "fetch_chunk_size", fallback=50),
+            move_batch_size=config.getint("PIPELINE", "move_batch_size", fallback=50),
+            move_linger_seconds=config.getfloat("PIPELINE", "move_linger_seconds", fallback=0.5),
+        )
+
+
+def serialized(items: Iterator, lock: Lock) -> Iterator:
+    """Iterate a generator that talks to a shared connection, holding the lock only while it produces the
+    next item, so other stages can use the connection between items."""
+    iterator = iter(items)
+    while True:
+        with lock:
+            item = next(iterator, STOP)
+        if item is STOP:
+            return
+        yield item
+
+
+class Stage:
+    def __init__(self, name: str, handler: Callable, workers: int, queue_size: int, batch_size: int, linger: float):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.threads: list = []
+        self.lock = Lock()
+        self.items = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+
+    def stats(self, elapsed: float) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'items': self.items,
+                'failures': self.failures,
+                'busy_seconds': self.busy_seconds,
+                # Share of the stage's worker time spent in its handler, including waits on a full next queue
+                'utilization': self.busy_seconds / (elapsed * self.workers) if elapsed else 0.0,
+            }
+
+
+# Stages connected by bounded queues, each with its own worker threads. A handler hands its results to
+# any later stage with put(), which blocks while that stage's queue is full, so a slow stage holds back
+# the ones feeding it instead of letting work pile up in memory. With batch_size > 1 a handler receives
+# a list: whatever is queued, up to batch_size items, waiting at most `linger` seconds for more.
+# Stages only feed stages added after them, so close() can stop them in order: once a stage's workers
+# have finished, nothing can reach the stages after it but what is already queued.
+class Pipeline:
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: dict = {}
+        self.started = None
+
+    def add_stage(self, name: str, handler: Callable, workers: int = 1, queue_size: int = 64,
+                  batch_size: int = 1, linger: float = 0.0) -> None:
+        self.stages[name] = Stage(name, handler, workers, queue_size, batch_size, linger)
+
+    def start(self) -> None:
+        self.started = perf_counter()
+        for stage in self.stages.values():
+            stage.threads = [
+                Thread(target=self.__work, args=(stage,), name=f"{self.name}-{stage.name}-{index}", daemon=True)
+                for index in range(stage.workers)
+            ]
+            for thread in stage.threads:
+                thread.start()
+
+    def put(self, stage: str, item) -> None:
+        self.stages[stage].queue.put(item)
+
+    def put_all(self, stage: str, items: Iterable) -> None:
+        for item in items:
+            self.put(stage, item)
+
+    def __next_batch(self, stage: Stage, first) -> tuple:
+        """Returns (batch, stop) with the items queued behind `first`."""
+        batch = [first]
+        deadline = monotonic() + stage.linger
+        while len(batch) < stage.batch_size:
+            try:
+                item = stage.queue.get(timeout=max(0.0, deadline - monotonic()))
+            except Empty:
+                break
+            if item is STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def __work(self, stage: Stage) -> None:
+        while True:
+            item = stage.queue.get()
+            if item is STOP:
+                return
+            stop = False
+            if stage.batch_size > 1:
+                item, stop = self.__next_batch(stage, item)
+            started = perf_counter()
+            failed = False
+            try:
+                stage.handler(item)
+            except Exception as e:
+                failed = True
+                logger.exception(f"{self.name}: {stage.name} stage failed: {e}")
+            with stage.lock:
+                stage.items += len(item) if stage.batch_size > 1 else 1
+                stage.failures += failed
+                stage.busy_seconds += perf_counter() - started
+            if stop:
+                return
+
+    def close(self) -> dict:
+        """Let every stage finish what is queued, stop the workers and return the stats of each stage."""
+        for stage in self.stages.values():
+            for _ in stage.threads:
+                stage.queue.put(STOP)
+            for thread in stage.threads:
+                thread.join()
+        return self.stats()
+
+    def stats(self) -> dict:
+        elapsed = perf_counter() - self.started if self.started else 0.0
+        return {name: stage.stats(elapsed) for name, stage in self.stages.items()}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        stats = self.close()
+        logger.debug(f"{self.name}: " + ", ".join(
+            f"{name} {stage['items']} items {stage['utilization']:.0%} busy" for name, stage in stats.items()
+        ))
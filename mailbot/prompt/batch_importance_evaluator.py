@@ -0,0 +1,97 @@
+from typing import Iterable, Iterator
+from mail.emailwrapper import EmailWrapper
+from prompt.importance_evaluator import SCORING_RULES
+from prompt.prompt import Prompt, estimate_tokens, extract_json_objects
+from loguru import logger
+
+# Tokens the answer needs per email: one {"id", "importance", "confidence", "reasoning"} object
+ANSWER_TOKENS_PER_EMAIL = 64
+
+
+# Scores several emails with one prompt, so the instructions and examples are evaluated once per batch
+# instead of once per email. Every email gets a short ID and the answer is a JSON array of verdicts keyed
+# by it. extract_response returns the verdicts it could read by ID; emails missing from it (dropped,
+# cut off, malformed) are left for the caller to classify one at a time.
+# There is no stop marker: "]" may appear inside a reasoning string, so the answer is bounded by
+# max_tokens and whatever follows the array is ignored by extract_json_objects.
+class BatchImportanceEvaluator(Prompt):
+    body_chars = 500
+
+    def __init__(self, emails: list):
+        self.emails = {str(index): email for index, email in enumerate(emails, start=1)}
+        self.max_tokens = ANSWER_TOKENS_PER_EMAIL * len(emails) + 16
+
+    @classmethod
+    def _format_email(cls, email_id: str, email: EmailWrapper) -> str:
+        return f"ID: {email_id}\nFrom: {email.sender}\nSubject: {email.subject}\nBody: {(email.body or '')[:cls.body_chars]}...\n\n"
+
+    @classmethod
+    def pack(cls, emails: Iterable[EmailWrapper], num_ctx: int, max_batch: int) -> Iterator[list]:
+        """
+        Splits emails into batches of at most max_batch whose prompt and answer fit in num_ctx tokens.
+        An email too large to share the window still gets a batch of its own.
+        """
+        budget = num_ctx - estimate_tokens(cls([]).get_prompt())
+        batch, used = [], 0
+        for email in emails:
+            cost = estimate_tokens(cls._format_email(str(len(batch) + 1), email)) + ANSWER_TOKENS_PER_EMAIL
+            if batch and (len(batch) >= max_batch or used + cost > budget):
+                yield batch
+                batch, used = [], 0
+            batch.append(email)
+            used += cost
+        if batch:
+            yield batch
+
+    def _get_instruction(self) -> str:
+        return (
+            "Respond ONLY with a JSON array. No extra text.\n\n"
+            "Task: Assign an importance score (0.0-1.0) to each email below for an individual. If an email is a scam or phishing attempt, set its importance to -1. "
+            "Judge every email on its own.\n\n"
+            f"{SCORING_RULES}"
+            "Format: one object per email, in the order given, with the email's ID:\n"
+            "[\n  {\"id\": \"1\", \"importance\": 0.XX, \"confidence\": 0.XX, \"reasoning\": \"Brief explanation\"}\n]\n\n"
+            "Return ONLY this JSON array."
+        )
+
+    def _get_few_shot_example(self) -> str:
+        return (
+            "Example for three emails (a promotion, a security alert and a phishing attempt):\n"
+            "[{\"id\": \"1\", \"importance\": 0.1, \"confidence\": 0.95, \"reasoning\": \"Promotional email with discount offers\"}, "
+            "{\"id\": \"2\", \"importance\": 0.95, \"confidence\": 0.98, \"reasoning\": \"Account security alert\"}, "
+            "{\"id\": \"3\", \"importance\": -1, \"confidence\": 0.99, \"reasoning\": \"Likely scam or phishing attempt\"}]"
+        )
+
+    def _get_response_format(self) -> str:
+        return (
+            f"Return ONLY a JSON array with exactly {len(self.emails)} objects, one per ID:\n"
+            "[{\"id\": \"[ID]\", \"importance\": [0.0-1.0 or -1 for scam], \"confidence\": [0.0-1.0], \"reasoning\": \"[one sentence]\"}]"
+        )
+
+    def get_user_prompt(self) -> str:
+        emails = "".join(self._format_email(email_id, email) for email_id, email in self.emails.items())
+        return (
+            f"EMAILS TO EVALUATE:\n{emails}"
+            f"{self._get_response_format()}\n"
+        )
+
+    def extract_response(self, response: str) -> dict:
+        verdicts = {}
+        for obj in extract_json_objects(response):
+            email_id = str(obj.get("id", "")).strip()
+            if email_id not in self.emails or email_id in verdicts:
+                continue
+            if not isinstance(obj.get("importance"), (int, float)) or not isinstance(obj.get("confidence"), (int, float)):
+                continue
+            verdicts[email_id] = {
+                "importance": obj["importance"],
+                "confidence": obj["confidence"],
+                "reasoning": obj.get("reasoning", "Missing reasoning."),
+            }
+        if len(verdicts) < len(self.emails):
+            logger.info(f"Batched answer covered {len(verdicts)} of {len(self.emails)} emails")
+        return verdicts
+
+    def unanswered(self, verdicts: dict) -> list:
+        """The emails extract_response found no verdict for."""
+        return [email for email_id, email in self.emails.items() if email_id not in verdicts]
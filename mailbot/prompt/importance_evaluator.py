@@ -1,11 +1,36 @@
 from mail.emailwrapper import EmailWrapper
-from prompt.prompt import Prompt
-from re import findall, DOTALL
-from json import loads
+from prompt.prompt import Prompt, extract_json_answer
 from loguru import logger
 
+# Shared with BatchImportanceEvaluator so a batch is scored by the same rules as a single email
+SCORING_RULES = (
+    "Scoring:\n"
+    "- HIGH (0.8-1.0): Security alerts, account notifications, direct human communication, medical/legal info, calendar invites\n"
+    "- MEDIUM (0.4-0.79): Order confirmations, shipping updates, expiring EXISTING paid services/memberships, appointment reminders\n"
+    "- LOW (0.0-0.39): Marketing, promotions, newsletters, deals, offers, advertisements, bulk emails\n"
+    "- SCAM/PHISHING (-1): Any email that is a scam, phishing, or malicious attempt.\n\n"
+    "Scam/Phishing Detection:\n"
+    "- If the sender address and the content (e.g., signature, reply-to, URLs) do not match or look suspicious, mark as SCAM (-1).\n"
+    "- If sender claims to be a known company but uses a generic or mismatched email domain, mark as SCAM.\n"
+    "- If the email requests sensitive info, login, payment, or urgent action with suspicious links, mark as SCAM.\n"
+    "- If sender is unknown and content is generic, threatening, or too good to be true, mark as SCAM.\n"
+    "- If sender and content mismatch in any way typical of phishing, mark as SCAM.\n\n"
+    "Rules:\n"
+    "- Promotional keywords (deals, discount, offer, sale, limited time, promo code, bonus points, low stock, savings, % off) = LOW\n"
+    "- Expiring EXISTING paid service = MEDIUM\n"
+    "- Promotional offers to join/buy NEW service = LOW\n"
+    "- If selling or promoting anything = LOW, even if personalized\n"
+    "- Marketing disguised as urgent = LOW\n"
+    "- Food/newsletters/events/rewards/loyalty/community = LOW\n"
+    "- If the email is a scam, phishing, or malicious, set importance to -1 and reasoning to 'Likely scam or phishing'.\n\n"
+)
+
 # This prompt is custom-built and maynot be suitable for all use cases.
 class ImportanceEvaulator(Prompt):
+    # The answer is one small JSON object; generation ends with it (the "}" itself is not returned)
+    max_tokens = 80
+    stop_sequences = ("}",)
+
     def __init__(self, email: EmailWrapper):
         self.email_from = email.sender
         self.email_subject = email.subject
@@ -15,25 +40,7 @@ class ImportanceEvaulator(Prompt):
         return (
             "Respond ONLY with the following JSON format. No extra text.\n\n"
             "Task: Assign an importance score (0.0-1.0) to this email for an individual. If the email is a scam or phishing attempt, set importance to -1.\n\n"
-            "Scoring:\n"
-            "- HIGH (0.8-1.0): Security alerts, account notifications, direct human communication, medical/legal info, calendar invites\n"
-            "- MEDIUM (0.4-0.79): Order confirmations, shipping updates, expiring EXISTING paid services/memberships, appointment reminders\n"
-            "- LOW (0.0-0.39): Marketing, promotions, newsletters, deals, offers, advertisements, bulk emails\n"
-            "- SCAM/PHISHING (-1): Any email that is a scam, phishing, or malicious attempt.\n\n"
-            "Scam/Phishing Detection:\n"
-            "- If the sender address and the content (e.g., signature, reply-to, URLs) do not match or look suspicious, mark as SCAM (-1).\n"
-            "- If sender claims to be a known company but uses a generic or mismatched email domain, mark as SCAM.\n"
-            "- If the email requests sensitive info, login, payment, or urgent action with suspicious links, mark as SCAM.\n"
-            "- If sender is unknown and content is generic, threatening, or too good to be true, mark as SCAM.\n"
-            "- If sender and content mismatch in any way typical of phishing, mark as SCAM.\n\n"
-            "Rules:\n"
-            "- Promotional keywords (deals, discount, offer, sale, limited time, promo code, bonus points, low stock, savings, % off) = LOW\n"
-            "- Expiring EXISTING paid service = MEDIUM\n"
-            "- Promotional offers to join/buy NEW service = LOW\n"
-            "- If selling or promoting anything = LOW, even if personalized\n"
-            "- Marketing disguised as urgent = LOW\n"
-            "- Food/newsletters/events/rewards/loyalty/community = LOW\n"
-            "- If the email is a scam, phishing, or malicious, set importance to -1 and reasoning to 'Likely scam or phishing'.\n\n"
+            f"{SCORING_RULES}"
             "Format:\n"
             "{\n  \"importance\": 0.XX,\n  \"confidence\": 0.XX,\n  \"reasoning\": \"Brief explanation\"\n}\n\n"
             "Return ONLY this JSON."
@@ -56,26 +63,17 @@ class ImportanceEvaulator(Prompt):
             "{\"importance\": [0.0-1.0 or -1 for scam], \"confidence\": [0.0-1.0], \"reasoning\": \"[one sentence]\"}"
         )
 
-    def get_prompt(self) -> str:
+    def get_user_prompt(self) -> str:
         return (
-            f"{self._get_instruction()}\n\n"
-            f"{self._get_few_shot_example()}\n\n"
             f"EMAIL TO EVALUATE:\nFrom: {self.email_from}\nSubject: {self.email_subject}\nBody: {self.email_body[:500]}...\n\n"
             f"{self._get_response_format()}\n"
         )
     
     def __create_object(self, response: str) -> dict:
         try:
-            match = findall(r"<answer>\s*({.*?})\s*</answer>", response, flags=DOTALL)
-
-            if not match:
-                match = findall(r"```(?:json)?\s*({.*?})\s*```", response, flags=DOTALL)
-            if not match:
-                match = findall(r"{\s*\"importance\".*?}", response, flags=DOTALL)
-            if not match:
+            obj = extract_json_answer(response)
+            if not obj or "importance" not in obj:
                 raise ValueError("No valid JSON found in response.")
-            extracted_answer = match[0].strip()
-            obj = loads(extracted_answer)
             return {
                 "importance": obj.get("importance", 0.0),
                 "confidence": obj.get("confidence", 0.0),
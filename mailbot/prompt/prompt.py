@@ -1,9 +1,80 @@
 import abc
+from json import JSONDecodeError, JSONDecoder
+from re import DOTALL, compile as compile_regex
+from typing import Optional
+
+THINKING = compile_regex(r"<think>.*?</think>", flags=DOTALL)
+FIELD = compile_regex(r'"(\w+)"\s*:\s*(-?\d+(?:\.\d+)?|"(?:[^"\\]|\\.)*)')
+
+
+def extract_json_answer(response: str) -> Optional[dict]:
+    """
+    Finds the JSON object of an answer, tolerating how a bounded generation ends: the stop marker
+    (e.g. "}" or "</answer>") is not part of the output, and num_predict can cut it mid-string.
+    Fields that can still be read are returned even if the object as a whole cannot be parsed.
+    """
+    text = THINKING.sub("", response)
+    if "<answer>" in text:
+        text = text.split("<answer>", 1)[1]
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    decoder = JSONDecoder()
+    for ending in ("", "}", "\"}"):
+        try:
+            obj, _ = decoder.raw_decode(text.rstrip().rstrip("`").rstrip() + ending)
+            if isinstance(obj, dict):
+                return obj
+        except JSONDecodeError:
+            continue
+    fields = {}
+    for key, value in FIELD.findall(text):
+        if value.startswith('"'):
+            fields[key] = value[1:].replace('\\"', '"')
+        else:
+            fields[key] = float(value) if "." in value else int(value)
+    return fields or None
+
+
+def extract_json_objects(response: str) -> list:
+    """
+    Every flat JSON object found in the answer, in order, e.g. the elements of an array of verdicts. A
+    malformed object, or the last one cut off by the stop marker or num_predict, is read up to the next
+    "{" as far as extract_json_answer can read it.
+    """
+    text = THINKING.sub("", response)
+    if "<answer>" in text:
+        text = text.split("<answer>", 1)[1]
+    decoder = JSONDecoder()
+    objects = []
+    start = text.find("{")
+    while start >= 0:
+        try:
+            obj, end = decoder.raw_decode(text, start)
+        except JSONDecodeError:
+            end = text.find("{", start + 1)
+            end = len(text) if end < 0 else end
+            obj = extract_json_answer(text[start:end].rstrip().rstrip(",]").rstrip())
+        if isinstance(obj, dict) and obj:
+            objects.append(obj)
+        start = text.find("{", end)
+    return objects
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting the context window; about 3 characters a token errs on the large side."""
+    return len(text) // 3 + 1
+
 
 class Prompt(abc.ABC):
     """
     Abstract base class for prompts
     """
+    # Generation budget of the answer: at most max_tokens tokens (None for the LLM's default), and
+    # generation stops at any of stop_sequences
+    max_tokens: Optional[int] = None
+    stop_sequences: tuple = ()
     @abc.abstractmethod
     def _get_instruction(self) -> str:
         """
@@ -25,12 +96,25 @@ class Prompt(abc.ABC):
         """
         pass
 
+    def get_system_prompt(self) -> str:
+        """
+        Returns the static part of the prompt: the instruction and the few shot examples. It is the same
+        for every email, so it can be sent as the system prompt and its KV cache reused across calls.
+        """
+        return f"{self._get_instruction()}\n\n{self._get_few_shot_example()}"
+
     @abc.abstractmethod
+    def get_user_prompt(self) -> str:
+        """
+        Returns the part of the prompt that changes with every email, including the response format.
+        """
+        pass
+
     def get_prompt(self) -> str:
         """
         Returns the complete prompt string.
         """
-        pass
+        return f"{self.get_system_prompt()}\n\n{self.get_user_prompt()}"
 
     @abc.abstractmethod
     def extract_response(self, response: str) -> dict:
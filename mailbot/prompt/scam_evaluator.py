@@ -1,10 +1,11 @@
 from mail.emailwrapper import EmailWrapper
-from prompt.prompt import Prompt
-from re import findall, DOTALL
-from json import loads
+from prompt.prompt import Prompt, extract_json_answer
 from loguru import logger
 
 class ScamEvaluator(Prompt):
+    max_tokens = 120
+    stop_sequences = ("</answer>",)
+
     def __init__(self, email: EmailWrapper):
         self.email_from = email.sender
         self.email_subject = email.subject
@@ -91,10 +92,8 @@ class ScamEvaluator(Prompt):
             "- No markdown, no explanation, just JSON"
         )
 
-    def get_prompt(self) -> str:
+    def get_user_prompt(self) -> str:
         return (
-            f"{self._get_instruction()}\n\n"
-            f"{self._get_few_shot_example()}\n\n"
             f"EMAIL TO ANALYZE:\n"
             f"From: {self.email_from}\n"
             f"Subject: {self.email_subject}\n"
@@ -104,11 +103,9 @@ class ScamEvaluator(Prompt):
     
     def __create_object(self, response: str) -> dict:
         try:
-            match = findall(r"<answer>\s*(\{.*?\})\s*</answer>", response, flags=DOTALL)
-            if not match:
+            obj = extract_json_answer(response)
+            if not obj or "scam" not in obj:
                 raise ValueError("No valid JSON found in response.")
-            extracted_answer = match[0].strip()
-            obj = loads(extracted_answer)
             return {
                 "scam": obj.get("scam", 0),
                 "confidence": obj.get("confidence", 0.0),
@@ -0,0 +1,184 @@
+from os import path, replace
+from configparser import ConfigParser
+from re import compile as compile_regex
+from threading import Lock
+from time import perf_counter
+from typing import Iterable, Optional
+from zlib import crc32
+import numpy as np
+from loguru import logger
+from mail.emailwrapper import EmailWrapper
+from cache.backends import read_csv_rows
+from cache.cache import ImportanceLevel
+from cache.reputation import normalize_address, registrable_domain
+
+LEVELS = [level.value for level in ImportanceLevel]
+WORDS = compile_regex(r"\w+")
+NUMBERS = compile_regex(r"\d+")
+
+
+def features(sender: str, subject: str, bits: int) -> np.ndarray:
+    """Hashed feature indices of an email: its sender address, domain and mailbox name, and the words
+    and word pairs of its subject. The cache only keeps sender and subject, so that is what it learns from."""
+    address = normalize_address(sender)
+    words = WORDS.findall(NUMBERS.sub("0", (subject or "").lower()))
+    tokens = [f"a:{address}", f"d:{registrable_domain(address)}", f"l:{address.partition('@')[0]}"]
+    tokens += [f"w:{word}" for word in words] + [f"p:{first} {second}" for first, second in zip(words, words[1:])]
+    mask = (1 << bits) - 1
+    # crc32 rather than hash(), which changes between processes and would break a saved model
+    return np.fromiter((crc32(token.encode('utf-8')) & mask for token in tokens), dtype=np.int64, count=len(tokens))
+
+
+# Multinomial naive Bayes over hashed sender and subject features, trained from the verdicts in the cache
+# and updated with every new LLM verdict. Emails it is confident about (posterior >= min_confidence) are
+# classified without the LLM; everything else is escalated.
+# It only takes over once it has seen min_examples verdicts and has proven itself: every verdict is
+# first predicted and then learned, and the predictions it would have been confident about must have
+# matched the LLM in at least min_precision of min_checked cases.
+class PreClassifier:
+    def __init__(self, config: ConfigParser, training_csv: Optional[str] = None):
+        triage_file = config.get("TRIAGE", "triage_file", fallback="triage_model.npz")
+        self.triage_file_path = path.join(path.dirname(path.abspath(__file__)), triage_file)
+        self.feature_bits = config.getint("TRIAGE", "feature_bits", fallback=18)
+        self.min_confidence = config.getfloat("TRIAGE", "min_confidence", fallback=0.95)
+        self.min_examples = config.getint("TRIAGE", "min_examples", fallback=500)
+        self.min_checked = config.getint("TRIAGE", "min_checked", fallback=50)
+        self.min_precision = config.getfloat("TRIAGE", "min_precision", fallback=0.95)
+        self.smoothing = config.getfloat("TRIAGE", "smoothing", fallback=0.1)
+
+        self.lock = Lock()
+        self.predictions = 0
+        self.escalations = 0
+        self.predict_seconds = 0.0
+        self.dirty = False
+
+        self.feature_counts = np.zeros((len(LEVELS), 1 << self.feature_bits), dtype=np.float64)
+        self.class_counts = np.zeros(len(LEVELS), dtype=np.float64)
+        # Predictions made before learning a verdict that were confident, and how many of those were right
+        self.checked = 0
+        self.correct = 0
+        if not self.__load() and training_csv and path.exists(training_csv):
+            self.train(read_csv_rows(training_csv))
+            logger.info(f"Pre-classifier trained on {int(self.class_counts.sum())} cached verdicts from {training_csv}")
+        self.__update_model()
+
+    def __load(self) -> bool:
+        if not path.exists(self.triage_file_path):
+            return False
+        with np.load(self.triage_file_path) as model:
+            if model['feature_counts'].shape != self.feature_counts.shape:
+                logger.warning(f"Pre-classifier model {self.triage_file_path} uses other feature_bits; retraining")
+                return False
+            self.feature_counts = model['feature_counts']
+            self.class_counts = model['class_counts']
+            self.checked, self.correct = (int(value) for value in model['checks'])
+        return True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            temporary_path = self.triage_file_path + '.tmp.npz'
+            np.savez(temporary_path, feature_counts=self.feature_counts, class_counts=self.class_counts,
+                     checks=np.array([self.checked, self.correct]))
+            replace(temporary_path, self.triage_file_path)
+            self.dirty = False
+
+    def __update_model(self) -> None:
+        """Recompute the log probabilities from the counts; called with the lock held or before sharing."""
+        smoothed = self.feature_counts + self.smoothing
+        self.log_likelihood = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+        self.log_prior = np.log(self.class_counts + 1.0) - np.log(self.class_counts.sum() + len(LEVELS))
+
+    def __posteriors(self, feature_lists: list) -> np.ndarray:
+        """Class posteriors, one row per email, with one gather and one segmented sum for all emails."""
+        lengths = np.array([len(indices) for indices in feature_lists])
+        scores = np.add.reduceat(self.log_likelihood[:, np.concatenate(feature_lists)], np.cumsum(lengths) - lengths, axis=1).T
+        scores += self.log_prior
+        scores -= scores.max(axis=1, keepdims=True)
+        posteriors = np.exp(scores)
+        return posteriors / posteriors.sum(axis=1, keepdims=True)
+
+    def __check_and_learn(self, feature_lists: list, labels: np.ndarray) -> None:
+        """Score the examples with the current model, then add them to it."""
+        if self.class_counts.sum() >= self.min_examples:
+            posteriors = self.__posteriors(feature_lists)
+            confident = posteriors.max(axis=1) >= self.min_confidence
+            self.checked += int(confident.sum())
+            self.correct += int((posteriors.argmax(axis=1)[confident] == labels[confident]).sum())
+        rows = np.repeat(labels, [len(indices) for indices in feature_lists])
+        self.feature_counts += np.bincount(
+            rows * self.feature_counts.shape[1] + np.concatenate(feature_lists), minlength=self.feature_counts.size
+        ).reshape(self.feature_counts.shape)
+        self.class_counts += np.bincount(labels, minlength=len(LEVELS))
+        self.__update_model()
+        self.dirty = True
+
+    def train(self, rows: Iterable[dict], batch_size: int = 100) -> None:
+        """Learn from cache rows (sender, email_subject, importance_level), a batch at a time. Each batch
+        is checked against the model learned from the batches before it."""
+        batch = []
+        for row in rows:
+            if row.get('importance_level') in LEVELS:
+                batch.append(row)
+            if len(batch) >= batch_size:
+                self.__train_batch(batch)
+                batch = []
+        if batch:
+            self.__train_batch(batch)
+
+    def __train_batch(self, rows: list) -> None:
+        feature_lists = [features(row['sender'], row['email_subject'], self.feature_bits) for row in rows]
+        labels = np.array([LEVELS.index(row['importance_level']) for row in rows])
+        with self.lock:
+            self.__check_and_learn(feature_lists, labels)
+
+    def learn(self, email: EmailWrapper, importance_level: ImportanceLevel) -> None:
+        """Learn a verdict of the LLM."""
+        with self.lock:
+            self.__check_and_learn([features(email.sender, email.subject, self.feature_bits)], np.array([LEVELS.index(importance_level.value)]))
+
+    @property
+    def active(self) -> bool:
+        return (
+            self.class_counts.sum() >= self.min_examples
+            and self.checked >= self.min_checked
+            and self.correct >= self.min_precision * self.checked
+        )
+
+    def predict(self, email: EmailWrapper) -> Optional[tuple]:
+        """(ImportanceLevel, confidence) when the model is confident enough to skip the LLM, else None."""
+        started = perf_counter()
+        indices = features(email.sender, email.subject, self.feature_bits)
+        with self.lock:
+            result = None
+            if self.active:
+                posteriors = self.__posteriors([indices])[0]
+                best = int(posteriors.argmax())
+                if posteriors[best] >= self.min_confidence:
+                    result = (ImportanceLevel(LEVELS[best]), float(posteriors[best]))
+            self.predictions += 1
+            self.escalations += result is None
+            self.predict_seconds += perf_counter() - started
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'active': self.active,
+                'examples': int(self.class_counts.sum()),
+                'precision': self.correct / self.checked if self.checked else 0.0,
+                'predictions': self.predictions,
+                'escalations': self.escalations,
+                'escalation_rate': self.escalations / self.predictions if self.predictions else 0.0,
+                'mean_predict_ms': self.predict_seconds / self.predictions * 1000 if self.predictions else 0.0,
+            }
+
+    def close(self) -> None:
+        stats = self.stats()
+        if stats['predictions']:
+            logger.info(
+                f"Pre-classifier escalated {stats['escalations']} of {stats['predictions']} emails to the LLM "
+                f"({stats['escalation_rate']:.1%}), {stats['mean_predict_ms']:.2f} ms per email"
+            )
+        self.save()
@@ -0,0 +1,181 @@
+from os import path
+from configparser import ConfigParser
+from enum import Enum
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from typing import Iterable, Optional
+from loguru import logger
+
+class MessageState(Enum):
+    PENDING = "pending"
+    FETCHED = "fetched"
+    CLASSIFIED = "classified"
+    MOVED = "moved"
+    FAILED = "failed"
+    QUARANTINED = "quarantined"
+    # Classified without a verdict; left in the mailbox and not retried
+    SKIPPED = "skipped"
+
+# Durable per-message work queue. Every UID returned by a mailbox search is checkpointed here, so a crash,
+# reconnect or a single broken message only costs the messages that are still unfinished.
+# Rows are keyed by (mailbox, uidvalidity, uid) since UIDs are only stable within one UIDVALIDITY.
+class WorkQueue:
+    def __init__(self, config: ConfigParser):
+        queue_file = config.get("QUEUE", "queue_file", fallback="work_queue.sqlite3")
+        if not queue_file:
+            raise ValueError("Work queue file path is not specified in the configuration.")
+
+        self.queue_file_path = path.join(
+            self.__get_current_base_dir(),
+            queue_file
+        )
+        self.max_attempts = config.getint("QUEUE", "max_attempts", fallback=5)
+        self.backoff_base_seconds = config.getfloat("QUEUE", "backoff_base_seconds", fallback=60.0)
+        self.backoff_max_seconds = config.getfloat("QUEUE", "backoff_max_seconds", fallback=6 * 3600.0)
+        self.moved_retention_seconds = config.getfloat("QUEUE", "moved_retention_hours", fallback=24.0) * 3600
+
+        # Mailboxes are processed by concurrent workers that share one queue
+        self.lock = Lock()
+        self.connection = connect(self.queue_file_path, check_same_thread=False, isolation_level=None)
+        self.__ensure_schema()
+        self.purge_moved()
+
+    def __get_current_base_dir(self) -> str:
+        """Get the current base directory of the script."""
+        return path.dirname(path.abspath(__file__))
+
+    def __ensure_schema(self) -> None:
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " mailbox TEXT NOT NULL,"
+                " uidvalidity INTEGER NOT NULL,"
+                " uid INTEGER NOT NULL,"
+                " state TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL DEFAULT 0,"
+                " importance_level TEXT,"
+                " last_error TEXT,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (mailbox, uidvalidity, uid))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_due ON messages (mailbox, state, next_attempt_at)"
+            )
+
+    def __backoff(self, attempts: int) -> float:
+        return min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** max(0, attempts - 1)))
+
+    def enqueue(self, mailbox: str, uidvalidity: int, uids: Iterable) -> None:
+        now = time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            # UIDs from another UIDVALIDITY no longer identify the same messages
+            self.connection.execute(
+                "DELETE FROM messages WHERE mailbox = ? AND uidvalidity != ?", (mailbox, uidvalidity)
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO messages (mailbox, uidvalidity, uid, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(mailbox, uidvalidity, int(uid), MessageState.PENDING.value, now) for uid in uids]
+            )
+            self.connection.execute("COMMIT")
+
+    # Returns (uids_to_fetch, [(uid, importance_level_value), ...] to move) for items whose backoff has expired.
+    # Failed items that were already classified only retry the move.
+    def due(self, mailbox: str, uidvalidity: int) -> tuple:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT uid, state, importance_level FROM messages"
+                " WHERE mailbox = ? AND uidvalidity = ? AND state IN (?, ?, ?, ?) AND next_attempt_at <= ?"
+                " ORDER BY uid",
+                (mailbox, uidvalidity, MessageState.PENDING.value, MessageState.FETCHED.value,
+                 MessageState.CLASSIFIED.value, MessageState.FAILED.value, time())
+            ).fetchall()
+        to_fetch = [str(uid) for uid, _, importance_level in rows if not importance_level]
+        to_move = [(str(uid), importance_level) for uid, _, importance_level in rows if importance_level]
+        return to_fetch, to_move
+
+    # Mailboxes with items whose backoff has expired. Such items are only picked up when their mailbox is
+    # processed, which a STATUS scan skips as long as no new mail arrives.
+    def mailboxes_with_due_work(self) -> set:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT mailbox FROM messages WHERE state IN (?, ?, ?, ?) AND next_attempt_at <= ?",
+                (MessageState.PENDING.value, MessageState.FETCHED.value, MessageState.CLASSIFIED.value,
+                 MessageState.FAILED.value, time())
+            ).fetchall()
+        return {mailbox for mailbox, in rows}
+
+    def __set_state(self, mailbox: str, uidvalidity: int, uids: Iterable, state: MessageState, importance_level: Optional[str] = None) -> None:
+        now = time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE messages SET state = ?, importance_level = COALESCE(?, importance_level), updated_at = ?"
+                " WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(state.value, importance_level, now, mailbox, uidvalidity, int(uid)) for uid in uids]
+            )
+
+    def mark_fetched(self, mailbox: str, uidvalidity: int, uids: Iterable) -> None:
+        self.__set_state(mailbox, uidvalidity, uids, MessageState.FETCHED)
+
+    def mark_classified(self, mailbox: str, uidvalidity: int, uid: str, importance_level: str) -> None:
+        self.__set_state(mailbox, uidvalidity, [uid], MessageState.CLASSIFIED, importance_level)
+
+    def mark_moved(self, mailbox: str, uidvalidity: int, uids: Iterable) -> None:
+        self.__set_state(mailbox, uidvalidity, uids, MessageState.MOVED)
+
+    # Schedules a retry with exponential backoff, or quarantines the message after max_attempts so a
+    # poison message never blocks the rest of the mailbox.
+    def mark_failed(self, mailbox: str, uidvalidity: int, uids: Iterable, error: str) -> None:
+        now = time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            for uid in uids:
+                row = self.connection.execute(
+                    "SELECT attempts FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                    (mailbox, uidvalidity, int(uid))
+                ).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0] + 1
+                if attempts >= self.max_attempts:
+                    state = MessageState.QUARANTINED
+                    logger.warning(f"Email with UID {uid} in {mailbox} quarantined after {attempts} attempts: {error}")
+                else:
+                    state = MessageState.FAILED
+                self.connection.execute(
+                    "UPDATE messages SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?"
+                    " WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                    (state.value, attempts, now + self.__backoff(attempts), error, now, mailbox, uidvalidity, int(uid))
+                )
+            self.connection.execute("COMMIT")
+
+    def mark_skipped(self, mailbox: str, uidvalidity: int, uids: Iterable, reason: str) -> None:
+        now = time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE messages SET state = ?, last_error = ?, updated_at = ?"
+                " WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(MessageState.SKIPPED.value, reason, now, mailbox, uidvalidity, int(uid)) for uid in uids]
+            )
+
+    def counts(self, mailbox: str) -> dict:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM messages WHERE mailbox = ? GROUP BY state", (mailbox,)
+            ).fetchall()
+        return dict(rows)
+
+    def purge_moved(self) -> None:
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM messages WHERE state IN (?, ?) AND updated_at < ?",
+                (MessageState.MOVED.value, MessageState.SKIPPED.value, time() - self.moved_retention_seconds)
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,6 @@
+import sys
+from os import path
+
+# The application modules import each other relative to the mailbot directory (e.g. `from mail.utils import ...`),
+# the same way they are resolved when e2e.py is run from inside mailbot/.
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "mailbot"))
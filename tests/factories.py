@@ -0,0 +1,55 @@
+from configparser import ConfigParser
+from cache.cache import Cache
+from mail.emailwrapper import EmailWrapper
+
+# Builders for the objects most tests need, so every test module creates them the same way.
+
+
+def email(sender: str, subject: str, body: str = "", uid: str = None) -> EmailWrapper:
+    return EmailWrapper(subject, body, sender, "me@example.com", "", "<id@example.com>", uid=uid)
+
+
+def raw_email(subject: str, sender: str = "sender@example.com") -> bytes:
+    return (
+        f"From: {sender}\r\nTo: me@example.com\r\nSubject: {subject}\r\n"
+        f"Message-ID: <{subject}@example.com>\r\nContent-Type: text/plain; charset=utf-8\r\n\r\nBody of {subject}\r\n"
+    ).encode("utf-8")
+
+
+def folders(messages: list) -> dict:
+    """An INBOX with the messages and the empty folders make_imap_config sorts into."""
+    return {"INBOX": messages, "Important": [], "Later": [], "Spare": [], "Junk": []}
+
+
+def make_imap_config(tmp_path, port: int, **imap) -> ConfigParser:
+    """Settings for a StandInImapServer on port."""
+    cfg = ConfigParser()
+    cfg["IMAP"] = {
+        "port": str(port),
+        "server": "127.0.0.1",
+        "username": "user@example.com",
+        "password": "password123",
+        "ssl": "false",
+        "most_important_folder": "Important",
+        "medium_important_folder": "Later",
+        "less_important_folder": "Spare",
+        "likely_junk_folder": "Junk",
+        "sync_state_file": str(tmp_path / "sync_state.json"),
+        **imap,
+    }
+    return cfg
+
+
+def make_cache(tmp_path, backend: str, **settings) -> Cache:
+    """A Cache with all its files in tmp_path; settings override [CACHE] keys."""
+    cfg = ConfigParser()
+    cfg["CACHE"] = {
+        "cache_file": str(tmp_path / "cache.csv"),
+        "cache_backend": backend,
+        "cache_db_file": str(tmp_path / "cache.sqlite3"),
+        "write_buffer_size": "1",
+        **settings,
+    }
+    cfg["REPUTATION"] = {"reputation_file": str(tmp_path / "reputation.sqlite3")}
+    cfg["NEAR_DUPLICATES"] = {"near_duplicate_file": str(tmp_path / "near_duplicates.sqlite3")}
+    return Cache(cfg)
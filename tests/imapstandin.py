@@ -0,0 +1,270 @@
+import asyncio
+from email import message_from_bytes
+from threading import Thread
+from typing import Optional
+from mail.imapparser import tokenize_response
+
+# A small in-memory IMAP4rev1 server for tests and benchmarks. It implements just what the bot uses
+# (LOGIN, CAPABILITY, LIST, SELECT, UID SEARCH/FETCH/STORE/COPY/MOVE/EXPUNGE, EXPUNGE, NOOP, LOGOUT) over
+# plain TCP. Every response is delayed by `latency` seconds without blocking the next command, which
+# models a high-latency link: pipelined commands overlap their round trips, sequential ones do not.
+class StandInImapServer:
+    def __init__(self, mailboxes: dict, capabilities: tuple = ('IMAP4rev1', 'MOVE', 'UIDPLUS'),
+                 latency: float = 0.0, uidvalidity: int = 1):
+        self.capabilities = capabilities
+        self.latency = latency
+        self.uidvalidity = uidvalidity
+        self.mailboxes: dict = {}
+        self.uidnext: dict = {}
+        for name, messages in mailboxes.items():
+            self.mailboxes[name] = {}
+            self.uidnext[name] = 1
+            for raw in messages:
+                self.append(name, raw)
+        self.commands: list = []
+        # Commands (e.g. "UID STORE") answered with NO, to script server-side failures
+        self.refused: set = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.port: Optional[int] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__server = None
+        self.__thread: Optional[Thread] = None
+
+    def append(self, mailbox: str, raw: bytes, flags: tuple = ()) -> int:
+        self.mailboxes.setdefault(mailbox, {})
+        self.uidnext.setdefault(mailbox, 1)
+        uid = self.uidnext[mailbox]
+        self.mailboxes[mailbox][uid] = {'raw': raw, 'flags': set(flags)}
+        self.uidnext[mailbox] += 1
+        return uid
+
+    def start(self) -> int:
+        self.__loop = asyncio.new_event_loop()
+        ready = []
+
+        def run() -> None:
+            asyncio.set_event_loop(self.__loop)
+            self.__server = self.__loop.run_until_complete(asyncio.start_server(self.__handle, '127.0.0.1', 0))
+            ready.append(self.__server.sockets[0].getsockname()[1])
+            self.__loop.run_forever()
+
+        self.__thread = Thread(target=run, name="imap-standin", daemon=True)
+        self.__thread.start()
+        while not ready:
+            self.__thread.join(0.01)
+        self.port = ready[0]
+        return self.port
+
+    def stop(self) -> None:
+        if self.__loop is None:
+            return
+
+        async def shutdown() -> None:
+            self.__server.close()
+            await self.__server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.__loop).result(5)
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join(5)
+        self.__loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = {'selected': None}
+        writer.write(b'* OK [CAPABILITY ' + ' '.join(self.capabilities).encode() + b'] stand-in ready\r\n')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.rstrip(b'\r\n')
+                self.commands.append(line)
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                tag, _, rest = line.partition(b' ')
+                try:
+                    response = self.__execute(session, tag, rest)
+                except Exception as e:
+                    response = tag + b' BAD ' + str(e).encode() + b'\r\n'
+                logout = rest.upper() == b'LOGOUT'
+                await self.__respond(writer, response, close=logout)
+                if logout:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if not writer.is_closing():
+                writer.close()
+
+    async def __respond(self, writer: asyncio.StreamWriter, response: bytes, close: bool = False) -> None:
+        async def send() -> None:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            self.in_flight -= 1
+            if not writer.is_closing():
+                writer.write(response)
+                await writer.drain()
+
+        if close:
+            await send()
+        else:
+            asyncio.get_running_loop().create_task(send())
+
+    def __uids(self, mailbox: dict, sequence_set: str) -> list:
+        highest = max(mailbox) if mailbox else 0
+        uids = set()
+        for item in sequence_set.split(','):
+            start, _, end = item.partition(':')
+            start = highest if start == '*' else int(start)
+            end = start if not end else (highest if end == '*' else int(end))
+            low, high = min(start, end), max(start, end)
+            uids.update(uid for uid in mailbox if low <= uid <= high)
+        return sorted(uids)
+
+    def __execute(self, session: dict, tag: bytes, rest: bytes) -> bytes:
+        args = tokenize_response([rest])
+        command = str(args[0]).upper()
+        if command == 'UID':
+            command = 'UID ' + str(args[1]).upper()
+            args = args[2:]
+        else:
+            args = args[1:]
+        ok = tag + b' OK ' + command.encode() + b' completed\r\n'
+        if command in self.refused:
+            return tag + b' NO [CANNOT] ' + command.encode() + b' refused\r\n'
+        selected = self.mailboxes.get(session['selected']) if session['selected'] else None
+
+        if command == 'CAPABILITY':
+            return b'* CAPABILITY ' + ' '.join(self.capabilities).encode() + b'\r\n' + ok
+        if command in ('LOGIN', 'NOOP', 'ENABLE'):
+            return ok
+        if command == 'LOGOUT':
+            return b'* BYE logging out\r\n' + ok
+        if command == 'LIST':
+            lines = b''.join(b'* LIST (\\HasNoChildren) "/" "' + name.encode() + b'"\r\n' for name in self.mailboxes)
+            return lines + ok
+        if command == 'SELECT':
+            name = args[0]
+            if name not in self.mailboxes:
+                return tag + b' NO no such mailbox\r\n'
+            session['selected'] = name
+            return (
+                f'* {len(self.mailboxes[name])} EXISTS\r\n'
+                f'* OK [UIDVALIDITY {self.uidvalidity}] UIDs valid\r\n'
+                f'* OK [UIDNEXT {self.uidnext[name]}] Predicted next UID\r\n'
+            ).encode() + tag + b' OK [READ-WRITE] SELECT completed\r\n'
+        if selected is None:
+            return tag + b' BAD no mailbox selected\r\n'
+
+        if command == 'UID SEARCH':
+            uids = sorted(selected)
+            index = 0
+            while index < len(args):
+                criterion = str(args[index]).upper()
+                if criterion == 'UNSEEN':
+                    uids = [uid for uid in uids if '\\Seen' not in selected[uid]['flags']]
+                elif criterion == 'UID':
+                    index += 1
+                    matching = set(self.__uids(selected, args[index]))
+                    uids = [uid for uid in uids if uid in matching]
+                index += 1
+            return b'* SEARCH' + b''.join(b' %d' % uid for uid in uids) + b'\r\n' + ok
+        if command == 'UID FETCH':
+            return self.__fetch(selected, self.__uids(selected, args[0]), args[1]) + ok
+        if command == 'UID STORE':
+            mode, flags = str(args[1]).upper(), set(args[2])
+            for uid in self.__uids(selected, args[0]):
+                if mode.startswith('+'):
+                    selected[uid]['flags'] |= flags
+                else:
+                    selected[uid]['flags'] -= flags
+            return ok
+        if command in ('UID COPY', 'UID MOVE'):
+            target = args[1]
+            if target not in self.mailboxes:
+                return tag + b' NO [TRYCREATE] no such mailbox\r\n'
+            uids = self.__uids(selected, args[0])
+            for uid in uids:
+                message = selected[uid]
+                self.append(target, message['raw'], tuple(message['flags'] - {'\\Deleted'}))
+                if command == 'UID MOVE':
+                    del selected[uid]
+            return ok
+        if command in ('UID EXPUNGE', 'EXPUNGE'):
+            candidates = self.__uids(selected, args[0]) if command == 'UID EXPUNGE' else list(selected)
+            for uid in candidates:
+                if '\\Deleted' in selected[uid]['flags']:
+                    del selected[uid]
+            return ok
+        return tag + b' BAD unknown command\r\n'
+
+    def __fetch(self, selected: dict, uids: list, items) -> bytes:
+        items = items if isinstance(items, list) else [items]
+        sequence_numbers = {uid: number for number, uid in enumerate(sorted(selected), start=1)}
+        response = b''
+        for uid in uids:
+            message = selected[uid]
+            parsed = message_from_bytes(message['raw'])
+            parts = []
+            for item in items:
+                name = str(item).upper()
+                if name == 'UID':
+                    parts.append(b'UID %d' % uid)
+                elif name == 'FLAGS':
+                    parts.append(b'FLAGS (' + ' '.join(sorted(message['flags'])).encode() + b')')
+                elif name == 'BODYSTRUCTURE':
+                    parts.append(b'BODYSTRUCTURE ' + self.__bodystructure(parsed))
+                elif name.startswith('BODY'):
+                    if not name.startswith('BODY.PEEK'):
+                        message['flags'].add('\\Seen')
+                    section = str(item)[str(item).index('[') + 1:str(item).rindex(']')]
+                    data = self.__section(message['raw'], parsed, section)
+                    partial = str(item)[str(item).rindex(']') + 1:]
+                    key = f'BODY[{section}]'
+                    if partial:
+                        offset, length = (int(value) for value in partial.strip('<>').split('.'))
+                        data = data[offset:offset + length]
+                        key += f'<{offset}>'
+                    parts.append(key.encode() + b' {%d}\r\n' % len(data) + data)
+            response += b'* %d FETCH (' % sequence_numbers[uid] + b' '.join(parts) + b')\r\n'
+        return response
+
+    def __section(self, raw: bytes, parsed, section: str) -> bytes:
+        if not section:
+            return raw
+        upper = section.upper()
+        if upper.startswith('HEADER.FIELDS'):
+            wanted = {name.upper() for name in upper[upper.index('(') + 1:upper.index(')')].split()}
+            headers = ''.join(f'{key}: {value}\r\n' for key, value in parsed.items() if key.upper() in wanted)
+            return headers.encode('utf-8') + b'\r\n'
+        part = parsed
+        for number in section.split('.'):
+            if part.is_multipart():
+                part = part.get_payload()[int(number) - 1]
+        payload = part.get_payload()
+        return payload.encode('utf-8', errors='replace') if isinstance(payload, str) else b''
+
+    def __bodystructure(self, part) -> bytes:
+        if part.is_multipart():
+            children = b''.join(self.__bodystructure(child) for child in part.get_payload())
+            return b'(' + children + b' "' + part.get_content_subtype().upper().encode() + b'")'
+        payload = part.get_payload()
+        size = len(payload.encode('utf-8', errors='replace')) if isinstance(payload, str) else 0
+        charset = part.get_content_charset() or 'us-ascii'
+        encoding = (part.get('Content-Transfer-Encoding') or '7bit').upper()
+        disposition = part.get_content_disposition()
+        disposition = b'("' + disposition.upper().encode() + b'" NIL)' if disposition else b'NIL'
+        basic = (
+            f'"{part.get_content_maintype().upper()}" "{part.get_content_subtype().upper()}" '
+            f'("CHARSET" "{charset}") NIL NIL "{encoding}" {size}'
+        ).encode()
+        if part.get_content_maintype() == 'text':
+            basic += b' %d' % payload.count('\n')
+        return b'(' + basic + b' NIL ' + disposition + b' NIL)'
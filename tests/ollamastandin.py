@@ -0,0 +1,93 @@
+import socket
+import struct
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Lock, Semaphore, Thread
+from time import sleep
+from typing import Callable, Optional
+
+ANSWER = '<answer>{"importance": 0.5, "confidence": 0.9, "reasoning": "Stand-in verdict"}</answer>'
+
+
+# A small Ollama stand-in for tests and benchmarks. POST /api/generate answers `response` (a string, or
+# a function of the request body) after `latency` seconds (a number, or a function of the body), running at most `parallel` requests at a time
+# like OLLAMA_NUM_PARALLEL; the rest queue. Faults can be scripted per request: "error" answers 503,
+# "reset" drops the connection with a TCP RST and "hang" answers only after `hang_seconds`.
+# POST /api/embed answers a small constant vector per input.
+class StandInOllamaServer:
+    def __init__(self, latency=0.0, response=ANSWER, parallel: int = 4, hang_seconds: float = 5.0):
+        self.latency: Callable[[dict], float] = latency if callable(latency) else (lambda _body: latency)
+        self.response: Callable[[dict], str] = response if callable(response) else (lambda _body: response)
+        self.hang_seconds = hang_seconds
+        self.faults: list = []
+        self.requests: list = []
+        self.connections: set = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+        self.slots = Semaphore(parallel)
+        self.port: Optional[int] = None
+        self.__server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api"
+
+    def start(self) -> int:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with standin.lock:
+                    standin.requests.append((self.path, body))
+                    standin.connections.add(self.client_address)
+                    fault = standin.faults.pop(0) if standin.faults else None
+                if fault == "reset":
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.connection.close()
+                    self.close_connection = True
+                    return
+                if fault == "error":
+                    self.__reply(503, {"error": "server busy"})
+                    return
+                with standin.slots:
+                    with standin.lock:
+                        standin.in_flight += 1
+                        standin.max_in_flight = max(standin.max_in_flight, standin.in_flight)
+                    sleep(standin.hang_seconds if fault == "hang" else standin.latency(body))
+                    with standin.lock:
+                        standin.in_flight -= 1
+                if self.path.endswith("/embed"):
+                    self.__reply(200, {"model": body.get("model"), "embeddings": [[1.0, 0.0, 0.0]] * len(body.get("input", []))})
+                    return
+                self.__reply(200, {"model": body.get("model"), "response": standin.response(body), "done": True})
+
+            def __reply(self, status: int, payload: dict) -> None:
+                data = dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up (read timeout)
+                    self.close_connection = True
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        self.port = self.__server.server_address[1]
+        Thread(target=self.__server.serve_forever, name="ollama-standin", daemon=True).start()
+        return self.port
+
+    def stop(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
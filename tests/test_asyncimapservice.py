@@ -0,0 +1,130 @@
+import asyncio
+from time import perf_counter
+from unittest.mock import MagicMock, patch
+from cache.cache import ImportanceLevel
+from e2e import process_mailbox_async
+from mail.asyncimapservice import AsyncImapService
+from tests.factories import folders, make_imap_config, raw_email
+from tests.imapstandin import StandInImapServer
+from workqueue.workqueue import WorkQueue
+
+
+def test_fetches_are_pipelined(tmp_path):
+    messages = [raw_email(f"mail{index}") for index in range(16)]
+    with StandInImapServer(folders(messages), latency=0.05) as server:
+        service = AsyncImapService(make_imap_config(tmp_path, server.port, fetch_chunk_size="2", pipeline_depth="8"))
+
+        async def run():
+            uids = await service.fetch_email_ids("INBOX")
+            started = perf_counter()
+            emails = [email async for email in service.fetch_emails(uids)]
+            elapsed = perf_counter() - started
+            await service.shutdown()
+            return emails, elapsed
+
+        emails, elapsed = asyncio.run(run())
+
+    assert [email.subject for email in emails] == [f"mail{index}" for index in range(16)]
+    assert emails[3].body == "Body of mail3"
+    assert server.max_in_flight >= 8
+    # 8 chunks at 50ms each would take 400ms one after the other
+    assert elapsed < 0.3
+
+
+def test_header_first_fetch_and_moves(tmp_path):
+    with StandInImapServer(folders([raw_email("a"), raw_email("b"), raw_email("c")])) as server:
+        service = AsyncImapService(make_imap_config(tmp_path, server.port))
+
+        async def run():
+            uids = await service.fetch_email_ids("INBOX")
+            headers = [email async for email in service.fetch_headers(uids)]
+            assert all(email.body == "" for email in headers)
+            emails = [email async for email in service.fetch_partial_bodies(headers)]
+            results = await service.move_many({
+                ImportanceLevel.MOST_IMPORTANT: [emails[0].uid],
+                ImportanceLevel.LEAST_IMPORTANT: [emails[1].uid, emails[2].uid],
+            })
+            service.commit_sync_state("INBOX")
+            again = await service.fetch_email_ids("INBOX")
+            await service.shutdown()
+            return emails, results, again
+
+        emails, results, again = asyncio.run(run())
+
+    assert [email.body for email in emails] == ["Body of a", "Body of b", "Body of c"]
+    assert all(results.values())
+    assert server.mailboxes["INBOX"] == {}
+    assert len(server.mailboxes["Important"]) == 1
+    assert len(server.mailboxes["Spare"]) == 2
+    # Nothing new since the committed sync state
+    assert again == []
+
+
+def test_copy_fallback_expunges_once(tmp_path):
+    with StandInImapServer(folders([raw_email("a"), raw_email("b")]), capabilities=("IMAP4rev1",)) as server:
+        service = AsyncImapService(make_imap_config(tmp_path, server.port, incremental_sync="false"))
+
+        async def run():
+            uids = await service.fetch_email_ids("INBOX")
+            results = await service.move_many({
+                ImportanceLevel.MOST_IMPORTANT: [uids[0]],
+                ImportanceLevel.SCAM: [uids[1]],
+            })
+            await service.shutdown()
+            return results
+
+        results = asyncio.run(run())
+
+    assert all(results.values())
+    assert server.mailboxes["INBOX"] == {}
+    assert len(server.mailboxes["Junk"]) == 1
+    assert sum(1 for command in server.commands if command.split(b" ", 1)[1] == b"EXPUNGE") == 1
+
+
+def test_missing_folder_marks_unread(tmp_path):
+    with StandInImapServer({"INBOX": [raw_email("a")]}) as server:
+        service = AsyncImapService(make_imap_config(tmp_path, server.port, incremental_sync="false"))
+
+        async def run():
+            uids = await service.fetch_email_ids("INBOX")
+            moved = await service.move_emails(uids, ImportanceLevel.MOST_IMPORTANT, mark_unread=False)
+            await service.shutdown()
+            return moved
+
+        assert asyncio.run(run()) is False
+    assert server.mailboxes["INBOX"][1]["flags"] == set()
+
+
+def test_refused_flag_store_fails_the_move(tmp_path):
+    with StandInImapServer(folders([raw_email("a")]), capabilities=("IMAP4rev1",)) as server:
+        service = AsyncImapService(make_imap_config(tmp_path, server.port, incremental_sync="false"))
+        server.refused.add("UID STORE")
+
+        async def run():
+            uids = await service.fetch_email_ids("INBOX")
+            moved = await service.move_emails(uids, ImportanceLevel.MOST_IMPORTANT)
+            await service.shutdown()
+            return moved
+
+        assert asyncio.run(run()) is False
+    assert list(server.mailboxes["INBOX"]) == [1]
+    assert not any(command.split(b" ", 1)[1].startswith(b"UID COPY") for command in server.commands)
+
+
+def test_process_mailbox_async_moves_classified_mail(tmp_path):
+    with StandInImapServer(folders([raw_email("a"), raw_email("b")])) as server:
+        config = make_imap_config(tmp_path, server.port)
+        config["QUEUE"] = {"queue_file": str(tmp_path / "queue.sqlite3")}
+        service = AsyncImapService(config)
+        work_queue = WorkQueue(config)
+
+        async def run():
+            await process_mailbox_async(service, None, MagicMock(), work_queue, "INBOX")
+            await service.shutdown()
+
+        with patch("e2e.classify_email", return_value=ImportanceLevel.MEDIUM_IMPORTANT):
+            asyncio.run(run())
+
+    assert work_queue.counts("INBOX") == {"moved": 2}
+    assert len(server.mailboxes["Later"]) == 2
+    work_queue.close()
@@ -0,0 +1,81 @@
+import pytest
+from configparser import ConfigParser
+from json import dumps
+from re import MULTILINE, compile as compile_regex
+from cache.cache import ImportanceLevel
+from e2e import classify_emails
+from llm.ollamallm.llm import LLM
+from mail.emailwrapper import EmailWrapper
+from prompt.batch_importance_evaluator import BatchImportanceEvaluator
+from prompt.prompt import estimate_tokens
+from tests.factories import email
+from tests.ollamastandin import ANSWER, StandInOllamaServer
+
+EMAIL_IDS = compile_regex(r"^ID: (\d+)$", flags=MULTILINE)
+
+
+def numbered(index: int, body: str = "") -> EmailWrapper:
+    return email(f"sender{index}@example.com", f"Subject {index}", body or f"Body {index}", uid=str(index))
+
+
+def verdicts(prompt: str, skip: tuple = ()) -> str:
+    """A batched answer for every ID in the prompt except `skip`, with a "]" inside a reasoning string."""
+    return dumps([
+        {"id": email_id, "importance": 0.9, "confidence": 0.8, "reasoning": f"Verdict {email_id} [ok]"}
+        for email_id in EMAIL_IDS.findall(prompt) if email_id not in skip
+    ]) + "\nDone."
+
+
+@pytest.fixture
+def server():
+    standin = StandInOllamaServer(response=lambda body: verdicts(body["prompt"], skip=("2",)) if "ID: " in body["prompt"] else ANSWER)
+    standin.start()
+    yield standin
+    standin.stop()
+
+
+def test_batches_are_bounded_by_count_and_context_window():
+    emails = [numbered(index) for index in range(20)]
+    assert [len(batch) for batch in BatchImportanceEvaluator.pack(emails, 32768, 8)] == [8, 8, 4]
+
+    static = estimate_tokens(BatchImportanceEvaluator([]).get_prompt())
+    small = [len(batch) for batch in BatchImportanceEvaluator.pack(emails, static + 300, 8)]
+    assert sum(small) == 20 and max(small) < 8
+
+    long_emails = [numbered(index, "x" * 5000) for index in range(3)]
+    assert [len(batch) for batch in BatchImportanceEvaluator.pack(long_emails, static + 100, 8)] == [1, 1, 1]
+
+
+def test_answers_are_matched_by_id_and_gaps_are_reported():
+    emails = [numbered(index) for index in range(4)]
+    prompt = BatchImportanceEvaluator(emails)
+    response = (
+        '[{"id": 1, "importance": 0.1, "confidence": 0.9, "reasoning": "Sale"}, '
+        '{"id": "7", "importance": 0.9, "confidence": 0.9, "reasoning": "Unknown ID"}, '
+        '{"id": "2", "importance": 0.6, "confidence: 0.9}, '
+        '{"id": "1", "importance": 0.9, "confidence": 0.9, "reasoning": "Duplicate"}, '
+        '{"id": "4", "importance": 0.95, "confidence": 0.98, "reasoning": "Security ale'
+    )
+    answers = prompt.extract_response(response)
+
+    assert answers == {
+        "1": {"importance": 0.1, "confidence": 0.9, "reasoning": "Sale"},
+        "4": {"importance": 0.95, "confidence": 0.98, "reasoning": "Security ale"},
+    }
+    assert [item.uid for item in prompt.unanswered(answers)] == ["1", "2"]
+    assert prompt.max_tokens > 4 * 40 and "exactly 4 objects" in prompt.get_prompt()
+
+
+def test_emails_left_out_of_a_batch_fall_back_to_single_prompts(server):
+    config = ConfigParser()
+    config["OLLAMA"] = {"ollama_base_url": server.url, "num_ctx": "8192"}
+    llm = LLM(config)
+    results = classify_emails([numbered(index) for index in range(10)], None, llm, max_batch=8)
+    llm.close()
+
+    # One batch of 8 and one of 2; the second email of each was skipped and asked about again on its own
+    prompts = [body["prompt"] for _, body in server.requests[1:]]
+    assert [len(EMAIL_IDS.findall(prompt)) for prompt in prompts] == [8, 0, 2, 0]
+    assert "stop" not in server.requests[1][1]["options"]
+    assert results[:8] == [ImportanceLevel.MOST_IMPORTANT] + [ImportanceLevel.MEDIUM_IMPORTANT] + [ImportanceLevel.MOST_IMPORTANT] * 6
+    assert results[8:] == [ImportanceLevel.MOST_IMPORTANT, ImportanceLevel.MEDIUM_IMPORTANT]
@@ -0,0 +1,44 @@
+from configparser import ConfigParser
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from mail.bodyextractor import BodyExtractor
+
+
+def extractor(max_body_chars: int = 2000, html_converter: str = "html2text") -> BodyExtractor:
+    cfg = ConfigParser()
+    cfg["EVALUATION"] = {"max_body_chars": str(max_body_chars), "html_converter": html_converter}
+    return BodyExtractor(cfg)
+
+
+def test_prefers_plain_text_and_honors_the_charset():
+    message = MIMEMultipart("mixed")
+    attachment = MIMEApplication(b"%PDF", "pdf")
+    attachment.add_header("Content-Disposition", "attachment", filename="plain.txt")
+    message.attach(attachment)
+    alternative = MIMEMultipart("alternative")
+    alternative.attach(MIMEText("<p>HTML version</p>", "html"))
+    alternative.attach(MIMEText("Grüße aus Köln", "plain", "iso-8859-1"))
+    message.attach(alternative)
+
+    assert extractor().from_raw(message.as_bytes()) == "Grüße aus Köln"
+
+
+def test_html_only_mail_is_converted_and_capped():
+    html = "<html><body><h1>Sale</h1><p>" + "deal " * 1000 + "</p><pre>kept</pre></body></html>"
+    body = extractor(max_body_chars=100).from_raw(MIMEText(html, "html").as_string())
+
+    assert body.startswith("# Sale")
+    assert len(body) <= 100
+
+
+def test_converter_state_does_not_leak_between_documents():
+    body_extractor = extractor()
+    body_extractor.from_text("<pre>unterminated", "html")
+
+    assert body_extractor.from_text("<p>four    five</p>", "html") == "four five"
+
+
+def test_builtin_converter_is_the_default():
+    assert BodyExtractor().from_text("<style>p{}</style><p>Hi <a href='https://example.com'>there</a></p>", "html") \
+        == "Hi [there](https://example.com)"
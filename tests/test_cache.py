@@ -0,0 +1,193 @@
+import multiprocessing
+import os
+import signal
+import time
+import pytest
+from datetime import datetime, timedelta
+from hashlib import sha256
+from cache.cache import ImportanceLevel
+from tests.factories import email, make_cache
+
+LEGACY_CSV = (
+    "sender,importance_level,email_subject,email_subject_hash,reasoning,time_added\n"
+    "news@shop.example,least_important,Sale,{sale},\"promo, again\",{day3}\n"
+    "broken-row\n"
+    "boss@work.example,most_important,Review,{review},urgent,{day2}\n"
+    "news@shop.example,scam,Later,{later},changed,{day1}\n"
+)
+
+
+@pytest.fixture
+def legacy_csv(tmp_path):
+    hashes = {name: sha256(name.capitalize().encode()).hexdigest() for name in ("sale", "review", "later")}
+    days = {f"day{days}": (datetime.now() - timedelta(days=days)).isoformat() for days in (1, 2, 3)}
+    (tmp_path / "cache.csv").write_text(LEGACY_CSV.format(**hashes, **days))
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_existing_csv_is_indexed_and_the_latest_verdict_wins(tmp_path, legacy_csv, backend):
+    cache = make_cache(tmp_path, backend)
+
+    # The most recent matching record wins, whether it matched on the subject or the sender
+    assert cache.exists(email("news@shop.example", "Something new")) == ImportanceLevel.SCAM
+    assert cache.exists(email("other@shop.example", "Review")) == ImportanceLevel.MOST_IMPORTANT
+    assert cache.exists(email("boss@work.example", "Sale")) == ImportanceLevel.MOST_IMPORTANT
+    assert cache.exists(email("stranger@example.com", "Hello")) is None
+    assert cache.backend.count() == 3
+    cache.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_added_records_are_found_and_survive_a_restart(tmp_path, backend):
+    cache = make_cache(tmp_path, backend)
+    cache.add_record(email("a@example.com", "Invoice"), ImportanceLevel.MEDIUM_IMPORTANT, "bills")
+    cache.add_record(email("a@example.com", "Other"), ImportanceLevel.SCAM, "changed, with a comma")
+
+    assert cache.exists(email("b@example.com", "Invoice")) == ImportanceLevel.MEDIUM_IMPORTANT
+    cache.close()
+
+    reopened = make_cache(tmp_path, backend)
+    assert reopened.exists(email("a@example.com", "Unrelated")) == ImportanceLevel.SCAM
+    assert reopened.backend.count() == 2
+    reopened.close()
+
+
+def test_csv_is_migrated_into_sqlite_only_once(tmp_path, legacy_csv):
+    make_cache(tmp_path, "sqlite").close()
+    cache = make_cache(tmp_path, "sqlite")
+
+    assert cache.backend.count() == 3
+    cache.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_confirmed_verdicts_live_exponentially_longer(tmp_path, backend):
+    cache = make_cache(tmp_path, backend, ttl_hours="1", max_ttl_hours="4")
+    policy = cache.backend.policy
+    later = lambda hours: (lambda: datetime.now().timestamp() + hours * 3600)
+
+    for number in range(3):
+        cache.add_record(email("x@example.com", f"Report {number}"), ImportanceLevel.MEDIUM_IMPORTANT, "")
+    policy.clock = later(1.5)
+    assert cache.exists(email("x@example.com", "New")) == ImportanceLevel.MEDIUM_IMPORTANT
+
+    for number in range(3, 6):
+        cache.add_record(email("x@example.com", f"Report {number}"), ImportanceLevel.MEDIUM_IMPORTANT, "")
+    assert cache.backend.lookup("none", "x@example.com")["streak"] == 6
+    policy.clock = later(3.9)
+    assert cache.exists(email("x@example.com", "New")) == ImportanceLevel.MEDIUM_IMPORTANT
+    policy.clock = later(4.1)
+    assert cache.exists(email("x@example.com", "New")) is None
+
+    # A disagreement starts over with the base TTL
+    cache.add_record(email("x@example.com", "Report 6"), ImportanceLevel.SCAM, "")
+    policy.clock = later(1.5)
+    assert cache.exists(email("x@example.com", "New")) is None
+    cache.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_least_recently_used_keys_are_evicted(tmp_path, backend):
+    cache = make_cache(tmp_path, backend, max_entries="4")
+    cache.add_record(email("a@example.com", "A"), ImportanceLevel.SCAM, "")
+    cache.add_record(email("b@example.com", "B"), ImportanceLevel.SCAM, "")
+    assert cache.exists(email("a@example.com", "A")) == ImportanceLevel.SCAM
+    cache.add_record(email("c@example.com", "C"), ImportanceLevel.SCAM, "")
+    cache.compact()
+
+    assert cache.exists(email("a@example.com", "A")) == ImportanceLevel.SCAM
+    assert cache.exists(email("b@example.com", "B")) is None
+    cache.close()
+
+
+def test_compaction_keeps_one_row_per_key_and_the_streaks(tmp_path):
+    cache = make_cache(tmp_path, "csv")
+    for number in range(4):
+        cache.add_record(email("x@example.com", "Weekly report"), ImportanceLevel.LEAST_IMPORTANT, "")
+    cache.add_record(email("y@example.com", "Weekly report"), ImportanceLevel.LEAST_IMPORTANT, "")
+    cache.add_record(email("z@example.com", "Other"), ImportanceLevel.SCAM, "")
+    cache.compact()
+    assert cache.backend.count() == 4
+    cache.close()
+
+    reopened = make_cache(tmp_path, "csv")
+    assert reopened.backend.lookup("none", "x@example.com")["streak"] == 4
+    assert reopened.backend.lookup(sha256(b"Weekly report").hexdigest(), "none")["streak"] == 5
+    assert reopened.exists(email("z@example.com", "Other")) == ImportanceLevel.SCAM
+    reopened.close()
+
+
+def test_buffered_records_are_visible_and_flushed_in_batches(tmp_path):
+    cache = make_cache(tmp_path, "csv", write_buffer_size="3", write_buffer_ms="60000")
+    cache.add_record(email("a@example.com", "A"), ImportanceLevel.SCAM, "")
+    cache.add_record(email("b@example.com", "B"), ImportanceLevel.MOST_IMPORTANT, "")
+
+    assert cache.exists(email("a@example.com", "Other")) == ImportanceLevel.SCAM
+    assert cache.backend.count() == 0
+    cache.add_record(email("c@example.com", "C"), ImportanceLevel.SCAM, "")
+    assert cache.backend.count() == 3
+    assert [journal.read_text() for journal in tmp_path.glob("cache.csv.journal*")] == [""]
+
+    cache.add_record(email("d@example.com", "D"), ImportanceLevel.SCAM, "")
+    cache.close()
+    assert make_cache(tmp_path, "csv").backend.count() == 4
+
+
+def test_buffer_is_flushed_after_the_interval(tmp_path):
+    cache = make_cache(tmp_path, "sqlite", write_buffer_size="100", write_buffer_ms="50")
+    cache.add_record(email("a@example.com", "A"), ImportanceLevel.SCAM, "")
+    cache.flush_timer.join()
+
+    assert cache.backend.count() == 1
+    cache.close()
+
+
+def _add_records_and_wait(tmp_path, added):
+    cache = make_cache(tmp_path, "csv", write_buffer_size="100", write_buffer_ms="60000")
+    for number in range(5):
+        cache.add_record(email(f"{number}@example.com", f"Subject {number}"), ImportanceLevel.SCAM, "")
+    added.set()
+    time.sleep(60)
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_journal_survives_kill_9(tmp_path, backend):
+    context = multiprocessing.get_context("fork")
+    added = context.Event()
+    process = context.Process(target=_add_records_and_wait, args=(tmp_path, added))
+    process.start()
+    assert added.wait(10)
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+    journal_path, = tmp_path.glob("cache.csv.journal*")
+    with open(journal_path, "a") as journal:
+        journal.write('{"sender": "torn')
+
+    cache = make_cache(tmp_path, backend)
+    assert cache.backend.count() == 5
+    assert cache.exists(email("4@example.com", "x")) == ImportanceLevel.SCAM
+    cache.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_journal_replay_skips_records_that_were_already_written(tmp_path, backend):
+    cache = make_cache(tmp_path, backend, write_buffer_size="100", write_buffer_ms="60000")
+    for number in range(3):
+        cache.add_record(email("a@example.com", f"Subject {number}"), ImportanceLevel.SCAM, "", 0.9)
+    cache.add_record(email("b@example.com", "Other"), ImportanceLevel.SCAM, "", 0.9)
+    # Killed after the batch was written but before the journal was truncated; the last record was not written yet
+    cache.flush_timer.cancel()
+    cache.backend.append(cache.pending[:3])
+    cache.reputation.record([(row["sender"], row["importance_level"], row["confidence"]) for row in cache.pending[:3]])
+    cache.journal.close()
+    cache.backend.close()
+    cache.reputation.close()
+
+    reopened = make_cache(tmp_path, backend)
+    assert reopened.backend.count() == 4
+    assert reopened.backend.lookup("none", "a@example.com")["streak"] == 3
+    verdicts = reopened.reputation.connection.execute(
+        "SELECT key, verdicts FROM reputation WHERE scope = 'address' ORDER BY key"
+    ).fetchall()
+    assert verdicts == [("a@example.com", 3), ("b@example.com", 1)]
+    reopened.close()
@@ -0,0 +1,114 @@
+import multiprocessing
+import time
+import pytest
+from hashlib import sha256
+from cache.backends import read_csv_rows
+from cache.cache import Cache, ImportanceLevel
+from tests import factories
+from tests.factories import email
+
+RECORDS = 300
+REASONING = 'reason, with "quotes"\nand a second line'
+
+
+def make_cache(tmp_path, backend: str, **settings) -> Cache:
+    # Writers buffer a few records, so batches from several processes interleave
+    return factories.make_cache(tmp_path, backend, **{"write_buffer_size": "8", **settings})
+
+
+def _writer(tmp_path, backend, writer, writers, senders, work, settings, barrier):
+    cache = make_cache(tmp_path, backend, **settings)
+    barrier.wait(60)
+    for number in range(RECORDS):
+        sender = f"w{writer}-{number % senders}@example.com"
+        # Stands in for the LLM call that happens between two records, outside any cache lock
+        time.sleep(work)
+        cache.add_record(email(sender, f"Subject {writer} {number % senders}"), ImportanceLevel.SCAM, REASONING)
+        if number % 10 == 0:
+            cache.exists(email(f"w{(writer + 1) % writers}-0@example.com", "lookup"))
+    cache.flush()
+    barrier.wait(60)
+    # Every process sees what the others wrote
+    seen = all(
+        cache.exists(email(f"w{other}-{(RECORDS - 1) % senders}@example.com", "lookup")) == ImportanceLevel.SCAM
+        for other in range(writers)
+    )
+    cache.close()
+    raise SystemExit(0 if seen else 3)
+
+
+def run_writers(tmp_path, backend: str, writers: int, senders: int = RECORDS, work: float = 0.0, **settings) -> float:
+    tmp_path.mkdir(exist_ok=True)
+    make_cache(tmp_path, backend).close()
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(writers + 1)
+    processes = [
+        context.Process(target=_writer, args=(tmp_path, backend, writer, writers, senders, work, settings, barrier))
+        for writer in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait(60)
+    started = time.perf_counter()
+    barrier.wait(60)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0] * writers
+    return writers * RECORDS / elapsed
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_concurrent_writers_lose_and_corrupt_nothing(tmp_path, backend):
+    run_writers(tmp_path, backend, writers=4)
+
+    cache = make_cache(tmp_path, backend)
+    if backend == "csv":
+        rows = list(read_csv_rows(str(tmp_path / "cache.csv")))
+        assert len(rows) == 4 * RECORDS
+        assert all(row["reasoning"] == REASONING and row["importance_level"] == "scam" for row in rows)
+        assert len({row["sender"] for row in rows}) == 4 * RECORDS
+    else:
+        assert cache.backend.count() == 4 * RECORDS
+        assert cache.backend.connection.execute("SELECT COUNT(DISTINCT sender) FROM records").fetchone()[0] == 4 * RECORDS
+    cache.close()
+
+
+def test_compaction_while_other_processes_write(tmp_path):
+    # Few senders per writer, so the log keeps outgrowing the index and every process compacts
+    run_writers(tmp_path, "csv", writers=4, senders=5, compact_min_records="20")
+
+    cache = make_cache(tmp_path, "csv")
+    # Every record was counted exactly once: the streak of a sender is the number of records it got
+    for writer in range(4):
+        for sender in range(5):
+            assert cache.backend.lookup("none", f"w{writer}-{sender}@example.com")["streak"] == RECORDS // 5
+            assert cache.backend.lookup(sha256(f"Subject {writer} {sender}".encode()).hexdigest(), "none")["streak"] == RECORDS // 5
+    assert cache.backend.count() < 4 * RECORDS
+    cache.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_throughput_grows_with_writer_processes(tmp_path, backend):
+    # The lock is only held to append a batch, so writers mostly wait on their own (simulated) work
+    single = run_writers(tmp_path / "one", backend, writers=1, work=0.002)
+    several = run_writers(tmp_path / "four", backend, writers=4, work=0.002)
+
+    print(f"{backend}: 1 writer {single:.0f} records/s, 4 writers {several:.0f} records/s")
+    assert several > 2 * single
+
+
+def test_a_line_torn_by_a_crashed_writer_is_skipped(tmp_path):
+    cache = make_cache(tmp_path, "csv", write_buffer_size="1")
+    cache.add_record(email("a@example.com", "A"), ImportanceLevel.SCAM, REASONING)
+    with open(tmp_path / "cache.csv", "a") as log:
+        log.write('b@example.com,scam,B,0123,"half a reas')
+
+    other = make_cache(tmp_path, "csv", write_buffer_size="1")
+    other.add_record(email("c@example.com", "C"), ImportanceLevel.MOST_IMPORTANT, REASONING)
+
+    assert [row["sender"] for row in read_csv_rows(str(tmp_path / "cache.csv"))] == ["a@example.com", "c@example.com"]
+    assert cache.exists(email("c@example.com", "x")) == ImportanceLevel.MOST_IMPORTANT
+    assert cache.exists(email("b@example.com", "x")) is None
+    other.close()
+    cache.close()
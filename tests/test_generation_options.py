@@ -0,0 +1,62 @@
+import pytest
+from configparser import ConfigParser
+from llm.ollamallm.llm import LLM
+from llm.ollamallm.options import GenerationOptions
+from mail.emailwrapper import EmailWrapper
+from prompt.importance_evaluator import ImportanceEvaulator
+from prompt.prompt import extract_json_answer
+from prompt.scam_evaluator import ScamEvaluator
+from tests.ollamastandin import StandInOllamaServer
+
+
+def email() -> EmailWrapper:
+    return EmailWrapper("Hello", "Body", "a@b.example", "me@example.com", "", "<id@x>")
+
+
+def make_config(**settings) -> ConfigParser:
+    cfg = ConfigParser()
+    cfg["OLLAMA"] = {"ollama_base_url": "http://localhost:11434/api", "num_predict": "256", "num_ctx": "4096",
+                     "stop": "", "top_k": "", "num_thread": "8", **settings}
+    return cfg
+
+
+def test_options_come_from_config_and_prompts_set_their_own_budget():
+    options = GenerationOptions.from_config(make_config())
+    assert options.to_dict() == {"num_predict": 256, "num_ctx": 4096, "temperature": 0.3, "num_thread": 8}
+
+    importance = options.for_prompt(ImportanceEvaulator(email())).to_dict()
+    assert importance["num_predict"] == 80 and importance["stop"] == ["}"]
+    assert options.for_prompt(ScamEvaluator(email())).to_dict()["stop"] == ["</answer>"]
+
+
+def test_options_are_sent_where_ollama_reads_them():
+    # Stops at "}" like a real server, so the answer comes back without it
+    server = StandInOllamaServer(response='{"importance": 0.7, "confidence": 0.8, "reasoning": "Order update"')
+    server.start()
+    try:
+        cfg = make_config(stop="</answer>, ###", temperature="0.1")
+        cfg["OLLAMA"]["ollama_base_url"] = server.url
+        llm = LLM(cfg)
+        assert llm.generate(ImportanceEvaulator(email())) == {"importance": 0.7, "confidence": 0.8, "reasoning": "Order update"}
+        llm.close()
+    finally:
+        server.stop()
+
+    warmup, (_, body) = server.requests
+    assert warmup[1]["options"]["num_predict"] == 1 and warmup[1]["options"]["stop"] == ["</answer>", "###"]
+    assert "temperature" not in body and "stop" not in body
+    assert body["options"] == {"num_predict": 80, "num_ctx": 4096, "stop": ["}"], "temperature": 0.1, "num_thread": 8}
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('{"importance": 0.1, "confidence": 0.95, "reasoning": "Promo"}', {"importance": 0.1, "confidence": 0.95, "reasoning": "Promo"}),
+    ('```json\n{"importance": 0.6, "confidence": 0.9, "reasoning": "Order"', {"importance": 0.6, "confidence": 0.9, "reasoning": "Order"}),
+    ('<think>hmm {"no": 1}</think><answer>\n{"scam": 1, "confidence": 0.97, "reasoning": "Spoofed"}\n', {"scam": 1, "confidence": 0.97, "reasoning": "Spoofed"}),
+    # Cut by num_predict in the middle of the reasoning
+    ('{"importance": -1, "confidence": 0.99, "reasoning": "Likely sc', {"importance": -1, "confidence": 0.99, "reasoning": "Likely sc"}),
+    ('{"importance": 0.95, "confidence": 0.9, "reasoning": "Says \\"urgent\\" {twice}', {"importance": 0.95, "confidence": 0.9, "reasoning": 'Says "urgent" {twice}'}),
+    ('{"importance": 0.3, "confid', {"importance": 0.3}),
+    ("I cannot classify this email.", None),
+])
+def test_answers_are_extracted_from_bounded_generations(response, expected):
+    assert extract_json_answer(response) == expected
@@ -0,0 +1,30 @@
+from mail.htmltext import HtmlTextConverter
+
+
+def test_drops_invisible_content_and_keeps_links():
+    html = (
+        "<html><head><title>t</title><style>.a{color:red}</style></head><body>"
+        "<div style=\"display:none;max-height:0\">Preheader <div>nested</div> text</div>"
+        "<span hidden>secret</span><script>track()</script>"
+        "<h1>Order&nbsp;shipped</h1><p>Your   parcel\n is on <b>its</b> way. "
+        "<a href=\"https://example.com/track\">Track it</a> <a href=\"#top\">top</a></p>"
+        "<table><tr><td>Item</td><td>Qty</td></tr></table><ul><li>one</li><li>two</li></ul>"
+        "<a href=\"https://example.com/pixel\"><img src=\"p.png\"></a></body></html>"
+    )
+
+    assert HtmlTextConverter().convert(html) == (
+        "Order shipped\n\nYour parcel is on its way. [Track it](https://example.com/track) top\n\n"
+        "Item Qty\n\n- one\n- two"
+    )
+
+
+def test_stops_parsing_once_the_budget_is_reached():
+    converter = HtmlTextConverter(max_chars=120, feed_size=1024)
+    html = "<html><body>" + "<table><tr><td><p>Limited time offer on everything</p></td></tr></table>" * 5000 + "</body></html>"
+
+    text = converter.convert(html)
+
+    assert 100 <= len(text) <= 120
+    assert converter.consumed <= 2048
+    # The same instance starts every document from a clean state
+    assert converter.convert("<p>short</p>") == "short"
@@ -0,0 +1,75 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from configparser import ConfigParser
+from mail.imappool import ImapConnectionPool
+
+
+@pytest.fixture
+def config():
+    cfg = ConfigParser()
+    cfg["IMAP"] = {
+        "port": "993",
+        "server": "imap.example.com",
+        "username": "user@example.com",
+        "password": "password123",
+        "pool_size": "2",
+        "pool_acquire_timeout": "0.1",
+    }
+    return cfg
+
+
+def healthy_client():
+    client = MagicMock()
+    client.state = "AUTH"
+    client.noop.return_value = ("OK", [b""])
+    return client
+
+
+@patch("mail.imapclientwrapper.IMAP4_SSL")
+def test_connections_are_reused_and_bounded(mock_imap_ssl, config):
+    mock_imap_ssl.side_effect = lambda *_: healthy_client()
+    pool = ImapConnectionPool(config)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+    pool.release(first)
+    assert pool.acquire() is first
+    assert mock_imap_ssl.call_count == 2
+    pool.release(first)
+    pool.release(second)
+
+
+@patch("mail.imapclientwrapper.IMAP4_SSL")
+def test_stale_connection_is_logged_in_again(mock_imap_ssl, config):
+    stale = healthy_client()
+    fresh = healthy_client()
+    mock_imap_ssl.side_effect = [stale, fresh]
+    pool = ImapConnectionPool(config)
+
+    with pool.connection() as client_wrapper:
+        assert client_wrapper.imap_client is stale
+    stale.noop.side_effect = OSError("connection reset")
+
+    with pool.connection() as client_wrapper:
+        assert client_wrapper.imap_client is fresh
+    stale.logout.assert_called_once()
+
+
+@patch("mail.imapclientwrapper.IMAP4_SSL")
+def test_close_logs_out_every_idle_connection(mock_imap_ssl, config):
+    clients = [healthy_client(), healthy_client()]
+    mock_imap_ssl.side_effect = clients
+    pool = ImapConnectionPool(config)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    pool.close()
+
+    for client in clients:
+        client.logout.assert_called_once()
+    with pytest.raises(Exception, match="closed"):
+        pool.acquire()
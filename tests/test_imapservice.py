@@ -0,0 +1,299 @@
+import base64
+import pytest
+import socket
+from threading import Thread
+from unittest.mock import patch, call, MagicMock
+from configparser import ConfigParser
+from mail.imapservice import ImapService
+from cache.cache import ImportanceLevel
+from mail.utils import to_sequence_set
+from tests.factories import folders, make_imap_config, raw_email
+from tests.imapstandin import StandInImapServer
+
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = ConfigParser()
+    cfg["IMAP"] = {
+        "port": "993",
+        "server": "imap.example.com",
+        "username": "user@example.com",
+        "password": "password123",
+        "most_important_folder": "Important",
+        "medium_important_folder": "Later",
+        "less_important_folder": "Spare",
+        "likely_junk_folder": "Junk",
+        "sync_state_file": str(tmp_path / "sync_state.json"),
+    }
+    return cfg
+
+
+@pytest.fixture
+def imap_client():
+    return MagicMock()
+
+
+@pytest.fixture
+def service(config, imap_client):
+    with patch("mail.imapservice.ImapClientWrapper") as mock_wrapper:
+        mock_wrapper.return_value.imap_client = None
+        mock_wrapper.return_value.initialize.return_value = imap_client
+        return ImapService(config)
+
+
+def test_to_sequence_set_collapses_ranges():
+    assert to_sequence_set(["90", "1", "2", "3", "77", "4"]) == "1:4,77,90"
+    assert to_sequence_set([]) == ""
+
+
+def test_fetch_emails_uses_one_fetch_per_chunk(service, imap_client):
+    imap_client.uid.return_value = ("OK", [
+        (b"1 (UID 10 BODY[]<0> {100}", raw_email("first")), b")",
+        (b"2 (BODY[]<0> {100}", raw_email("second")), b" UID 11)",
+    ])
+
+    emails = list(service.fetch_emails(["10", "11"], chunk_size=50))
+
+    imap_client.uid.assert_called_once_with("FETCH", "10:11", "(UID BODY.PEEK[]<0.65536>)")
+    assert [email.uid for email in emails] == ["10", "11"]
+    assert [email.subject for email in emails] == ["first", "second"]
+    assert emails[0].body == "Body of first"
+
+
+def test_fetch_emails_retries_missing_uids_per_chunk(service, imap_client):
+    imap_client.uid.side_effect = [
+        ("OK", [(b"1 (UID 10 BODY[]<0> {100}", raw_email("first")), b")", b"2 ()", b"3 ()"]),
+        ("OK", [(b"2 (UID 11 BODY[]<0> {100}", raw_email("second")), b")"]),
+    ]
+
+    emails = list(service.fetch_emails(["10", "11", "12"]))
+
+    assert [email.uid for email in emails] == ["10", "11"]
+    assert imap_client.uid.call_args_list[1].args == ("FETCH", "11:12", "(UID BODY[]<0.65536>)")
+
+
+def test_fetch_emails_streams_large_messages_in_windows(service, imap_client):
+    message = raw_email("big") + b"x" * 50
+    service.stream_window_bytes = 64
+    windows = [message[offset:offset + 64] for offset in range(0, len(message), 64)]
+    imap_client.uid.side_effect = [
+        ("OK", [(f"1 (UID 10 BODY[]<{index * 64}> {{{len(window)}}}".encode(), window), b")"])
+        for index, window in enumerate(windows)
+    ]
+
+    emails = list(service.fetch_emails(["10"]))
+
+    assert imap_client.uid.call_count == len(windows)
+    assert imap_client.uid.call_args_list[1].args == ("FETCH", "10", "(UID BODY.PEEK[]<64.64>)")
+    assert emails[0].body.startswith("Body of big")
+
+
+def test_move_emails_uses_uid_move_when_supported(service, imap_client):
+    imap_client.capabilities = ("IMAP4REV1", "MOVE")
+    imap_client.uid.return_value = ("OK", [None])
+
+    assert service.move_emails(["12", "10", "11"], ImportanceLevel.MOST_IMPORTANT)
+
+    assert imap_client.uid.call_args_list == [
+        call("STORE", "10:12", "-FLAGS.SILENT", "(\\Seen)"),
+        call("MOVE", "10:12", '"Important"'),
+    ]
+    imap_client.expunge.assert_not_called()
+
+
+def test_move_emails_falls_back_to_copy_and_single_expunge(service, imap_client):
+    imap_client.capabilities = ("IMAP4REV1", "UIDPLUS")
+    imap_client.uid.return_value = ("OK", [None])
+
+    assert service.move_emails(["10", "20"], ImportanceLevel.LEAST_IMPORTANT)
+
+    assert imap_client.uid.call_args_list == [
+        call("STORE", "10,20", "-FLAGS.SILENT", "(\\Seen)"),
+        call("COPY", "10,20", '"Spare"'),
+        call("STORE", "10,20", "+FLAGS.SILENT", "(\\Deleted)"),
+        call("EXPUNGE", "10,20"),
+    ]
+
+
+def test_move_emails_fails_when_the_deleted_flag_is_refused(service, imap_client):
+    imap_client.capabilities = ("IMAP4REV1", "UIDPLUS")
+    imap_client.uid.side_effect = lambda command, *args: (
+        ("NO", [b"refused"]) if args[1:] == ("+FLAGS.SILENT", "(\\Deleted)") else ("OK", [None])
+    )
+
+    assert service.move_emails(["10"], ImportanceLevel.LEAST_IMPORTANT) is False
+    assert call("EXPUNGE", "10") not in imap_client.uid.call_args_list
+
+
+def test_move_emails_falls_back_to_a_plain_expunge(service, imap_client):
+    imap_client.capabilities = ("IMAP4REV1", "UIDPLUS")
+    imap_client.uid.side_effect = lambda command, *args: ("NO", [b"refused"]) if command == "EXPUNGE" else ("OK", [None])
+    imap_client.expunge.return_value = ("OK", [None])
+
+    assert service.move_emails(["10"], ImportanceLevel.LEAST_IMPORTANT)
+    imap_client.expunge.assert_called_once()
+
+
+def test_refused_flag_store_fails_the_move(tmp_path):
+    with StandInImapServer(folders([raw_email("a")]), capabilities=("IMAP4rev1",)) as server:
+        service = ImapService(make_imap_config(tmp_path, server.port, incremental_sync="false"))
+        server.refused.add("UID STORE")
+        uids = service.fetch_email_ids("INBOX")
+
+        assert service.move_emails(uids, ImportanceLevel.MOST_IMPORTANT) is False
+        service.shutdown()
+    assert list(server.mailboxes["INBOX"]) == [1]
+    assert not any(command.split(b" ", 1)[1].startswith(b"UID COPY") for command in server.commands)
+
+
+def select_responses(uidvalidity: bytes, uidnext: bytes):
+    responses = {"UIDVALIDITY": [uidvalidity], "UIDNEXT": [uidnext], "HIGHESTMODSEQ": [None]}
+    return lambda code: (code, responses[code])
+
+
+def test_fetch_email_ids_only_searches_above_committed_uidnext(service, imap_client):
+    imap_client.select.return_value = ("OK", [b"3"])
+    imap_client.response.side_effect = select_responses(b"7", b"100")
+    imap_client.uid.return_value = ("OK", [b"40 41"])
+
+    assert service.fetch_email_ids("INBOX") == ["40", "41"]
+    imap_client.uid.assert_called_with("SEARCH", None, "UNSEEN")
+    service.commit_sync_state("INBOX")
+
+    imap_client.response.side_effect = select_responses(b"7", b"100")
+    assert service.fetch_email_ids("INBOX") == []
+
+    imap_client.response.side_effect = select_responses(b"7", b"103")
+    imap_client.uid.return_value = ("OK", [b"100 102"])
+    assert service.fetch_email_ids("INBOX") == ["100", "102"]
+    imap_client.uid.assert_called_with("SEARCH", None, "UID", "100:*", "UNSEEN")
+
+
+def test_fetch_email_ids_resyncs_when_uidvalidity_changes(service, imap_client):
+    imap_client.select.return_value = ("OK", [b"3"])
+    imap_client.response.side_effect = select_responses(b"7", b"100")
+    imap_client.uid.return_value = ("OK", [b"40"])
+    service.fetch_email_ids("INBOX")
+    service.commit_sync_state("INBOX")
+
+    imap_client.response.side_effect = select_responses(b"8", b"5")
+    imap_client.uid.return_value = ("OK", [b"1 2"])
+
+    assert service.fetch_email_ids("INBOX") == ["1", "2"]
+    imap_client.uid.assert_called_with("SEARCH", None, "UNSEEN")
+
+
+def test_scan_mailboxes_uses_status_and_skips_idle_folders(service, imap_client):
+    imap_client.noop.return_value = ("OK", [b""])
+    imap_client.status.side_effect = lambda mailbox, items: {
+        '"INBOX"': ("OK", [b'"INBOX" (UNSEEN 4 UIDNEXT 120 UIDVALIDITY 7)']),
+        '"Receipts"': ("OK", [b'Receipts (UNSEEN 0 UIDNEXT 9 UIDVALIDITY 3)']),
+        '"Updates"': ("OK", [b'"Updates" (UNSEEN 2 UIDNEXT 50 UIDVALIDITY 5)']),
+    }[mailbox]
+    service.sync_state.update("Updates", 5, 50)
+
+    assert service.scan_mailboxes(["INBOX", "Receipts", "Updates"]) == ["INBOX"]
+    imap_client.select.assert_not_called()
+    # Folders with queued retries are processed even without new mail
+    assert service.scan_mailboxes(["INBOX", "Receipts", "Updates"], pending={"Updates"}) == ["INBOX", "Updates"]
+
+
+def test_scan_mailboxes_uses_single_list_status_when_supported(service, imap_client):
+    imap_client.noop.return_value = ("OK", [b""])
+    imap_client.capabilities = ("IMAP4REV1", "LIST-STATUS")
+    imap_client._simple_command.return_value = ("OK", [b""])
+    imap_client._untagged_response.return_value = ("OK", [b'(\\HasNoChildren) "/" "INBOX"', b'(\\HasNoChildren) "/" Promotions'])
+    imap_client.response.return_value = ("STATUS", [
+        b'"INBOX" (UNSEEN 0 UIDNEXT 120 UIDVALIDITY 7)',
+        b'Promotions (UNSEEN 3 UIDNEXT 12 UIDVALIDITY 7)',
+    ])
+
+    assert service.scan_mailboxes(["INBOX", "Promotions"]) == ["Promotions"]
+    imap_client.status.assert_not_called()
+    assert service.get_mailbox_list() == ["INBOX", "Promotions"]
+    imap_client.list.assert_not_called()
+
+
+class SocketImapClient:
+    """Just enough of imaplib.IMAP4 to drive IDLE over a socket pair."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+
+    def _new_tag(self):
+        return b"A001"
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        return self.file.readline()
+
+    def abort(self, message):
+        return Exception(message)
+
+
+@pytest.fixture
+def idle_connection(service):
+    client_sock, server_sock = socket.socketpair()
+    service.imap_client = SocketImapClient(client_sock)
+    server = server_sock.makefile("rwb")
+    yield server
+    server.close()
+    server_sock.close()
+    client_sock.close()
+
+
+def test_wait_for_new_mail_returns_on_exists(service, idle_connection):
+    def server():
+        assert idle_connection.readline() == b"A001 IDLE\r\n"
+        idle_connection.write(b"+ idling\r\n* 4 EXISTS\r\n")
+        idle_connection.flush()
+        assert idle_connection.readline() == b"DONE\r\n"
+        idle_connection.write(b"A001 OK IDLE terminated\r\n")
+        idle_connection.flush()
+
+    thread = Thread(target=server)
+    thread.start()
+    assert service.wait_for_new_mail(timeout=5)
+    thread.join()
+
+
+def test_wait_for_new_mail_ends_idle_on_timeout(service, idle_connection):
+    service.idle_poll_interval = 0.05
+
+    def server():
+        idle_connection.readline()
+        idle_connection.write(b"+ idling\r\n")
+        idle_connection.flush()
+        assert idle_connection.readline() == b"DONE\r\n"
+        idle_connection.write(b"A001 OK IDLE terminated\r\n")
+        idle_connection.flush()
+
+    thread = Thread(target=server)
+    thread.start()
+    assert not service.wait_for_new_mail(timeout=0.2)
+    thread.join()
+
+
+def test_header_first_fetch_only_downloads_the_text_part_prefix(service, imap_client):
+    structure = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64" 4000 50 NIL NIL NIL NIL)'
+        b'("APPLICATION" "PDF" ("NAME" "invoice.pdf") NIL NIL "BASE64" 9000000 NIL ("ATTACHMENT" ("FILENAME" "invoice.pdf")) NIL NIL)'
+        b' "MIXED" ("BOUNDARY" "b1") NIL NIL NIL)'
+    )
+    headers = b"From: shop@example.com\r\nSubject: Your invoice\r\n\r\n"
+    body_prefix = base64.b64encode("Thanks for your order, the invoice is attached.".encode("utf-8"))[:30]
+    imap_client.uid.side_effect = [
+        ("OK", [(b"1 (UID 10 BODYSTRUCTURE " + structure + b" BODY[HEADER.FIELDS (FROM SUBJECT)] {49}", headers), b")"]),
+        ("OK", [(b"1 (UID 10 BODY[1]<0> {30}", body_prefix), b")"]),
+    ]
+    service.body_fetch_bytes = 30
+
+    emails = list(service.fetch_headers(["10"]))
+    assert [(email.uid, email.subject, email.body) for email in emails] == [("10", "Your invoice", "")]
+
+    bodies = list(service.fetch_partial_bodies(emails))
+
+    assert imap_client.uid.call_args_list[1].args == ("FETCH", "10", "(UID BODY.PEEK[1]<0.30>)")
+    assert bodies[0].body == "Thanks for your order"
@@ -0,0 +1,60 @@
+import pytest
+from configparser import ConfigParser
+from cache.cache import Cache, ImportanceLevel
+from cache.simhash import NearDuplicateIndex
+from mail.emailwrapper import EmailWrapper
+
+SHIPPING = (
+    "Hi {name}, good news! Your order #{order} placed on {date} has shipped and is on its way. "
+    "Track your package at https://track.example.com/{order} to see when it arrives. Estimated delivery "
+    "is within three to five business days. Thank you for shopping with us, we hope to see you again soon."
+)
+
+
+def shipping_notice(sender: str, name: str, order: int, date: str) -> EmailWrapper:
+    return EmailWrapper(f"Your order #{order} has shipped", SHIPPING.format(name=name, order=order, date=date),
+                        sender, "me@example.com", "", "<id@example.com>")
+
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = ConfigParser()
+    cfg["CACHE"] = {"cache_file": str(tmp_path / "cache.csv"), "write_buffer_size": "1"}
+    cfg["REPUTATION"] = {"reputation_enabled": "false"}
+    cfg["NEAR_DUPLICATES"] = {"near_duplicate_file": str(tmp_path / "near_duplicates.sqlite3"), "max_distance": "6"}
+    return cfg
+
+
+def test_templated_mail_reuses_the_verdict(config):
+    cache = Cache(config)
+    cache.add_record(shipping_notice("ship@shop.example", "Ann", 1041, "2026-03-01"), ImportanceLevel.MEDIUM_IMPORTANT, "")
+
+    other_copy = shipping_notice("orders@mail.shop.example", "Bob", 99817, "14/05/2026")
+    assert cache.exists(other_copy) is None
+    assert cache.near_duplicate(other_copy) == ImportanceLevel.MEDIUM_IMPORTANT
+    # The same template sent from another domain is not trusted
+    assert cache.near_duplicate(shipping_notice("ship@shop-example.top", "Bob", 99817, "14/05/2026")) is None
+    unrelated = EmailWrapper("Team offsite agenda", "Hi all, attached is the agenda for the offsite next week, "
+                             "please review the sessions and send me your comments by Friday.",
+                             "ship@shop.example", "me@example.com", "", "<id@example.com>")
+    assert cache.near_duplicate(unrelated) is None
+    assert cache.near_duplicates.stats()['hits'] == 1
+    cache.close()
+
+
+def test_short_emails_get_no_fingerprint(config):
+    index = NearDuplicateIndex(config)
+    assert index.fingerprint(EmailWrapper("Hi", "See you", "a@b.example", "", "", "")) is None
+    index.close()
+
+
+def test_changing_max_distance_rebands_stored_fingerprints(config):
+    index = NearDuplicateIndex(config)
+    fingerprint = index.fingerprint(shipping_notice("ship@shop.example", "Ann", 1041, "2026-03-01"))
+    index.record([("ship@shop.example", fingerprint, "scam")])
+    index.close()
+
+    config["NEAR_DUPLICATES"]["max_distance"] = "7"
+    index = NearDuplicateIndex(config)
+    assert index.lookup("ship@shop.example", fingerprint ^ 0b1011001) == {'importance_level': "scam", 'distance': 4}
+    index.close()
@@ -0,0 +1,88 @@
+import pytest
+from configparser import ConfigParser
+from requests.exceptions import ReadTimeout
+from llm.ollamallm.llm import LLM
+from mail.emailwrapper import EmailWrapper
+from prompt.importance_evaluator import ImportanceEvaulator
+from tests.ollamastandin import StandInOllamaServer
+
+
+@pytest.fixture
+def server():
+    standin = StandInOllamaServer()
+    standin.start()
+    yield standin
+    standin.stop()
+
+
+def make_llm(url: str, **settings) -> LLM:
+    cfg = ConfigParser()
+    cfg["OLLAMA"] = {
+        "ollama_base_url": url,
+        "connect_timeout": "1",
+        "read_timeout": "1",
+        "retry_backoff_seconds": "0.01",
+        **settings,
+    }
+    return LLM(cfg)
+
+
+def prompt() -> ImportanceEvaulator:
+    return ImportanceEvaulator(EmailWrapper("Hello", "Body", "a@b.example", "me@example.com", "", "<id@x>"))
+
+
+def test_calls_reuse_one_keep_alive_connection(server):
+    llm = make_llm(server.url)
+    for _ in range(5):
+        assert llm.generate(prompt())["importance"] == 0.5
+    assert len(server.requests) == 6
+    assert len(server.connections) == 1
+    assert llm.stats()["calls"] == 6 and llm.stats()["retries"] == 0
+    llm.close()
+
+
+def test_server_errors_and_connection_resets_are_retried(server):
+    llm = make_llm(server.url)
+    server.faults = ["error", "reset", "error"]
+    assert llm.generate(prompt())["confidence"] == 0.9
+    assert llm.stats()["retries"] == 3
+
+    server.faults = ["error"] * 4
+    with pytest.raises(Exception, match="server busy"):
+        llm.generate(prompt())
+    server.faults = ["reset"] * 2
+    with pytest.raises(Exception, match="Connection aborted"):
+        make_llm(server.url, max_retries="1")
+    assert llm.stats()["failures"] == 1
+    llm.close()
+
+
+def test_a_hung_generation_times_out_without_retrying(server):
+    llm = make_llm(server.url)
+    server.faults = ["hang"]
+    with pytest.raises(ReadTimeout):
+        llm.generate(prompt())
+    assert llm.stats()["retries"] == 0
+    # The pool replaces the dropped connection
+    assert llm.generate(prompt())["importance"] == 0.5
+    llm.close()
+
+
+def test_static_instructions_are_sent_as_the_system_prompt(server):
+    llm = make_llm(server.url)
+    other = ImportanceEvaulator(EmailWrapper("Other", "Another body", "c@d.example", "me@example.com", "", "<id2@x>"))
+    llm.generate(prompt())
+    llm.generate(other)
+    _, first = server.requests[1]
+    _, second = server.requests[2]
+    assert first["system"] == second["system"] == prompt().get_system_prompt()
+    assert first["prompt"] == prompt().get_user_prompt() and "Another body" in second["prompt"]
+    assert prompt().get_prompt() == f"{first['system']}\n\n{first['prompt']}"
+    assert first["keep_alive"] == "30m"
+    llm.close()
+
+    llm = make_llm(server.url, system_prompt="false")
+    llm.generate(prompt())
+    _, body = server.requests[-1]
+    assert "system" not in body and body["prompt"] == prompt().get_prompt()
+    llm.close()
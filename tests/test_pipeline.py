@@ -0,0 +1,115 @@
+from configparser import ConfigParser
+from threading import Event, Lock
+from time import perf_counter, sleep
+from unittest.mock import MagicMock
+from cache.cache import ImportanceLevel
+from e2e import process_mailbox
+from llm.ollamallm.llm import LLM
+from mail.imapservice import ImapService
+from pipeline import Pipeline, PipelineSettings
+from workqueue.workqueue import WorkQueue
+from tests.factories import folders, make_imap_config, raw_email
+from tests.imapstandin import StandInImapServer
+from tests.ollamastandin import StandInOllamaServer
+
+
+def make_config(tmp_path, imap_port: int, ollama_url: str) -> ConfigParser:
+    cfg = make_imap_config(tmp_path, imap_port, fetch_chunk_size="4")
+    cfg["OLLAMA"] = {"ollama_base_url": ollama_url, "pool_size": "3"}
+    cfg["QUEUE"] = {"queue_file": str(tmp_path / "queue.sqlite3")}
+    return cfg
+
+
+def test_full_queue_holds_back_the_stage_feeding_it():
+    release = Event()
+    queued = []
+    pipeline = Pipeline("test")
+    pipeline.add_stage("produce", lambda count: [pipeline.put("consume", index) for index in range(count)])
+    pipeline.add_stage("consume", lambda index: (release.wait(), queued.append(index)), queue_size=2)
+
+    with pipeline:
+        pipeline.put("produce", 10)
+        sleep(0.1)
+        # One item in the handler, two queued; the producer waits for room
+        assert pipeline.stages["consume"].queue.qsize() == 2
+        assert queued == []
+        release.set()
+
+    assert queued == list(range(10))
+
+
+def test_batches_and_failures():
+    batches = []
+    lock = Lock()
+
+    def collect(batch: list) -> None:
+        with lock:
+            batches.append(batch)
+        if 13 in batch:
+            raise ValueError("bad item")
+
+    pipeline = Pipeline("test")
+    pipeline.add_stage("collect", collect, batch_size=5, linger=0.2)
+    with pipeline:
+        pipeline.put_all("collect", range(20))
+    stats = pipeline.stats()["collect"]
+
+    assert sorted(item for batch in batches for item in batch) == list(range(20))
+    assert all(len(batch) <= 5 for batch in batches) and len(batches) < 20
+    assert stats["items"] == 20 and stats["failures"] == 1
+
+
+def test_settings_follow_the_ollama_parallelism(tmp_path):
+    cfg = make_config(tmp_path, 0, "")
+    assert PipelineSettings.from_config(cfg).llm_workers == 3
+    cfg["PIPELINE"] = {"llm_workers": "2", "queue_size": "8"}
+    settings = PipelineSettings.from_config(cfg)
+    assert (settings.llm_workers, settings.queue_size, settings.body_batch_size) == (2, 8, 4)
+
+
+def test_mailbox_is_classified_with_parallel_llm_calls(tmp_path):
+    messages = [raw_email(f"mail{index}", sender=f"sender{index}@example.com") for index in range(12)]
+    ollama = StandInOllamaServer(latency=0.1, parallel=3)
+    ollama.start()
+    try:
+        with StandInImapServer(folders(messages), latency=0.005) as imap:
+            config = make_config(tmp_path, imap.port, ollama.url)
+            llm = LLM(config)
+            work_queue = WorkQueue(config)
+            service = ImapService(config)
+            started = perf_counter()
+            process_mailbox(service, None, llm, work_queue, "INBOX", settings=PipelineSettings.from_config(config))
+            elapsed = perf_counter() - started
+            service.shutdown()
+            llm.close()
+    finally:
+        ollama.stop()
+
+    assert work_queue.counts("INBOX") == {"moved": 12}
+    assert imap.mailboxes["INBOX"] == {} and len(imap.mailboxes["Later"]) == 12
+    assert ollama.max_in_flight == 3
+    # 12 generations of 100ms one after the other would take 1.2s
+    assert elapsed < 0.9
+    work_queue.close()
+
+
+def test_pre_classified_mail_skips_the_body_fetch(tmp_path):
+    messages = [raw_email(f"mail{index}") for index in range(4)]
+    pre_classifier = MagicMock()
+    # Sure about everything but the last email
+    pre_classifier.predict.side_effect = lambda email: None if email.subject == "mail3" else (ImportanceLevel.LEAST_IMPORTANT, 0.99)
+    llm = MagicMock()
+    llm.generate.return_value = {"importance": 0.9, "confidence": 0.9, "reasoning": "A person"}
+    with StandInImapServer(folders(messages)) as imap:
+        config = make_config(tmp_path, imap.port, "")
+        work_queue = WorkQueue(config)
+        service = ImapService(config)
+        process_mailbox(service, None, llm, work_queue, "INBOX", pre_classifier, PipelineSettings.from_config(config))
+        service.shutdown()
+
+    body_fetches = [command.split(b" ", 1)[1] for command in imap.commands if b"BODY.PEEK[1]" in command]
+    assert body_fetches == [b"UID FETCH 4 (UID BODY.PEEK[1]<0.4096>)"]
+    # Asked once per email, on the headers
+    assert pre_classifier.predict.call_count == 4 and llm.generate.call_count == 1
+    assert len(imap.mailboxes["Spare"]) == 3 and len(imap.mailboxes["Important"]) == 1
+    work_queue.close()
@@ -0,0 +1,78 @@
+import pytest
+from configparser import ConfigParser
+from cache.cache import Cache, ImportanceLevel
+from cache.reputation import ReputationIndex, normalize_address, registrable_domain
+from tests.factories import email
+
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = ConfigParser()
+    cfg["CACHE"] = {"cache_file": str(tmp_path / "cache.csv"), "write_buffer_size": "1"}
+    cfg["REPUTATION"] = {
+        "reputation_file": str(tmp_path / "reputation.sqlite3"),
+        "min_samples": "3",
+        "min_agreement": "0.75",
+        "min_confidence": "0.8",
+        "shared_domains": "gmail.com",
+    }
+    cfg["NEAR_DUPLICATES"] = {"near_duplicate_file": str(tmp_path / "near_duplicates.sqlite3")}
+    return cfg
+
+
+def test_addresses_and_domains_are_normalized():
+    assert normalize_address('"Amazon" <Ship+Orders@Amazon.com>') == "ship@amazon.com"
+    assert normalize_address("Amazon.com <ship@amazon.com>") == "ship@amazon.com"
+    assert registrable_domain("news@mail.shop.example.co.uk") == "example.co.uk"
+    assert registrable_domain("a@e.newsletter.example.com") == "example.com"
+
+
+def test_a_consistent_sender_is_served_without_the_llm(config):
+    cache = Cache(config)
+    for number in range(3):
+        cache.add_record(email('"Amazon" <ship@amazon.com>', f"Order {number}"), ImportanceLevel.MEDIUM_IMPORTANT, "", 0.9)
+
+    # A differently formatted From header and an unseen address of the same domain
+    assert cache.exists(email("Amazon.com <ship@amazon.com>", "Order 99")) == ImportanceLevel.MEDIUM_IMPORTANT
+    assert cache.exists(email("deals@amazon.com", "Sale")) == ImportanceLevel.MEDIUM_IMPORTANT
+    cache.close()
+
+
+def test_mixed_or_unconfident_histories_go_to_the_llm(config):
+    reputation = ReputationIndex(config)
+    reputation.record([("a@mixed.example", "scam", 0.9), ("a@mixed.example", "scam", 0.9), ("a@mixed.example", "most_important", 0.9)])
+    reputation.record([("b@unsure.example", "scam", 0.5)] * 3)
+    reputation.record([(f"user{number}@gmail.com", "least_important", 0.99) for number in range(5)])
+
+    assert reputation.verdict("a@mixed.example") is None
+    assert reputation.verdict("b@unsure.example") is None
+    # Freemail domains are shared by unrelated people
+    assert reputation.verdict("someone.else@gmail.com") is None
+    assert reputation.verdict("user1@gmail.com") is None
+    reputation.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_a_new_index_is_seeded_from_the_cache_history(config, backend):
+    config["CACHE"]["cache_backend"] = backend
+    config["CACHE"]["cache_db_file"] = config["CACHE"]["cache_file"] + ".sqlite3"
+    config["REPUTATION"]["reputation_enabled"] = "false"
+    cache = Cache(config)
+    for number in range(3):
+        cache.add_record(email("ship@amazon.com", f"Order {number}"), ImportanceLevel.MEDIUM_IMPORTANT, "", 0.9)
+    cache.close()
+
+    config["REPUTATION"]["reputation_enabled"] = "true"
+    for _ in range(2):
+        cache = Cache(config)
+        cache.close()
+
+    # Seeded once; the cache keeps no confidences, so one confident verdict settles the history
+    reputation = ReputationIndex(config)
+    assert reputation.verdict("deals@amazon.com") is None
+    reputation.record([("ship@amazon.com", "medium_important", 0.9)])
+    assert reputation.verdict("deals@amazon.com") == {
+        "importance_level": "medium_important", "agreement": 1.0, "confidence": 0.9, "verdicts": 4,
+        "scope": "domain", "key": "amazon.com",
+    }
+    reputation.close()
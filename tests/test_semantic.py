@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from configparser import ConfigParser
+from cache.cache import Cache, ImportanceLevel
+from cache.semantic import HashingEmbedder, OllamaEmbedder, SemanticIndex
+from tests.factories import email
+from tests.ollamastandin import StandInOllamaServer
+
+
+def make_config(tmp_path, **settings) -> ConfigParser:
+    cfg = ConfigParser()
+    cfg["CACHE"] = {"cache_file": str(tmp_path / "cache.csv"), "write_buffer_size": "1"}
+    cfg["REPUTATION"] = {"reputation_enabled": "false"}
+    cfg["NEAR_DUPLICATES"] = {"near_duplicate_enabled": "false"}
+    cfg["SEMANTIC"] = {
+        "semantic_enabled": "true",
+        "semantic_file": str(tmp_path / "semantic"),
+        "embedding_backend": "hashing",
+        "min_similarity": "0.5",
+        **settings,
+    }
+    return cfg
+
+
+def unit_vectors(rng, rows: int, dimensions: int = 64) -> np.ndarray:
+    vectors = rng.standard_normal((rows, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_similar_emails_get_the_verdict_their_neighbours_agree_on(tmp_path):
+    cache = Cache(make_config(tmp_path))
+    body = "Your weekly team standup notes: project deadline moved, review the design document before the meeting."
+    for sender in ("a@work.example", "b@work.example"):
+        cache.add_record(email(sender, "Team standup notes", body), ImportanceLevel.MOST_IMPORTANT, "")
+
+    assert cache.semantic_match(email("c@work.example", "Team standup notes", body + " Thanks!")) == ImportanceLevel.MOST_IMPORTANT
+    assert cache.semantic_match(email("d@shop.example", "Huge sale", "Fifty percent off all shoes this weekend only.")) is None
+    cache.close()
+
+
+def test_the_vote_needs_agreeing_neighbours(tmp_path):
+    index = SemanticIndex(make_config(tmp_path, quantize="false", min_similarity="0.9", min_votes="2"), HashingEmbedder(ConfigParser()))
+    vectors = unit_vectors(np.random.default_rng(1), 3)
+    noise = unit_vectors(np.random.default_rng(2), 3) * 0.05
+    index.add(np.vstack([vectors[0], vectors[0] + noise[0], vectors[1], vectors[1] + noise[1], vectors[2]]),
+              ["scam", "scam", "scam", "most_important", "least_important"])
+
+    results = index.classify(np.vstack([vectors[0] + noise[2], vectors[1], vectors[2]]))
+    assert results[0]['importance_level'] == "scam" and results[0]['votes'] == 2
+    # Two close neighbours that disagree, and a single neighbour
+    assert results[1:] == [None, None]
+    index.close()
+
+
+@pytest.mark.parametrize("quantize", ["true", "false"])
+def test_the_index_grows_and_is_shared_through_the_files(tmp_path, quantize):
+    config = make_config(tmp_path, quantize=quantize, neighbours="1", min_votes="1", min_similarity="0.99")
+    embedder = HashingEmbedder(ConfigParser())
+    writer = SemanticIndex(config, embedder)
+    reader = SemanticIndex(config, embedder)
+    vectors = unit_vectors(np.random.default_rng(3), 3000)
+    levels = [("least_important", "scam")[row % 2] for row in range(3000)]
+    for start in range(0, 3000, 500):
+        writer.add(vectors[start:start + 500], levels[start:start + 500])
+
+    assert [result['importance_level'] for result in reader.classify(vectors[::7])] == levels[::7]
+    writer.close()
+    reader.close()
+    reopened = SemanticIndex(config, embedder)
+    assert reopened.stats()['entries'] == 3000
+    reopened.close()
+
+
+def test_a_different_embedding_model_starts_a_new_index(tmp_path):
+    config = make_config(tmp_path)
+    index = SemanticIndex(config)
+    index.add(index.embed([email("a@b.example", "Hello there", "General Kenobi")]), ["scam"])
+    index.close()
+
+    config["SEMANTIC"]["embedding_dimensions"] = "128"
+    index = SemanticIndex(config)
+    assert index.stats()['entries'] == 0
+    index.close()
+
+
+def test_ollama_embeddings_reuse_connections_and_retry_failures():
+    server = StandInOllamaServer()
+    server.start()
+    config = ConfigParser()
+    config["OLLAMA"] = {"ollama_base_url": server.url, "retry_backoff_seconds": "0.01"}
+    embedder = OllamaEmbedder(config)
+    try:
+        server.faults = ["error", "reset"]
+        assert embedder.embed(["a", "b"]).shape == (2, 3)
+        embedder.embed(["c"])
+    finally:
+        embedder.close()
+        server.stop()
+
+    assert len(server.requests) == 4
+    # The reset connection was replaced once; the rest reused the pooled one
+    assert len(server.connections) == 2
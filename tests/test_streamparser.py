@@ -0,0 +1,61 @@
+import os
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from mail.streamparser import StreamingBodyExtractor
+
+
+def feed_in_pieces(extractor: StreamingBodyExtractor, raw: bytes, piece_size: int = 4096) -> None:
+    for offset in range(0, len(raw), piece_size):
+        extractor.feed(raw[offset:offset + piece_size])
+        if extractor.done:
+            break
+
+
+def invoice_email(attachment_first: bool) -> bytes:
+    message = MIMEMultipart("mixed")
+    message["From"] = "billing@example.com"
+    message["Subject"] = "Your invoice"
+    alternative = MIMEMultipart("alternative")
+    alternative.attach(MIMEText("Invoice total: 42 EUR", "plain", "iso-8859-1"))
+    alternative.attach(MIMEText("<p>Invoice total: 42 EUR</p>", "html"))
+    attachment = MIMEApplication(os.urandom(2 * 1024 * 1024), "pdf")
+    attachment.add_header("Content-Disposition", "attachment", filename="invoice.pdf")
+    for part in ([attachment, alternative] if attachment_first else [alternative, attachment]):
+        message.attach(part)
+    return message.as_bytes()
+
+
+def test_stops_reading_after_the_first_text_part():
+    raw = invoice_email(attachment_first=False)
+    extractor = StreamingBodyExtractor()
+
+    feed_in_pieces(extractor, raw)
+    headers, body = extractor.close()
+
+    assert headers["Subject"] == "Your invoice"
+    assert body == "Invoice total: 42 EUR"
+    assert extractor.content_subtype == "plain"
+    assert extractor.bytes_seen < 16 * 1024
+
+
+def test_skips_attachments_without_buffering_them():
+    raw = invoice_email(attachment_first=True)
+    extractor = StreamingBodyExtractor(max_body_bytes=1024)
+
+    feed_in_pieces(extractor, raw)
+    _, body = extractor.close()
+
+    assert body == "Invoice total: 42 EUR"
+    assert extractor.bytes_seen > 2 * 1024 * 1024
+
+
+def test_body_is_capped_at_the_memory_ceiling():
+    raw = MIMEText("line of text\n" * 10_000, "plain").as_bytes()
+    extractor = StreamingBodyExtractor(max_body_bytes=1000)
+
+    feed_in_pieces(extractor, raw, piece_size=333)
+    _, body = extractor.close()
+
+    assert extractor.done
+    assert 0 < len(body) <= 1000
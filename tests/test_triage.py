@@ -0,0 +1,88 @@
+import csv
+from configparser import ConfigParser
+from random import Random
+from unittest.mock import MagicMock
+import pytest
+from cache.backends import FIELDNAMES
+from cache.cache import ImportanceLevel
+from triage.triage import PreClassifier
+from tests.factories import email
+
+SENDERS = {
+    "scam": ["support@secure-paypa1.top", "admin@account-verify.xyz"],
+    "least_important": ["deals@shop.example", "news@brand.example"],
+    "medium_important": ["orders@shop.example", "ship@parcel.example"],
+    "most_important": ["boss@work.example", "alerts@bank.example"],
+}
+SUBJECTS = {
+    "scam": ["Verify your account now", "Your account is suspended, confirm your password"],
+    "least_important": ["Weekly deals: {n}% off everything", "Last chance: sale ends tonight"],
+    "medium_important": ["Your order {n} has shipped", "Delivery scheduled for order {n}"],
+    "most_important": ["Review the Q{n} budget before Monday", "Security alert: new sign-in to your account"],
+}
+
+
+def write_cache_csv(csv_path, rows: int) -> None:
+    rng = Random(9000)
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction="ignore")
+        writer.writeheader()
+        for _ in range(rows):
+            level = rng.choice(list(SENDERS))
+            writer.writerow({
+                "sender": rng.choice(SENDERS[level]),
+                "importance_level": level,
+                "email_subject": rng.choice(SUBJECTS[level]).format(n=rng.randrange(10000)),
+            })
+
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = ConfigParser()
+    cfg["TRIAGE"] = {"triage_file": str(tmp_path / "triage_model.npz"), "min_examples": "200", "min_checked": "50"}
+    return cfg
+
+
+def test_trained_from_the_cache_it_handles_familiar_mail_and_escalates_the_rest(tmp_path, config):
+    write_cache_csv(tmp_path / "cache.csv", 1000)
+    classifier = PreClassifier(config, str(tmp_path / "cache.csv"))
+
+    assert classifier.stats()["active"] and classifier.stats()["precision"] >= 0.95
+    assert classifier.predict(email("orders@shop.example", "Your order 77 has shipped"))[0] == ImportanceLevel.MEDIUM_IMPORTANT
+    assert classifier.predict(email("Bank Alerts <alerts@bank.example>", "Security alert: new sign-in to your account"))[0] == ImportanceLevel.MOST_IMPORTANT
+    assert classifier.predict(email("someone@unknown.example", "Lunch?")) is None
+    stats = classifier.stats()
+    assert stats["predictions"] == 3 and stats["escalation_rate"] == pytest.approx(1 / 3)
+
+    # The model is saved on close and loaded instead of retraining
+    classifier.close()
+    reloaded = PreClassifier(config, str(tmp_path / "missing.csv"))
+    assert reloaded.stats()["examples"] == 1000
+    assert reloaded.predict(email("ship@parcel.example", "Delivery scheduled for order 5"))[0] == ImportanceLevel.MEDIUM_IMPORTANT
+
+
+def test_it_stays_out_of_the_way_until_it_has_proven_itself(tmp_path, config):
+    write_cache_csv(tmp_path / "cache.csv", 150)
+    classifier = PreClassifier(config, str(tmp_path / "cache.csv"))
+    assert not classifier.stats()["active"]
+    assert classifier.predict(email("orders@shop.example", "Your order 77 has shipped")) is None
+
+    # Verdicts the LLM keeps giving are learned one by one
+    for number in range(150):
+        classifier.learn(email("orders@shop.example", f"Your order {number} has shipped"), ImportanceLevel.MEDIUM_IMPORTANT)
+    assert classifier.stats()["active"]
+
+
+def test_classify_email_only_escalates_uncertain_mail(tmp_path, config):
+    from e2e import classify_email
+
+    write_cache_csv(tmp_path / "cache.csv", 1000)
+    classifier = PreClassifier(config, str(tmp_path / "cache.csv"))
+    llm = MagicMock()
+    llm.generate.return_value = {"importance": 0.9, "confidence": 0.9, "reasoning": "a person"}
+
+    assert classify_email(email("deals@shop.example", "Last chance: sale ends tonight"), None, llm, classifier) == ImportanceLevel.LEAST_IMPORTANT
+    llm.generate.assert_not_called()
+    assert classify_email(email("friend@home.example", "Dinner on Friday?"), None, llm, classifier) == ImportanceLevel.MOST_IMPORTANT
+    llm.generate.assert_called_once()
+    assert classifier.stats()["examples"] == 1001
@@ -0,0 +1,143 @@
+import pytest
+from configparser import ConfigParser
+from unittest.mock import MagicMock, patch
+from cache.cache import ImportanceLevel
+from mail.emailwrapper import EmailWrapper
+from workqueue.workqueue import WorkQueue
+
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = ConfigParser()
+    cfg["QUEUE"] = {
+        "queue_file": str(tmp_path / "work_queue.sqlite3"),
+        "max_attempts": "3",
+        "backoff_base_seconds": "60",
+    }
+    return cfg
+
+
+@pytest.fixture
+def work_queue(config):
+    queue = WorkQueue(config)
+    yield queue
+    queue.close()
+
+
+def test_failed_items_back_off_and_are_quarantined(work_queue):
+    work_queue.enqueue("INBOX", 7, ["1", "2"])
+    assert work_queue.due("INBOX", 7) == (["1", "2"], [])
+
+    with patch("workqueue.workqueue.time", return_value=1000.0):
+        work_queue.mark_failed("INBOX", 7, ["1"], "fetch failed")
+    with patch("workqueue.workqueue.time", return_value=1059.0):
+        assert work_queue.due("INBOX", 7)[0] == ["2"]
+    with patch("workqueue.workqueue.time", return_value=1060.0):
+        assert work_queue.due("INBOX", 7)[0] == ["1", "2"]
+        work_queue.mark_failed("INBOX", 7, ["1"], "fetch failed")
+    # Second failure doubles the delay
+    with patch("workqueue.workqueue.time", return_value=1179.0):
+        assert work_queue.due("INBOX", 7)[0] == ["2"]
+
+    work_queue.mark_failed("INBOX", 7, ["1"], "fetch failed")
+    assert work_queue.counts("INBOX")["quarantined"] == 1
+    with patch("workqueue.workqueue.time", return_value=10 ** 10):
+        assert work_queue.due("INBOX", 7)[0] == ["2"]
+
+
+def test_classified_items_resume_at_the_move_step(config, work_queue):
+    work_queue.enqueue("INBOX", 7, ["1", "2"])
+    work_queue.mark_classified("INBOX", 7, "1", ImportanceLevel.MOST_IMPORTANT.value)
+    work_queue.close()
+
+    reopened = WorkQueue(config)
+    assert reopened.due("INBOX", 7) == (["2"], [("1", "most_important")])
+    reopened.mark_moved("INBOX", 7, ["1"])
+    # Re-enqueueing a known UID keeps its progress
+    reopened.enqueue("INBOX", 7, ["1", "2"])
+    assert reopened.due("INBOX", 7) == (["2"], [])
+    reopened.close()
+
+
+def test_uidvalidity_change_drops_stale_items(work_queue):
+    work_queue.enqueue("INBOX", 7, ["1", "2"])
+    work_queue.enqueue("INBOX", 8, ["5"])
+    assert work_queue.due("INBOX", 7) == ([], [])
+    assert work_queue.due("INBOX", 8) == (["5"], [])
+
+
+def test_process_mailbox_only_retries_the_failed_message(work_queue):
+    from e2e import process_mailbox
+
+    def email(uid):
+        return EmailWrapper(f"subject {uid}", "", "a@example.com", "b@example.com", "", f"<{uid}@x>", uid=uid)
+
+    imap_service = MagicMock()
+    imap_service.header_first_fetch = False
+    imap_service.selected_state = {"uidvalidity": 7}
+    imap_service.fetch_email_ids.return_value = ["1", "2", "3"]
+    imap_service.fetch_emails.side_effect = lambda uids: iter([email(uid) for uid in uids if uid != "2"])
+    imap_service.move_emails.return_value = True
+
+    with patch("e2e.classify_email", return_value=ImportanceLevel.LEAST_IMPORTANT) as classify:
+        process_mailbox(imap_service, None, MagicMock(), work_queue, "INBOX")
+
+    assert classify.call_count == 2
+    imap_service.commit_sync_state.assert_called_once_with("INBOX")
+    imap_service.move_emails.assert_called_once_with(["1", "3"], ImportanceLevel.LEAST_IMPORTANT)
+    assert work_queue.counts("INBOX") == {"moved": 2, "failed": 1}
+    imap_service.fetch_email_ids.assert_called_once()
+
+
+def test_failed_message_is_retried_without_new_mail(config):
+    from e2e import process_mailbox
+
+    config["QUEUE"]["backoff_base_seconds"] = "0"
+    work_queue = WorkQueue(config)
+    imap_service = MagicMock()
+    imap_service.header_first_fetch = False
+    imap_service.selected_state = {"uidvalidity": 7}
+    imap_service.move_emails.return_value = True
+    email = EmailWrapper("subject 2", "", "a@example.com", "b@example.com", "", "<2@x>", uid="2")
+
+    work_queue.enqueue("INBOX", 7, ["2"])
+    work_queue.mark_failed("INBOX", 7, ["2"], "fetch failed")
+    assert work_queue.mailboxes_with_due_work() == {"INBOX"}
+
+    # The search finds nothing new; the failed message comes from the queue
+    imap_service.fetch_email_ids.return_value = []
+    imap_service.fetch_emails.side_effect = lambda uids: iter([email] if uids == ["2"] else [])
+    with patch("e2e.classify_email", return_value=ImportanceLevel.LEAST_IMPORTANT):
+        process_mailbox(imap_service, None, MagicMock(), work_queue, "INBOX")
+
+    imap_service.move_emails.assert_called_once_with(["2"], ImportanceLevel.LEAST_IMPORTANT)
+    assert work_queue.counts("INBOX") == {"moved": 1}
+    assert work_queue.mailboxes_with_due_work() == set()
+    work_queue.close()
+
+
+def test_errors_are_retried_but_declined_verdicts_are_not(work_queue):
+    from e2e import process_mailbox
+
+    def email(uid):
+        return EmailWrapper(f"subject {uid}", "", "a@example.com", "b@example.com", "", f"<{uid}@x>", uid=uid)
+
+    def classify(email_data, *args):
+        if email_data.uid == "1":
+            raise TimeoutError("Ollama timed out")
+        # importance or confidence <= 0
+        return None
+
+    imap_service = MagicMock()
+    imap_service.header_first_fetch = False
+    imap_service.selected_state = {"uidvalidity": 7}
+    imap_service.fetch_email_ids.return_value = ["1", "2"]
+    imap_service.fetch_emails.side_effect = lambda uids: iter([email(uid) for uid in uids])
+
+    with patch("e2e.classify_email", side_effect=classify):
+        process_mailbox(imap_service, None, MagicMock(), work_queue, "INBOX")
+
+    imap_service.move_emails.assert_not_called()
+    assert work_queue.counts("INBOX") == {"failed": 1, "skipped": 1}
+    with patch("workqueue.workqueue.time", return_value=10 ** 10):
+        assert work_queue.due("INBOX", 7) == (["1"], [])